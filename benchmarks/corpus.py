@@ -0,0 +1,178 @@
+"""
+Synthetic CorefUD corpus for the benchmarks.
+
+`write_corpus` builds random documents with udapi (dependency trees, empty nodes,
+nested and discontinuous mentions) and writes them as CoNLL-U. `add_noise` turns
+the text format of the corpus into fake LLM outputs with inserted, deleted and
+replaced words and broken mention tags. `generate` writes them into a directory:
+
+    python benchmarks/corpus.py DIR [--docs N --sentences N --words N ...]
+"""
+import os
+import random
+
+FORMS = ["el", "la", "casa", "perro", "hombre", "ciudad", "equipo", "dijo", "que", "con", "para", "Barcelona",
+         "final", "ronda", "ayer", "hoy", "de", "en", "un", "una", "grande", "nuevo", ",", "."]
+UPOS = ["DET", "NOUN", "VERB", "ADP", "PROPN", "ADJ", "PUNCT"]
+DEPRELS = ["nsubj", "obj", "obl", "det", "amod", "nmod", "punct", "conj"]
+ETYPES = ["person", "place", "organization", "object", "event"]
+
+
+def _add_mentions(rng, doc, words, depth, discontinuous, entities, seen, outer=()):
+    """
+    Adds a mention over a random span of `words` and up to `depth` - 1 mentions nested
+    in it. The entities of the `outer` mentions are not reused, so the mentions stay
+    well nested.
+    """
+    if depth <= 0 or not words:
+        return
+    start = rng.randrange(len(words))
+    span = words[start:start + rng.choice([1, 1, 2, 3, 4, 6, 8])]
+    candidates = [entity for entity in entities if entity not in outer]
+    if candidates and rng.random() < 0.6:
+        entity = rng.choice(candidates)
+    else:
+        entity = doc.create_coref_entity(eid=f"e{len(entities) + 1}", etype=rng.choice(ETYPES))
+        entities.append(entity)
+    if len(span) >= 3 and rng.random() < discontinuous:
+        span = span[:1] + span[2:]
+        depth = 1
+    if (entity.eid, tuple(span)) not in seen:
+        seen.add((entity.eid, tuple(span)))
+        entity.create_mention(words=span)
+    if len(span) > 1:
+        _add_mentions(rng, doc, span[1:], depth - 1, discontinuous, entities, seen, outer + (entity,))
+
+
+def generate_document(rng, doc_id, sentences=10, words=15, depth=3, empty_density=0.05, discontinuous=0.01):
+    """
+    Returns a random udapi document with about `sentences` sentences of about `words`
+    words. `depth` is the maximal nesting of mentions, `empty_density` the probability
+    of an empty node after a word and `discontinuous` the probability that a mention
+    has a gap.
+    """
+    from udapi.core.document import Document
+
+    doc = Document()
+    doc.meta["docname"] = doc_id
+    entities = []
+    seen = set()
+    for sentence_idx in range(max(1, round(rng.gauss(sentences, sentences / 4)))):
+        root = doc.create_bundle().create_tree()
+        root.sent_id = f"{doc_id}-s{sentence_idx + 1}"
+        if sentence_idx == 0:
+            root.newdoc = doc_id
+        nodes = []
+        for _ in range(max(1, round(rng.gauss(words, words / 3)))):
+            parent = rng.choice(nodes) if nodes else root
+            nodes.append(parent.create_child(form=rng.choice(FORMS), lemma="_", upos=rng.choice(UPOS),
+                                             deprel="root" if parent is root else rng.choice(DEPRELS)))
+        root.text = " ".join(node.form for node in nodes)
+        for node in nodes:
+            node.deps = [{"parent": node.parent, "deprel": node.deprel}]
+        for node in nodes:
+            if rng.random() < empty_density:
+                empty = node.create_empty_child("nsubj", after=True)
+                empty.form = rng.choice(["_", "él", "ella"])
+                empty.upos = "PRON"
+                if rng.random() < 0.5:
+                    _add_mentions(rng, doc, [empty], 1, 0, entities, seen)
+        # the outermost mentions do not overlap, empty nodes are inside the spans (no gaps)
+        ordered = root.descendants_and_empty
+        for chunk_start in range(0, len(ordered), 8):
+            _add_mentions(rng, doc, ordered[chunk_start:chunk_start + 8], rng.randint(1, depth), discontinuous,
+                          entities, seen)
+    return doc
+
+
+def write_corpus(filename, docs=20, seed=0, **options):
+    """Writes `docs` random documents (see `generate_document` for the options) into a CoNLL-U file."""
+    import udapi.core.coref
+
+    from text2text_coref.convert import write_data
+
+    rng = random.Random(seed)
+    with open(filename, "w", encoding="utf-8") as f:
+        for doc_idx in range(docs):
+            doc = generate_document(rng, f"bench-d{doc_idx + 1}", **options)
+            udapi.core.coref.store_coref_to_misc(doc)
+            write_data([doc], f)
+
+
+def _break_tags(rng, word):
+    form, _, tags = word.partition("|")
+    tags = tags.split(",")
+    i = rng.randrange(len(tags))
+    tags[i] = rng.choice([tags[i].strip("[]"), tags[i].replace("[", ""), tags[i].replace("]", ""),
+                          tags[i] + "|x", "[e" + tags[i], "xx"])
+    return f"{form}|{','.join(tags)}"
+
+
+def add_noise(line, rng, noise=0.05):
+    """
+    Returns the line of the text format with a fraction `noise` of the words inserted,
+    deleted, replaced or with broken tags, as in the output of an LLM.
+    """
+    out = []
+    for word in line.split(" "):
+        x = rng.random()
+        if x >= noise:
+            out.append(word)
+        elif x < noise / 4:
+            out.append(rng.choice(FORMS))
+            out.append(word)
+        elif x < noise / 2:
+            continue
+        elif x < 3 * noise / 4 or "|" not in word:
+            form, pipe, tags = word.partition("|")
+            out.append(rng.choice(FORMS) + pipe + tags)
+        else:
+            out.append(_break_tags(rng, word))
+    return " ".join(out)
+
+
+def generate(directory, docs=20, seed=0, noise=0.05, **options):
+    """
+    Writes `gold.conllu`, its text and JSON formats `gold.txt` and `gold.json` (with
+    zero mentions and sequential ids) and the noisy outputs `noisy.txt` into the
+    directory. Returns the number of tokens (words and empty nodes) of the corpus.
+    """
+    from text2text_coref.convert import convert_conllu_file_to_text
+    from text2text_coref.json_format import convert_conllu_file_to_json
+
+    os.makedirs(directory, exist_ok=True)
+    gold = os.path.join(directory, "gold.conllu")
+    write_corpus(gold, docs, seed, **options)
+    convert_conllu_file_to_text(gold, os.path.join(directory, "gold.txt"), zero_mentions=True, sequential_ids=True)
+    convert_conllu_file_to_json(gold, os.path.join(directory, "gold.json"), zero_mentions=True)
+    rng = random.Random(seed)
+    tokens = 0
+    with open(os.path.join(directory, "gold.txt"), encoding="utf-8") as f, \
+            open(os.path.join(directory, "noisy.txt"), "w", encoding="utf-8") as out:
+        for line in f:
+            line = line.rstrip("\n")
+            tokens += len(line.split(" "))
+            out.write(add_noise(line, rng, noise) + "\n")
+    return tokens
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Writes a synthetic CorefUD corpus and noisy LLM outputs")
+    parser.add_argument("directory")
+    parser.add_argument("--docs", type=int, default=20)
+    parser.add_argument("--sentences", type=int, default=10, help="Average number of sentences of a document.")
+    parser.add_argument("--words", type=int, default=15, help="Average number of words of a sentence.")
+    parser.add_argument("--depth", type=int, default=3, help="Maximal nesting depth of mentions.")
+    parser.add_argument("--empty_density", type=float, default=0.05, help="Probability of an empty node after a word.")
+    parser.add_argument("--discontinuous", type=float, default=0.01, help="Probability of a discontinuous mention.")
+    parser.add_argument("--noise", type=float, default=0.05, help="Fraction of words changed in the noisy outputs.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    tokens = generate(**vars(args))
+    print(f"{tokens} tokens written into {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Offline benchmarks of the hot paths on synthetic corpora (see `corpus.py`).
+
+Every benchmark runs in a fresh process, so that its peak memory (maximal resident
+set size) is not shared with the others. The results are printed or written as JSON:
+
+    python benchmarks/run.py [--tiers small medium] [-o results.json]
+"""
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from multiprocessing import get_context
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from corpus import generate  # noqa: E402
+
+# corpus options of the size tiers
+TIERS = {
+    "small": dict(docs=20, sentences=10, words=15),
+    "medium": dict(docs=100, sentences=20, words=20),
+    "large": dict(docs=200, sentences=40, words=25),
+}
+
+
+def _peak_memory_mb():
+    """Peak resident set size of this process in MB."""
+    # ru_maxrss of a new process starts at the peak of its parent on Linux, VmHWM does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def _conllu2text(directory):
+    from text2text_coref.convert import convert_conllu_file_to_text
+
+    convert_conllu_file_to_text(os.path.join(directory, "gold.conllu"), os.path.join(directory, "out.txt"),
+                                zero_mentions=True, sequential_ids=True)
+
+
+def _conllu2json(directory):
+    from text2text_coref.json_format import convert_conllu_file_to_json
+
+    convert_conllu_file_to_json(os.path.join(directory, "gold.conllu"), os.path.join(directory, "out.json"),
+                                zero_mentions=True)
+
+
+def _clean(directory):
+    from text2text_coref.output_cleaner import clean_file
+
+    clean_file(os.path.join(directory, "noisy.txt"), os.path.join(directory, "gold.conllu"),
+               os.path.join(directory, "clean.txt"), zero_mentions=True)
+
+
+def _edit_distance(directory):
+    from text2text_coref.output_cleaner import _word_level_edit_distance, read_conllu, read_input_file
+
+    gold_docs = read_conllu(os.path.join(directory, "gold.conllu"), True)
+    noisy_docs = [doc.split() for doc in read_input_file(os.path.join(directory, "noisy.txt"))]
+    start = time.perf_counter()
+    for words, gold in zip(noisy_docs, gold_docs):
+        _word_level_edit_distance([word.partition("|")[0] for word in words],
+                                  [word for sentence in gold for word in sentence], words, True)
+    return time.perf_counter() - start
+
+
+def _edit_distance_divergent(directory):
+    """Aligns every noisy document to the gold words of the next one, the worst case of the band."""
+    from text2text_coref.output_cleaner import _word_level_edit_distance, read_conllu, read_input_file
+
+    gold_docs = read_conllu(os.path.join(directory, "gold.conllu"), True)
+    noisy_docs = [doc.split() for doc in read_input_file(os.path.join(directory, "noisy.txt"))]
+    gold_docs = gold_docs[1:] + gold_docs[:1]
+    start = time.perf_counter()
+    for words, gold in zip(noisy_docs, gold_docs):
+        _word_level_edit_distance([word.partition("|")[0] for word in words],
+                                  [word for sentence in gold for word in sentence], words, True)
+    return time.perf_counter() - start
+
+
+def _correct_tags(directory):
+    from text2text_coref.output_cleaner import _correct_tags, read_conllu, read_input_file
+
+    gold_docs = read_conllu(os.path.join(directory, "gold.conllu"), True)
+    sentences = []
+    for doc, gold in zip(read_input_file(os.path.join(directory, "noisy.txt")), gold_docs):
+        words = doc.split()
+        offset = 0
+        for gold_sentence in gold:
+            sentences.append(words[offset:offset + len(gold_sentence)])
+            offset += len(gold_sentence)
+    start = time.perf_counter()
+    for sentence in sentences:
+        _correct_tags(sentence)
+    return time.perf_counter() - start
+
+
+def _text2conllu(directory):
+    from text2text_coref.convert import convert_text_file_to_conllu
+
+    convert_text_file_to_conllu(os.path.join(directory, "gold.txt"), os.path.join(directory, "gold.conllu"),
+                                os.path.join(directory, "out.conllu"), zero_mentions=True)
+
+
+def _json2conllu(directory):
+    from text2text_coref.json_format import convert_json_to_conllu
+
+    convert_json_to_conllu(os.path.join(directory, "gold.json"), os.path.join(directory, "gold.conllu"),
+                           os.path.join(directory, "out.conllu"), use_gold_empty_nodes=True)
+
+
+BENCHMARKS = {
+    "conllu2text": _conllu2text,
+    "conllu2json": _conllu2json,
+    "clean": _clean,
+    "clean._word_level_edit_distance": _edit_distance,
+    "clean._word_level_edit_distance.divergent": _edit_distance_divergent,
+    "clean._correct_tags": _correct_tags,
+    "text2conllu": _text2conllu,
+    "json2conllu": _json2conllu,
+}
+
+
+def _run_benchmark(name, directory):
+    """
+    Runs the benchmark in this (fresh) process and returns its time, peak memory and
+    the number of documents read or merged by udapi instead of the fast paths.
+    """
+    from text2text_coref import stats
+
+    # the logging of the progress and of the problems found would be timed as well
+    logging.disable(logging.WARNING)
+    # the fallbacks are marked in the records of the documents
+    stats.enable(name)
+    start = time.perf_counter()
+    seconds = BENCHMARKS[name](directory)
+    if seconds is None:
+        seconds = time.perf_counter() - start
+    fallbacks = sum(1 for record in stats.report()["documents"] if record.get("udapi"))
+    return seconds, _peak_memory_mb(), fallbacks
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(tiers, benchmarks=None, seed=0, noise=0.05, **options):
+    """Runs the benchmarks on the corpora of the tiers and returns the report."""
+    results = []
+    context = get_context("spawn")
+    for tier in tiers:
+        with tempfile.TemporaryDirectory() as directory:
+            tokens = generate(directory, seed=seed, noise=noise, **{**TIERS[tier], **options})
+            for name in BENCHMARKS:
+                if benchmarks and name not in benchmarks:
+                    continue
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    seconds, peak_memory, fallbacks = executor.submit(_run_benchmark, name, directory).result()
+                results.append({
+                    "tier": tier,
+                    "benchmark": name,
+                    "tokens": tokens,
+                    "seconds": round(seconds, 4),
+                    "tokens_per_second": round(tokens / seconds) if seconds else None,
+                    "peak_memory_mb": round(peak_memory, 1),
+                    "udapi_fallbacks": fallbacks,
+                })
+                print(f"{tier:<8} {name:<44} {seconds:9.3f} s {tokens / seconds:12.0f} tokens/s "
+                      f"{peak_memory:8.1f} MB {fallbacks:6d} udapi", file=sys.stderr)
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": seed,
+        "noise": noise,
+        "options": options,
+        "results": results,
+    }
+
+
+def main():
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description="Benchmarks of text2text_coref on synthetic corpora")
+    parser.add_argument("--tiers", nargs="+", choices=list(TIERS), default=["small", "medium"])
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=None,
+                        help="Run only these benchmarks.")
+    parser.add_argument("--depth", type=int, default=3, help="Maximal nesting depth of mentions.")
+    parser.add_argument("--empty_density", type=float, default=0.05, help="Probability of an empty node after a word.")
+    parser.add_argument("--discontinuous", type=float, default=0.01, help="Probability of a discontinuous mention.")
+    parser.add_argument("--noise", type=float, default=0.05, help="Fraction of words changed in the noisy outputs.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output_filename", default=None, help="Write the JSON report into the file.")
+    args = parser.parse_args()
+    output_filename = args.output_filename
+    del args.output_filename
+    report = run(**vars(args))
+    if output_filename:
+        with open(output_filename, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,2 +1,20 @@
-from .convert import convert_text_file_to_conllu, convert_conllu_file_to_text
-from .output_cleaner import clean_file
+# the subsystems are imported on first use, `import text2text_coref` stays cheap
+_EXPORTS = {
+    "convert_text_file_to_conllu": "convert",
+    "convert_conllu_file_to_text": "convert",
+    "clean_file": "output_cleaner",
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib import import_module
+
+    value = getattr(import_module(f".{_EXPORTS[name]}", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted([*globals(), *_EXPORTS])
@@ -1,11 +1,11 @@
 import logging
 
-from .convert import convert_text_file_to_conllu, convert_conllu_file_to_text
-from .output_cleaner import clean_file
+from . import stats
 
 
 def parse_args():
     from argparse import ArgumentParser
+    from .doc_index import parse_shard
     main_parser = ArgumentParser(prog="text2text_coref",
                                  description="Coreference resolution plaintext convertor",)
     subparsers = main_parser.add_subparsers(required=True, dest='action')
@@ -25,6 +25,51 @@ def parse_args():
         action="store_true",
         help="Map zero mentions in the output to the gold empty nodes in CoNLLu.",
     )
+    parser.add_argument(
+        "-a",
+        "--anchors",
+        action="store_true",
+        help="Split documents on unique matching words and align only the parts between them (faster, "
+             "the alignment may differ from the full one).",
+    )
+    parser.add_argument(
+        "-e",
+        "--engine",
+        choices=["python", "numpy"],
+        default="python",
+        help="Implementation of the word alignment, numpy is much faster for documents with many edits.",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes cleaning the documents in parallel.",
+    )
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Read, clean and write one document at a time to keep the memory usage low.",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory of the on-disk cache of preprocessed skeleton files and of cleaned documents, "
+             "only the documents not cleaned before are cleaned again (disabled by default).",
+    )
+    parser.add_argument(
+        "--chunks",
+        default=None,
+        metavar="FILE",
+        help="Chunk metadata written by conllu2text --max_tokens, the lines are chunks cleaned separately and "
+             "merged into documents (not with --stream).",
+    )
+    parser.add_argument(
+        "--strict",
+        action="store_true",
+        help="Stop at a document which fails to clean instead of replacing it by its gold words without entities "
+             "(logged and counted as failed_documents).",
+    )
 
     conllu2text_parser = subparsers.add_parser(
         "conllu2text",
@@ -62,6 +107,33 @@ def parse_args():
         help="Do not include empty node forms in the output text.",
     )
 
+    conllu2text_parser.add_argument(
+        "--udapi_reader",
+        action="store_true",
+        help="Read all documents with udapi instead of the faster built-in reader.",
+    )
+    conllu2text_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes converting the documents in parallel.",
+    )
+    conllu2text_parser.add_argument(
+        "--max_tokens",
+        type=int,
+        default=None,
+        help="Split documents into chunks of whole sentences of at most this many words, one chunk per line, "
+             "described in OUTPUT.chunks.jsonl.",
+    )
+    conllu2text_parser.add_argument(
+        "--overlap",
+        type=int,
+        default=0,
+        help="Number of sentences shared by consecutive chunks, their mentions link the entities of the chunks "
+             "when they are merged.",
+    )
+
     text2conllu_parser = subparsers.add_parser(
         "text2conllu",
         prog="text2conll_convertor",
@@ -77,6 +149,22 @@ def parse_args():
         action="store_true",
         help="Map zero mentions in the output to the gold empty nodes in CoNLLu.",
     )
+    text2conllu_parser.add_argument(
+        "--udapi_writer",
+        action="store_true",
+        help="Merge all documents into the skeleton with udapi instead of the faster built-in writer.",
+    )
+    text2conllu_parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory of the on-disk cache of preprocessed skeleton files, used by --udapi_writer (disabled by default).",
+    )
+    text2conllu_parser.add_argument(
+        "--chunks",
+        default=None,
+        metavar="FILE",
+        help="Chunk metadata written by conllu2text --max_tokens, the lines are chunks merged into documents.",
+    )
 
     conllu2json_parser = subparsers.add_parser(
         "conllu2json",
@@ -113,6 +201,24 @@ def parse_args():
         help="Do not include empty node forms in the output text.",
     )
 
+    conllu2json_parser.add_argument(
+        "--udapi_reader",
+        action="store_true",
+        help="Read all documents with udapi instead of the faster built-in reader.",
+    )
+    conllu2json_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of processes converting the documents in parallel.",
+    )
+    conllu2json_parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Write JSON Lines (one document per line) as the documents are converted.",
+    )
+
     json2conllu_parser = subparsers.add_parser(
         "json2conllu",
         prog="json2conllu_convertor",
@@ -127,6 +233,98 @@ def parse_args():
         action="store_true",
         help="Use gold empty nodes from the skeleton CoNLLu file.",
     )
+    json2conllu_parser.add_argument(
+        "--udapi_writer",
+        action="store_true",
+        help="Merge all documents into the skeleton with udapi instead of the faster built-in writer.",
+    )
+    json2conllu_parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory of the on-disk cache of preprocessed skeleton files, used by --udapi_writer (disabled by default).",
+    )
+    json2conllu_parser.add_argument(
+        "--jsonl",
+        action="store_true",
+        help="Read the predictions as JSON Lines (one document per line) one document at a time.",
+    )
+
+    serve_parser = subparsers.add_parser(
+        "serve",
+        prog="text2text_coref_server",
+        help="loads skeleton/gold conllu files once and answers JSON line requests per document"
+    )
+    serve_parser.add_argument("skeleton_filenames", nargs="+")
+    serve_parser.add_argument(
+        "--socket",
+        default=None,
+        metavar="PATH",
+        help="Listen on a Unix socket instead of reading the requests from stdin.",
+    )
+
+    for subparser in (text2conllu_parser, json2conllu_parser):
+        subparser.add_argument(
+            "-j",
+            "--jobs",
+            type=int,
+            default=1,
+            help="Number of processes merging the documents in parallel (with --batch).",
+        )
+
+    for subparser in (parser, conllu2text_parser, text2conllu_parser, conllu2json_parser, json2conllu_parser):
+        subparser.add_argument(
+            "--batch",
+            action="store_true",
+            help="The input is a directory or a glob of files and the other file names (the gold/skeleton file, "
+                 "-o) are templates filled for every input with {stem}, {name} and {dir}; the documents of all "
+                 "files are processed by one pool of --jobs processes, the largest first.",
+        )
+        subparser.add_argument(
+            "--summary",
+            default=None,
+            metavar="FILE",
+            help="With --batch, write the per-file summary (documents, words, ...) as JSON.",
+        )
+
+    merge_parser = subparsers.add_parser(
+        "merge",
+        prog="shard_merger",
+        help="joins the outputs of the shards of a command run with --shard in order"
+    )
+    merge_parser.add_argument("filenames", nargs="+")
+    merge_parser.add_argument(
+        "-o",
+        "--output_filename",
+        required=True,
+        help="Merged output, the documents of .json files are joined into one list and the documents of "
+             ".chunks.jsonl metadata are renumbered, other files are concatenated.",
+    )
+
+    for subparser in (parser, conllu2text_parser, text2conllu_parser, conllu2json_parser, json2conllu_parser):
+        subparser.add_argument(
+            "--shard",
+            type=parse_shard,
+            default=None,
+            metavar="i/N",
+            help="Process only the i-th of N contiguous parts of the documents of the CoNLL-U file, located by "
+                 "its document index FILE.idx (built on the first use); the other inputs are the documents of "
+                 "the part. The outputs of the parts are joined by the merge command.",
+        )
+
+    for subparser in (parser, conllu2text_parser, text2conllu_parser, conllu2json_parser, json2conllu_parser,
+                      serve_parser, merge_parser):
+        subparser.add_argument(
+            "--stats",
+            default=None,
+            metavar="FILE",
+            help="Write a JSON report with the time of every stage, per-document metrics and the peak memory.",
+        )
+        subparser.add_argument(
+            "--log_level",
+            default="INFO",
+            choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+            help="Level of the logged messages, DEBUG adds a one-line summary of every document with problems.",
+        )
 
     return main_parser.parse_args()
 
@@ -134,17 +332,53 @@ def parse_args():
 def main():
     args = parse_args()
     logging.basicConfig(
-        level=logging.DEBUG,
+        level=args.log_level,
         format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
         datefmt="%m/%d/%Y %H:%M:%S",
     )
+    stats_filename = args.stats
+    del args.stats, args.log_level
+    if stats_filename:
+        stats.enable(args.action)
+    try:
+        run(args)
+    finally:
+        from . import diagnostics
+
+        diagnostics.log_summary()
+        if stats_filename:
+            stats.write(stats_filename)
+
+
+def run(args):
+    # only the modules of the subcommand are imported
+    if getattr(args, "batch", False):
+        from .batch import run_batch
+        del args.batch
+        run_batch(**vars(args))
+        return
+    if hasattr(args, "batch"):
+        del args.batch
+        if args.summary:
+            raise ValueError("--summary requires --batch")
+        del args.summary
+    if args.action in ("text2conllu", "json2conllu"):
+        if args.jobs > 1:
+            logging.warning("--jobs is used only with --batch")
+        del args.jobs
+        if args.cache_dir and not args.udapi_writer:
+            # the built-in writer merges the skeleton line by line, there is nothing to cache
+            raise ValueError("--cache_dir requires --udapi_writer")
     if args.action == "clean":
+        from .output_cleaner import clean_file
         del args.action
         clean_file(**vars(args))
     elif args.action == "text2conllu":
+        from .convert import convert_text_file_to_conllu
         del args.action
         convert_text_file_to_conllu(**vars(args))
     elif args.action == "conllu2text":
+        from .convert import convert_conllu_file_to_text
         del args.action
         convert_conllu_file_to_text(**vars(args))
     elif args.action == "conllu2json":
@@ -155,6 +389,14 @@ def main():
         from .json_format import convert_json_to_conllu
         del args.action
         convert_json_to_conllu(**vars(args))
+    elif args.action == "serve":
+        from .server import serve
+        del args.action
+        serve(**vars(args))
+    elif args.action == "merge":
+        from .doc_index import merge_files
+        del args.action
+        merge_files(**vars(args))
 
 
 
@@ -0,0 +1,156 @@
+"""
+In-memory API of the converters and of the cleaner.
+
+The functions take and return Python objects instead of file names: lines of the
+text format, JSON documents (dicts), CoNLL-U strings or udapi documents. A gold or
+skeleton CoNLL-U file is loaded once into a `Skeleton` and reused by any number of
+calls:
+
+    skeleton = Skeleton.from_file("dev.conllu")
+    cleaned = clean(llm_outputs, skeleton, zero_mentions=True)
+    conllu = text_to_conllu(cleaned, skeleton, zero_mentions=True)
+
+The problems found in the documents are counted by `diagnostics`,
+`diagnostics.log_summary()` logs their totals and starts a new run.
+"""
+import io
+from functools import partial
+
+from .convert import (document_to_text, fast_document_to_text, iter_converted_documents, merge_into_skeleton,
+                      merge_text_into_udapi, read_data, write_data)
+from .fast_reader import document_source, iter_document_blocks
+from .output_cleaner import clean_data, iter_conllu
+from .skeleton_merge import merge_json_document, merge_text_document
+
+
+class Skeleton:
+    """
+    Gold/skeleton CoNLL-U documents loaded once. The sentence blocks of the documents
+    are kept in memory, the gold words of the cleaner are computed on first use and
+    every call merging predictions gets its own copy of the documents.
+    """
+
+    __slots__ = ["documents", "_gold"]
+
+    def __init__(self, documents):
+        # (blocks, global_entity) of every document, see fast_reader.iter_document_blocks
+        self.documents = documents
+        self._gold = {}
+
+    @classmethod
+    def from_file(cls, filename):
+        return cls(list(iter_document_blocks(filename)))
+
+    @classmethod
+    def from_string(cls, conllu):
+        return cls(list(iter_document_blocks(io.StringIO(conllu.lstrip("\ufeff")))))
+
+    def __len__(self):
+        return len(self.documents)
+
+    def source(self):
+        """The CoNLL-U of the documents, every document with its global.Entity declaration."""
+        return "".join(document_source(blocks, global_entity) for blocks, global_entity in self.documents)
+
+    def udapi_documents(self):
+        """New udapi documents read from the skeleton (after MoveHead and SingleParent)."""
+        return read_data(io.StringIO(self.source()))
+
+    def gold(self, zero_mentions):
+        """The gold words in the structure of `output_cleaner.read_conllu`."""
+        if zero_mentions not in self._gold:
+            self._gold[zero_mentions] = list(iter_conllu(io.StringIO(self.source()), zero_mentions))
+        return self._gold[zero_mentions]
+
+
+def _conllu_input(conllu):
+    if isinstance(conllu, Skeleton):
+        return io.StringIO(conllu.source())
+    return io.StringIO(conllu)
+
+
+def _convert(conllu, convert, convert_fast, udapi_reader, jobs):
+    """Converts a CoNLL-U string, a Skeleton or a list of udapi documents."""
+    if isinstance(conllu, list):
+        return [convert(doc) for doc in conllu]
+    return list(iter_converted_documents(_conllu_input(conllu), convert, convert_fast, udapi_reader, jobs))
+
+
+def _write(udapi_docs):
+    f = io.StringIO()
+    write_data(udapi_docs, f)
+    return f.getvalue()
+
+
+def conllu_to_text(conllu, zero_mentions=False, blind=False, sequential_ids=False, empty_node_form=True,
+                   udapi_reader=False, jobs=1):
+    """
+    Returns the lines of the text format of a CoNLL-U string, a Skeleton or a list of
+    udapi documents (which are modified by the conversion), like `conllu2text`.
+    """
+    options = dict(solve_empty_nodes=zero_mentions, mark_entities=not blind, sequential_ids=sequential_ids,
+                   empty_node_form=empty_node_form)
+    return _convert(conllu, partial(document_to_text, **options), partial(fast_document_to_text, **options),
+                    udapi_reader, jobs)
+
+
+def conllu_to_json(conllu, zero_mentions=False, blind=False, sequential_ids=False, empty_node_form=True,
+                   udapi_reader=False, jobs=1):
+    """The same as `conllu_to_text` for the documents of the JSON format."""
+    from .json_format import document_to_json, fast_document_to_json
+
+    options = dict(solve_empty_nodes=zero_mentions, mark_entities=not blind, sequential_ids=sequential_ids,
+                   empty_node_form=empty_node_form)
+    return _convert(conllu, partial(document_to_json, **options), partial(fast_document_to_json, **options),
+                    udapi_reader, jobs)
+
+
+def clean(docs, gold, zero_mentions=True, anchors=False, engine="python", jobs=1, cache_dir=None, strict=False):
+    """
+    Cleans the lines of the text format (any iterable) against a Skeleton or gold
+    words already in the structure of `output_cleaner.read_conllu`, like `clean`.
+    """
+    if isinstance(gold, Skeleton):
+        gold = gold.gold(zero_mentions)
+    return clean_data(list(docs), gold, gold_zeros=zero_mentions, anchors=anchors, engine=engine, jobs=jobs,
+                      cache_dir=cache_dir, strict=strict)
+
+
+def text_to_udapi(docs, skeleton, zero_mentions=False):
+    """Merges the lines of the text format into new udapi documents of the Skeleton."""
+    docs = list(docs)
+    udapi_docs = skeleton.udapi_documents()
+    assert len(udapi_docs) == len(docs)
+    for text, udapi_doc in zip(docs, udapi_docs):
+        merge_text_into_udapi(text, udapi_doc, zero_mentions)
+    return udapi_docs
+
+
+def text_to_conllu(docs, skeleton, zero_mentions=False, udapi_writer=False):
+    """Merges the lines of the text format (any iterable) into the Skeleton and returns the CoNLL-U, like `text2conllu`."""
+    if udapi_writer:
+        return _write(text_to_udapi(docs, skeleton, zero_mentions))
+    return "".join(merge_into_skeleton(docs, skeleton.documents, merge_text_document, merge_text_into_udapi,
+                                       zero_mentions))
+
+
+def json_to_udapi(docs, skeleton, use_gold_empty_nodes=True):
+    """Merges the documents of the JSON format into new udapi documents of the Skeleton."""
+    from .json_format import merge_json_into_udapi
+
+    docs = list(docs)
+    udapi_docs = skeleton.udapi_documents()
+    assert len(udapi_docs) == len(docs)
+    for doc, udapi_doc in zip(docs, udapi_docs):
+        merge_json_into_udapi(doc, udapi_doc, use_gold_empty_nodes)
+    return udapi_docs
+
+
+def json_to_conllu(docs, skeleton, use_gold_empty_nodes=True, udapi_writer=False):
+    """The same as `text_to_conllu` for the documents of the JSON format, like `json2conllu`."""
+    from .json_format import merge_json_into_udapi
+
+    if udapi_writer:
+        return _write(json_to_udapi(docs, skeleton, use_gold_empty_nodes))
+    return "".join(merge_into_skeleton(docs, skeleton.documents, merge_json_document, merge_json_into_udapi,
+                                       use_gold_empty_nodes))
@@ -0,0 +1,337 @@
+"""
+Batch mode of the commands (`--batch`) over many files, e.g. all treebanks of a
+CorefUD release, in one process.
+
+The input of the command is a directory (its files with the suffix of the input,
+recursively) or a glob, the other file arguments are templates filled for every
+input file with `{stem}` (the name without the suffix), `{name}` and `{dir}`. The
+gold/skeleton template may be a glob matching one file:
+
+    clean --batch 'pred/*.txt' 'gold/**/{stem}.conllu' -o 'out/{stem}-cleaned.txt' -j 32
+
+The documents of all files are processed by one process pool, the largest first,
+so that the workers stay busy until the end instead of waiting for the largest
+file. The workers read the CoNLL-U documents directly through the document index
+(see `doc_index`). The output of a file is written as soon as all its documents
+are done and a summary of the files is logged at the end (and written to
+`--summary FILE` as JSON).
+"""
+import gc
+import glob
+import io
+import json
+import logging
+import os
+from collections import Counter
+from functools import partial
+
+from . import stats
+from .compression import SUFFIXES, open_file, split_suffix
+from .doc_index import DocumentIndex
+from .fast_reader import iter_document_blocks
+
+logger = logging.getLogger()
+
+# CoNLL-U lines (or words for clean) of the documents processed by one task
+CHUNK_SIZE = 2000
+
+_indexes = {}
+
+
+def expand_inputs(pattern, suffix):
+    """The input files, the files with the suffix in a directory (recursively) or the files matching a glob."""
+    if os.path.isdir(pattern):
+        filenames = [filename for compression in ("", *SUFFIXES)
+                     for filename in glob.glob(os.path.join(pattern, "**", f"*{suffix}{compression}"), recursive=True)]
+    else:
+        filenames = glob.glob(pattern, recursive=True)
+    if not filenames:
+        raise ValueError(f"no input files match {pattern}")
+    return sorted(filenames)
+
+
+def fill(template, filename):
+    """
+    Fills `{stem}`, `{name}` and `{dir}` of the template with the parts of the input file name,
+    the stem is without the compression suffix (`dev.conllu.gz` -> `dev`).
+    """
+    name = os.path.basename(filename)
+    return template.format(stem=os.path.splitext(split_suffix(name)[0])[0], name=name, dir=os.path.dirname(filename))
+
+
+def find_file(template, filename):
+    """The existing file of the filled template, which may be a glob matching one file (e.g. `gold/**/{stem}.conllu`)."""
+    path = fill(template, filename)
+    if os.path.exists(path) or not glob.has_magic(path):
+        return path
+    matches = glob.glob(path, recursive=True)
+    if len(matches) != 1:
+        raise ValueError(f"{len(matches)} files match {path} (for {filename})")
+    return matches[0]
+
+
+def _index(filename):
+    # every process loads the index of a file once
+    if filename not in _indexes:
+        _indexes[filename] = DocumentIndex.load(filename)
+    return _indexes[filename]
+
+
+def _read_document(filename, k):
+    """The blocks of document k of the CoNLL-U file and the global.Entity declaration it inherits."""
+    index = _index(filename)
+    blocks, _ = next(iter_document_blocks(io.StringIO(index.read(k))))
+    return blocks, index.global_entity(k)
+
+
+def _sizes(filename, zero_mentions=True):
+    """Numbers of words (with the empty nodes if `zero_mentions`) of the documents of the CoNLL-U file."""
+    index = _index(filename)
+    return [index.tokens[k] + (index.empty_nodes[k] if zero_mentions else 0) for k in range(len(index))]
+
+
+def _schedule(tasks, work, jobs, finish):
+    """
+    Processes the tasks of all files, `tasks` are lists of (task, size) of every file.
+    `work(chunk)` returns the results of a chunk of tasks and the stats of the process,
+    `finish(i, results)` is called with the results of file i as soon as they are all done.
+    The largest tasks are processed first, small ones are grouped into chunks.
+    """
+    ordered = sorted(((size, i, j) for i, file_tasks in enumerate(tasks) for j, (_, size) in enumerate(file_tasks)),
+                     key=lambda item: -item[0])
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for size, i, j in ordered:
+        chunk.append((i, j))
+        chunk_size += size
+        if chunk_size >= CHUNK_SIZE:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        chunks.append(chunk)
+
+    results = [[None] * len(file_tasks) for file_tasks in tasks]
+    remaining = [len(file_tasks) for file_tasks in tasks]
+    def collect(chunk, chunk_results, chunk_stats):
+        stats.merge(chunk_stats)
+        for (i, j), result in zip(chunk, chunk_results):
+            results[i][j] = result
+            remaining[i] -= 1
+            if not remaining[i]:
+                finish(i, results[i])
+                results[i] = tasks[i] = None
+
+    # the udapi reader collects the garbage after every document, the tasks are not traversed
+    # (nor copied by the forked workers touching them) until the batch is done
+    gc.freeze()
+    try:
+        for i, count in enumerate(remaining):
+            if not count:
+                finish(i, [])
+        if jobs > 1:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+
+            with ProcessPoolExecutor(max_workers=jobs, initializer=stats.init_worker,
+                                     initargs=(stats.enabled(),)) as executor:
+                futures = {executor.submit(work, [tasks[i][j][0] for i, j in chunk]): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    collect(futures.pop(future), *future.result())
+        else:
+            for chunk in chunks:
+                collect(chunk, *work([tasks[i][j][0] for i, j in chunk]))
+    finally:
+        gc.unfreeze()
+
+
+def _convert_documents(chunk, convert, convert_fast, udapi_reader):
+    from .convert import convert_document
+
+    return [convert_document(*_read_document(filename, k), convert, convert_fast, udapi_reader)
+            for filename, k in chunk], stats.take()
+
+
+def _clean_documents(chunk, gold_zeros, anchors, engine, cache_dir, strict):
+    from .output_cleaner import _try_clean_document, iter_conllu
+
+    results = []
+    for doc, filename, k in chunk:
+        gold_doc = next(iter_conllu(io.StringIO(_index(filename).read(k)), gold_zeros))
+        tiers = Counter()
+        clean = _try_clean_document(k, doc, gold_doc, gold_zeros, anchors, tiers, engine, cache_dir, strict)
+        results.append((clean, next(iter(tiers))))
+    return results, stats.take()
+
+
+def _merge_documents(chunk, merge, merge_udapi, use_gold_empty_nodes):
+    from .convert import merge_into_skeleton
+
+    outputs = merge_into_skeleton([doc for doc, _, _ in chunk],
+                                  [_read_document(filename, k) for _, filename, k in chunk],
+                                  merge, merge_udapi, use_gold_empty_nodes)
+    return list(outputs), stats.take()
+
+
+def _unsupported(**options):
+    for name, value in options.items():
+        if value:
+            raise ValueError(f"--{name} is not supported with --batch")
+
+
+def _run(action, inputs, outputs, sizes, tasks, work, jobs, write, summary):
+    """Schedules the tasks of all files, writes their outputs and logs the summary."""
+    files = []
+
+    def finish(i, results):
+        os.makedirs(os.path.dirname(outputs[i]) or ".", exist_ok=True)
+        with stats.stage("write"):
+            details = write(outputs[i], results)
+        files.append({"input": inputs[i], "output": outputs[i], "documents": len(results), "words": sum(sizes[i]),
+                      **details})
+        logger.info(f"Wrote {outputs[i]} ({len(files)}/{len(inputs)} files)")
+
+    logger.info(f"{action}: {sum(map(len, tasks))} documents of {len(inputs)} files, {jobs} jobs")
+    _schedule(tasks, work, jobs, finish)
+    files.sort(key=lambda file: inputs.index(file["input"]))
+    for file in files:
+        details = ", ".join(f"{key} {value}" for key, value in file.items() if key not in ("input", "output"))
+        logger.info(f"{file['input']} -> {file['output']}: {details}")
+    logger.info(f"Total: {len(files)} files, {sum(file['documents'] for file in files)} documents, "
+                f"{sum(file['words'] for file in files)} words")
+    if summary:
+        with open(summary, "w", encoding="utf-8") as f:
+            json.dump(files, f, indent=2, ensure_ascii=False)
+
+
+def _write_lines(filename, lines):
+    with open_file(filename, "w") as f:
+        for line in lines:
+            f.write(line + "\n")
+
+
+def _convert(action, filename, output_filename, zero_mentions, blind=False, sequential_ids=True,
+             no_empty_node_form=False, udapi_reader=False, jobs=1, jsonl=False, summary=None, max_tokens=None,
+             overlap=0, shard=None):
+    """`conllu2text` and `conllu2json` of every CoNLL-U file."""
+    _unsupported(max_tokens=max_tokens, shard=shard)
+    if action == "conllu2text":
+        from .convert import document_to_text as convert, fast_document_to_text as convert_fast
+        suffix = ".txt"
+    else:
+        from .json_format import document_to_json as convert, fast_document_to_json as convert_fast
+        suffix = ".jsonl" if jsonl else ".json"
+    options = dict(solve_empty_nodes=zero_mentions, mark_entities=not blind, sequential_ids=sequential_ids,
+                   empty_node_form=not no_empty_node_form)
+    inputs = expand_inputs(filename, ".conllu")
+    outputs = [fill(output_filename, name) if output_filename else name.replace(".conllu", suffix) for name in inputs]
+    with stats.stage("index"):
+        sizes = [_sizes(name, zero_mentions) for name in inputs]
+    tasks = [[((name, k), size) for k, size in enumerate(file_sizes)] for name, file_sizes in zip(inputs, sizes)]
+
+    def write(output, results):
+        if action == "conllu2text":
+            _write_lines(output, [result for result, _ in results])
+        elif jsonl:
+            from .json_format import write_json_lines
+            write_json_lines([result for result, _ in results], output)
+        else:
+            from .json_format import write_json
+            write_json([result for result, _ in results], output)
+        return {"udapi": sum(fallback for _, fallback in results)}
+
+    work = partial(_convert_documents, convert=partial(convert, **options),
+                   convert_fast=partial(convert_fast, **options), udapi_reader=udapi_reader)
+    _run(action, inputs, outputs, sizes, tasks, work, jobs, write, summary)
+
+
+def _clean(filename, gold_filename, output_filename=None, zero_mentions=True, anchors=False, engine="python", jobs=1,
+           stream=False, cache_dir=None, chunks=None, shard=None, summary=None, strict=False):
+    """`clean` of every prediction file against its gold file."""
+    from .output_cleaner import _log_tiers, read_input_file
+
+    _unsupported(stream=stream, chunks=chunks, shard=shard)
+    inputs = expand_inputs(filename, ".txt")
+    outputs = [fill(output_filename, name) if output_filename else name.replace(".txt", "-cleaned.txt")
+               for name in inputs]
+    tasks = []
+    sizes = []
+    with stats.stage("read_input"):
+        for name in inputs:
+            gold = find_file(gold_filename, name)
+            docs = read_input_file(name)
+            file_sizes = _sizes(gold, zero_mentions)
+            assert len(docs) == len(file_sizes), f"{name} has {len(docs)} documents, {gold} {len(file_sizes)}"
+            tasks.append([((doc, gold, k), size) for k, (doc, size) in enumerate(zip(docs, file_sizes))])
+            sizes.append(file_sizes)
+    all_tiers = Counter()
+
+    def write(output, results):
+        _write_lines(output, [clean for clean, _ in results])
+        tiers = Counter(tier for _, tier in results)
+        all_tiers.update(tiers)
+        return {"tiers": dict(tiers)}
+
+    work = partial(_clean_documents, gold_zeros=zero_mentions, anchors=anchors, engine=engine, cache_dir=cache_dir,
+                   strict=strict)
+    _run("clean", inputs, outputs, sizes, tasks, work, jobs, write, summary)
+    _log_tiers(all_tiers, cache_dir)
+
+
+def _merge(action, filename, skeleton_filename, output_filename, use_gold_empty_nodes, udapi_writer=False,
+           cache_dir=None, jobs=1, jsonl=False, summary=None, chunks=None, shard=None):
+    """
+    `text2conllu` and `json2conllu` of every prediction file into its skeleton (`cache_dir`
+    is used only by the udapi writer, neither is supported in batch mode).
+    """
+    _unsupported(udapi_writer=udapi_writer, cache_dir=cache_dir, chunks=chunks, shard=shard)
+    if action == "text2conllu":
+        from .convert import merge_text_into_udapi as merge_udapi
+        from .skeleton_merge import merge_text_document as merge
+        suffix = ".txt"
+    else:
+        from .json_format import merge_json_into_udapi as merge_udapi
+        from .skeleton_merge import merge_json_document as merge
+        suffix = ".jsonl" if jsonl else ".json"
+    inputs = expand_inputs(filename, suffix)
+    outputs = [fill(output_filename, name) if output_filename else name.replace(suffix, ".conllu") for name in inputs]
+    tasks = []
+    sizes = []
+    with stats.stage("read_input"):
+        for name in inputs:
+            skeleton = find_file(skeleton_filename, name)
+            if action == "text2conllu":
+                with open_file(name) as f:
+                    docs = f.read().splitlines()
+            elif jsonl:
+                from .json_format import iter_json_lines
+                docs = list(iter_json_lines(name))
+            else:
+                with open_file(name) as f:
+                    docs = json.load(f)
+            file_sizes = _sizes(skeleton)
+            assert len(docs) == len(file_sizes), f"{name} has {len(docs)} documents, {skeleton} {len(file_sizes)}"
+            tasks.append([((doc, skeleton, k), size) for k, (doc, size) in enumerate(zip(docs, file_sizes))])
+            sizes.append(file_sizes)
+
+    def write(output, results):
+        with open_file(output, "w") as f:
+            f.writelines(results)
+        return {}
+
+    work = partial(_merge_documents, merge=merge, merge_udapi=merge_udapi, use_gold_empty_nodes=use_gold_empty_nodes)
+    _run(action, inputs, outputs, sizes, tasks, work, jobs, write, summary)
+
+
+def run_batch(action, **options):
+    """Runs the command over all files of its batch arguments (see the module docstring)."""
+    if action in ("conllu2text", "conllu2json"):
+        _convert(action, **options)
+    elif action == "clean":
+        _clean(**options)
+    elif action == "text2conllu":
+        _merge(action, options.pop("filename"), options.pop("skeleton_filename"), options.pop("output_filename"),
+               options.pop("zero_mentions"), **options)
+    else:
+        _merge(action, options.pop("json_filename"), options.pop("conllu_skeleton_filename"),
+               options.pop("output_filename"), options.pop("use_gold_empty_nodes"), **options)
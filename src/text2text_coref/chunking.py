@@ -0,0 +1,244 @@
+"""
+Token-budgeted chunks of the documents of the text format.
+
+`conllu2text --max_tokens N` splits every document into chunks of whole sentences
+of at most N words (a longer sentence is a chunk of its own), consecutive chunks
+of a document share `--overlap` sentences. Every chunk is one line of the output
+and is described by one line of the metadata file `OUTPUT.chunks.jsonl`:
+
+    {"doc": 0, "docname": "doc1", "chunk": 1, "first_sentence": 7, "sentences": [12, 9, 15], "overlap": 1,
+     "zero_mentions": true}
+
+`sentences` are the numbers of words of the sentences of the chunk (with the empty
+nodes if `zero_mentions`) and `overlap` the number of its first sentences which end
+the previous chunk. `clean --chunks` and `text2conllu --chunks` merge the chunks back
+into documents (`merge_chunks`). Mentions never cross sentences, so the words of a
+document are the words of its chunks without the overlaps; the entities of a chunk
+are linked to the entities of the previous chunk by the mentions they share in the
+overlap, the other entities get new ids.
+"""
+import json
+from collections import Counter, defaultdict
+
+from .compression import open_file
+from .fast_reader import FastDocument
+from .tag_lexer import CLOSE, OPEN, lex_mentions, tag_text
+
+
+def metadata_filename(output_filename):
+    return output_filename + ".chunks.jsonl"
+
+
+def read_metadata(filename):
+    with open_file(filename) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_metadata(chunks, filename):
+    with open_file(filename, "w") as f:
+        for chunk in chunks:
+            f.write(json.dumps(chunk, ensure_ascii=False) + "\n")
+
+
+def sentence_sizes(doc, solve_empty_nodes=True):
+    """Numbers of the words of the sentences in the text format of a FastDocument or a udapi document."""
+    if isinstance(doc, FastDocument):
+        starts = doc.sentence_starts
+        if solve_empty_nodes:
+            return [end - start for start, end in zip(starts, starts[1:])]
+        return [sum(not doc.is_empty(position) for position in range(start, end))
+                for start, end in zip(starts, starts[1:])]
+    return [len(tree.descendants) + (len(tree.empty_nodes) if solve_empty_nodes else 0) for tree in doc.trees]
+
+
+def convert_with_sentences(doc, convert, solve_empty_nodes=True):
+    """`convert(doc)` with the docname and the sizes of the sentences, for `chunk_document`."""
+    docname = doc.docname if isinstance(doc, FastDocument) else doc.meta["docname"]
+    sizes = sentence_sizes(doc, solve_empty_nodes)
+    return convert(doc), docname, sizes
+
+
+def chunk_bounds(sizes, max_tokens, overlap=0):
+    """(first, end) sentences of the chunks, consecutive chunks share `overlap` sentences."""
+    bounds = []
+    start = 0
+    while start < len(sizes):
+        end = start
+        tokens = 0
+        while end < len(sizes) and (end == start or tokens + sizes[end] <= max_tokens):
+            tokens += sizes[end]
+            end += 1
+        bounds.append((start, end))
+        if end == len(sizes):
+            break
+        start = max(end - overlap, start + 1)
+    return bounds
+
+
+def _renumber(words):
+    """Renumbers the entities of the words e1, e2, ... in the order of their first tags."""
+    _, events = lex_mentions(words)
+    eids = {}
+    for _, eid, _ in events:
+        eids.setdefault(eid, f"e{len(eids) + 1}")
+    return _rewrite(words, events, eids, sort=True)
+
+
+def chunk_document(line, docname, sizes, doc_index, max_tokens, overlap=0, zero_mentions=True,
+                   sequential_ids=False):
+    """
+    Splits the line of the text format of a document into chunks, returns the lines of the
+    chunks and their metadata. With `sequential_ids`, the entities of every chunk are
+    numbered from 1.
+    """
+    words = line.split(" ") if line else []
+    offsets = [0]
+    for size in sizes:
+        offsets.append(offsets[-1] + size)
+    assert offsets[-1] == len(words), f"{docname}: {len(words)} words, the sentences have {offsets[-1]}"
+    lines = []
+    chunks = []
+    previous_end = 0
+    for index, (first, end) in enumerate(chunk_bounds(sizes, max_tokens, overlap)):
+        chunk_words = words[offsets[first]:offsets[end]]
+        if sequential_ids:
+            chunk_words = _renumber(chunk_words)
+        lines.append(" ".join(chunk_words))
+        chunks.append({"doc": doc_index, "docname": docname, "chunk": index, "first_sentence": first,
+                       "sentences": sizes[first:end], "overlap": max(previous_end - first, 0),
+                       "zero_mentions": zero_mentions})
+        previous_end = end
+    return lines, chunks
+
+
+def split_sentences(words, sizes, zero_mentions):
+    """
+    Splits the words of a chunk into its sentences. Without `zero_mentions`, the sizes
+    count only the words which are not empty nodes (`##`), the empty nodes are kept in
+    the sentence the cleaner puts them in (see `output_cleaner._clean_document`).
+    """
+    sentences = []
+    i = 0
+    for size in sizes:
+        start = i
+        count = 0
+        while i < len(words) and count < size:
+            if zero_mentions or not words[i].startswith("##"):
+                count += 1
+            i += 1
+        sentences.append(words[start:i])
+    if sentences:
+        sentences[-1].extend(words[i:])
+    return sentences
+
+
+def _position_keys(words, zero_mentions):
+    """Keys of the words which are the same in two versions of the same sentences."""
+    if zero_mentions:
+        return list(range(len(words)))
+    keys = []
+    regular = -1
+    zeros = 0
+    for word in words:
+        if word.startswith("##"):
+            zeros += 1
+        else:
+            regular += 1
+            zeros = 0
+        keys.append((regular, zeros))
+    return keys
+
+
+def _mentions(words, zero_mentions):
+    """The entities of the mentions of the words by the keys of the first and the last word."""
+    keys = _position_keys(words, zero_mentions)
+    _, events = lex_mentions(words)
+    starts = defaultdict(list)
+    mentions = defaultdict(list)
+    for index, eid, kind in events:
+        if kind & OPEN:
+            starts[eid].append(index)
+        if kind & CLOSE and starts[eid]:
+            mentions[keys[starts[eid].pop()], keys[index]].append(eid)
+    return mentions
+
+
+def _match_entities(previous, current, zero_mentions):
+    """Maps the entities of `current` to the entities of `previous` (the same sentences) by their shared mentions."""
+    previous_mentions = _mentions(previous, zero_mentions)
+    votes = Counter()
+    for span, eids in _mentions(current, zero_mentions).items():
+        previous_eids = previous_mentions.get(span, ())
+        if len(eids) == 1 and len(previous_eids) == 1:
+            votes[eids[0], previous_eids[0]] += 1
+    mapping = {}
+    taken = set()
+    for (eid, previous_eid), _ in votes.most_common():
+        if eid not in mapping and previous_eid not in taken:
+            mapping[eid] = previous_eid
+            taken.add(previous_eid)
+    return mapping
+
+
+def _rewrite(words, events, mapping, sort=False):
+    """The words with the tags of the events with the eids mapped."""
+    tags = defaultdict(list)
+    for index, eid, kind in events:
+        tags[index].append(tag_text(mapping[eid], kind))
+    out = []
+    for index, word in enumerate(words):
+        if index in tags:
+            word_tags = sorted(tags[index]) if sort else tags[index]
+            out.append(f"{word.partition('|')[0]}|{','.join(word_tags)}")
+        else:
+            out.append(word)
+    return out
+
+
+def _merge_document(lines, chunks):
+    """Merges the lines of the chunks of one document."""
+    words = []
+    used = set()
+    next_id = 1
+    previous = None  # the sentences of the previous chunk with the merged ids
+    for line, chunk in zip(lines, chunks):
+        sentences = split_sentences(line.split(), chunk["sentences"], chunk["zero_mentions"])
+        chunk_words = [word for sentence in sentences for word in sentence]
+        _, events = lex_mentions(chunk_words)
+        if previous is None:
+            # the entities of the first chunk keep their ids
+            overlap = 0
+            mapping = {eid: eid for _, eid, _ in events}
+        else:
+            overlap = min(chunk["overlap"], len(previous), len(sentences))
+            mapping = _match_entities([word for sentence in previous[len(previous) - overlap:] for word in sentence],
+                                      [word for sentence in sentences[:overlap] for word in sentence],
+                                      chunk["zero_mentions"])
+        used.update(mapping.values())
+        for _, eid, _ in events:
+            if eid not in mapping:
+                while f"e{next_id}" in used:
+                    next_id += 1
+                mapping[eid] = f"e{next_id}"
+                used.add(mapping[eid])
+        chunk_words = _rewrite(chunk_words, events, mapping)
+        previous = []
+        offset = 0
+        for sentence in sentences:
+            previous.append(chunk_words[offset:offset + len(sentence)])
+            offset += len(sentence)
+        for sentence in previous[overlap:]:
+            words.extend(sentence)
+    return " ".join(words)
+
+
+def merge_chunks(lines, chunks):
+    """Merges the lines of the chunks described by the metadata into the lines of the documents."""
+    assert len(lines) == len(chunks), f"{len(lines)} lines, the metadata has {len(chunks)} chunks"
+    documents = []
+    start = 0
+    for end in range(1, len(chunks) + 1):
+        if end == len(chunks) or chunks[end]["doc"] != chunks[start]["doc"]:
+            documents.append(_merge_document(lines[start:end], chunks[start:end]))
+            start = end
+    return documents
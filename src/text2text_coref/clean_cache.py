@@ -0,0 +1,73 @@
+"""
+On-disk cache of cleaned documents.
+
+Iterative runs (rerunning a few failed generations, tweaking a prompt) change
+only some of the LLM outputs, so every cleaned document is stored in the
+`clean` subdirectory of the cache directory. The entries are keyed by the hash
+of the output line, the gold words of the document, the cleaning options and
+the source of the cleaner, so an entry is never used for a different input or
+by a changed cleaner. The least recently used entries are deleted when the
+cache grows over its size limit.
+"""
+import hashlib
+import os
+import tempfile
+
+from .skeleton_cache import _evict
+
+CACHE_VERSION = 1
+CACHE_SIZE = 512 * 1024 ** 2
+SUFFIX = ".clean.txt"
+SUBDIR = "clean"
+
+_cleaner_version = None
+
+
+def cleaner_version():
+    """Hash of the source of the cleaner modules."""
+    global _cleaner_version
+    if _cleaner_version is None:
+        from . import output_cleaner, tag_lexer
+
+        digest = hashlib.sha256(f"{CACHE_VERSION}\n".encode())
+        for module in (output_cleaner, tag_lexer):
+            with open(module.__file__, "rb") as f:
+                digest.update(f.read())
+        _cleaner_version = digest.hexdigest()
+    return _cleaner_version
+
+
+def entry_path(cache_dir, document, gold_doc, gold_zeros, anchors):
+    """Path of the entry of the output line cleaned against the gold sentences with the options."""
+    # the engine is not a part of the key, all the engines give the same alignment
+    digest = hashlib.sha256(f"{cleaner_version()} {gold_zeros} {anchors}\n{document}".encode())
+    for sentence in gold_doc:
+        # CoNLL-U forms never contain tabs or newlines
+        digest.update(("\n" + "\t".join(sentence)).encode())
+    return os.path.join(cache_dir, SUBDIR, digest.hexdigest() + SUFFIX)
+
+
+def load(path):
+    """The cleaned line stored in the entry, None if there is no entry."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            clean = f.read()
+    except FileNotFoundError:
+        return None
+    os.utime(path)  # the modification time orders the entries for the eviction
+    return clean
+
+
+def store(path, clean):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # written under a temporary name, so that other processes never read a partial entry
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=directory, suffix=".tmp", delete=False) as f:
+        f.write(clean)
+    os.replace(f.name, path)
+
+
+def evict(cache_dir, max_size=CACHE_SIZE):
+    directory = os.path.join(cache_dir, SUBDIR)
+    if os.path.isdir(directory):
+        _evict(directory, max_size, SUFFIX)
@@ -0,0 +1,54 @@
+"""
+Transparent compression of the input and output files.
+
+A file is read through gzip, bz2 or lzma when its name ends with `.gz`, `.bz2`
+or `.xz` or when it starts with the magic bytes of the format, and written
+compressed when its name ends with one of the suffixes. The data are
+(de)compressed while streaming, without temporary files. The default output
+names keep the suffix (`dev.conllu.gz` -> `dev.txt.gz`).
+"""
+from importlib import import_module
+
+# the modules are imported only when a compressed file is used
+SUFFIXES = {".gz": "gzip", ".bz2": "bz2", ".xz": "lzma"}
+
+
+def split_suffix(filename):
+    """The file name without the compression suffix and the suffix (empty for a plain file)."""
+    for suffix in SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[: -len(suffix)], suffix
+    return filename, ""
+
+
+def codec(filename, sniff=True):
+    """The module (de)compressing the file by its suffix or its magic bytes (`sniff`), None for a plain file."""
+    suffix = split_suffix(filename)[1]
+    if suffix or not sniff:
+        return import_module(SUFFIXES[suffix]) if suffix else None
+    try:
+        with open(filename, "rb") as f:
+            head = f.read(10)
+    except FileNotFoundError:
+        return None
+    if head.startswith(b"\x1f\x8b"):
+        return import_module("gzip")
+    if head.startswith(b"BZh") and head[3:4].isdigit() and head[4:10] == b"1AY&SY":
+        return import_module("bz2")
+    if head.startswith(b"\xfd7zXZ\x00"):
+        return import_module("lzma")
+    return None
+
+
+def open_file(filename, mode="r", encoding="utf-8"):
+    """
+    `open` of a text file (a binary one with "b" in `mode`) compressed or decompressed
+    transparently. Files being read are recognized by their magic bytes too.
+    """
+    module = codec(filename, sniff="r" in mode)
+    if module is None:
+        return open(filename, mode) if "b" in mode else open(filename, mode, encoding=encoding)
+    options = {"compresslevel": 6} if module.__name__ == "gzip" and "r" not in mode else {}
+    if "b" in mode:
+        return module.open(filename, mode, **options)
+    return module.open(filename, mode + "t", encoding=encoding, **options)
@@ -1,49 +1,123 @@
+import io
 import logging
+import sys
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
+from functools import partial
 
-import udapi
-from udapi.block.corefud.movehead import MoveHead
-from udapi.block.corefud.singleparent import SingleParent
-from udapi.block.read.conllu import Conllu as ConlluReader
-from udapi.block.write.conllu import Conllu as ConlluWriter
-from udapi.core.coref import BridgingLinks
+from . import diagnostics, stats
+from .compression import codec, open_file
+from .fast_reader import FastDocument, UnsupportedDocument, document_source, iter_document_blocks, parse_document
+from .skeleton_merge import merge_text_document
+from .tag_lexer import CLOSE, OPEN, lex_mentions
 
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-                    datefmt='%m/%d/%Y %H:%M:%S',
-                    level=logging.INFO)
+# udapi is imported by the functions using it, the built-in reader and writer do not need it
 logger = logging.getLogger()
 
 
-def read_data(file):
+def read_data(file, cache_dir=None):
+    """
+    Reads the udapi documents from a CoNLL-U file name or file handle. With `cache_dir`,
+    the documents of a file are loaded from the on-disk skeleton cache when possible.
+    """
+    from udapi.block.corefud.movehead import MoveHead
+    from udapi.block.corefud.singleparent import SingleParent
+    from udapi.block.read.conllu import Conllu as ConlluReader
+
+    if cache_dir and isinstance(file, str):
+        from .skeleton_cache import load_cached
+
+        return load_cached(cache_dir, file, "udapi", read_data)
+    if isinstance(file, str) and codec(file):
+        with open_file(file) as f:
+            return read_data(f)
     move_head = MoveHead()
     single_parent = SingleParent()
-    docs = ConlluReader(files=file, split_docs=True).read_documents()
-    level = logging.getLogger().level
-    logging.getLogger().setLevel(logging.ERROR)
-    for doc in docs:
-        move_head.run(doc)
-        single_parent.run(doc)
-    logging.getLogger().setLevel(level)
+    if isinstance(file, str):
+        reader = ConlluReader(files=file, split_docs=True)
+    else:
+        reader = ConlluReader(filehandle=file, split_docs=True)
+    with stats.stage("udapi_read"):
+        docs = reader.read_documents()
+    with stats.stage("move_head"), diagnostics.quiet():
+        for doc in docs:
+            move_head.run(doc)
+            single_parent.run(doc)
     return docs
 
 
 def write_data(docs, f):
-    level = logging.getLogger().level
-    logging.getLogger().setLevel(logging.ERROR)
+    from udapi.block.write.conllu import Conllu as ConlluWriter
+
     writer = ConlluWriter(filehandle=f)
-    for doc in docs:
-        writer.before_process_document(doc)
-        writer.process_document(doc)
+    stdout = sys.stdout
+    with stats.stage("write"), diagnostics.quiet():
+        for doc in docs:
+            writer.before_process_document(doc)
+            writer.process_document(doc)
     # writer.after_process_document(None)
-    logging.getLogger().setLevel(level)
+    # the writer prints to sys.stdout redirected to f
+    sys.stdout = stdout
 
 
-def convert_text_file_to_conllu(filename, skeleton_filename, output_filename, zero_mentions=False):
+def convert_text_file_to_conllu(filename, skeleton_filename, output_filename, zero_mentions=False, udapi_writer=False,
+                                cache_dir=None, chunks=None, shard=None):
+    """
+    Merges the lines of the text format into the skeleton. With `chunks` (the metadata
+    file of `conllu2text --max_tokens`), the lines are chunks merged into documents first.
+    With `shard` (i, N), the lines are the documents of the i-th of N parts of the skeleton
+    (see `doc_index`).
+    """
     if not output_filename:
         output_filename = filename.replace(".txt", ".conllu")
-    with open(filename, encoding="utf-8") as f:
+    if shard:
+        from .doc_index import open_shard
+        skeleton_filename = open_shard(skeleton_filename, shard)
+    with stats.stage("read_input"), open_file(filename) as f:
         text_docs = f.read().splitlines()
-        convert_text_to_conllu(text_docs, skeleton_filename, output_filename, zero_mentions)
+    if chunks:
+        from .chunking import merge_chunks, read_metadata
+
+        with stats.stage("merge_chunks"):
+            text_docs = merge_chunks(text_docs, read_metadata(chunks))
+    convert_text_to_conllu(text_docs, skeleton_filename, output_filename, zero_mentions, udapi_writer, cache_dir)
+
+
+def merge_into_skeleton(docs, conllu_skeleton_file, merge, merge_udapi, use_gold_empty_nodes=True):
+    """
+    Yields the CoNLL-U of every skeleton document merged with its predicted document.
+    Documents are merged by the skeleton-merge engine (`merge`) where possible, the
+    rest is read by udapi and merged by `merge_udapi`. Both the predicted documents
+    and the skeleton are read one document at a time. The skeleton is a file name,
+    a file handle or a list of documents from `fast_reader.iter_document_blocks`.
+    """
+    if isinstance(conllu_skeleton_file, list):
+        skeletons = iter(conllu_skeleton_file)
+    else:
+        skeletons = iter_document_blocks(conllu_skeleton_file)
+    fallbacks = 0
+    for doc in docs:
+        skeleton = next(skeletons, None)
+        assert skeleton is not None, "more predicted documents than skeleton documents"
+        blocks, global_entity = skeleton
+        with stats.document(), diagnostics.document():
+            try:
+                with stats.stage("merge"):
+                    output = merge(doc, blocks, global_entity, use_gold_empty_nodes)
+            except UnsupportedDocument:
+                fallbacks += 1
+                stats.annotate(udapi=True)
+                diagnostics.retry()
+                udapi_doc = read_data(io.StringIO(document_source(blocks, global_entity)))[0]
+                with stats.stage("udapi_merge"):
+                    merge_udapi(doc, udapi_doc, use_gold_empty_nodes)
+                f = io.StringIO()
+                write_data([udapi_doc], f)
+                output = f.getvalue()
+        yield output
+    assert next(skeletons, None) is None, "more skeleton documents than predicted documents"
+    if fallbacks:
+        logger.info(f"{fallbacks} documents merged by udapi")
 
 
 def remove_empty_node(node):
@@ -64,6 +138,8 @@ def remove_empty_node(node):
 
 def reduce_discontinuous_mention(mention):
     """Reduce a mention to a continuous span if it is discontinuous."""
+    import udapi.core.coref
+
     root = mention.words[0].root
     for subspan in mention.span.split(','):
         subspan_words = udapi.core.coref.span_to_nodes(root, subspan)
@@ -71,71 +147,221 @@ def reduce_discontinuous_mention(mention):
             mention.words = subspan_words
             break
 
-def convert_text_to_conllu(text_docs, conllu_skeleton_file, out_file, use_gold_empty_nodes=True):
-    udapi_docs = read_data(conllu_skeleton_file)
+def convert_text_to_conllu(text_docs, conllu_skeleton_file, out_file, use_gold_empty_nodes=True, udapi_writer=False,
+                           cache_dir=None):
+    if not udapi_writer:
+        output = merge_into_skeleton(text_docs, conllu_skeleton_file, merge_text_document, merge_text_into_udapi,
+                                     use_gold_empty_nodes)
+        with open_file(out_file, "w") as f:
+            f.writelines(output)
+        return
+    udapi_docs = read_data(conllu_skeleton_file, cache_dir)
     # udapi_docs2 = read_data(conllu_skeleton_file)
-    move_head = MoveHead()
-    for doc in udapi_docs:
-        doc._eid_to_entity = {}
     assert len(udapi_docs) == len(text_docs)
     for text, udapi_doc in zip(text_docs, udapi_docs):
-        words = text.split(" ")
-        udapi_words = [word for word in udapi_doc.nodes]
-        for word in udapi_doc.nodes_and_empty:
+        with stats.document(), diagnostics.document(udapi_doc.meta["docname"]), stats.stage("udapi_merge"):
+            merge_text_into_udapi(text, udapi_doc, use_gold_empty_nodes)
+    # debug_udapi(udapi_docs, udapi_docs2)
+    with open_file(out_file, "w") as f:
+        write_data(udapi_docs, f)
+
+
+def merge_text_into_udapi(text, udapi_doc, use_gold_empty_nodes=True):
+    """Replaces the coreference in the udapi document by the one from the line of the text format."""
+    import udapi.core.coref
+    from udapi.block.corefud.movehead import MoveHead
+
+    move_head = MoveHead()
+    udapi_doc._eid_to_entity = {}
+    words = text.split(" ")
+    udapi_words = [word for word in udapi_doc.nodes]
+    for tree in udapi_doc.trees:
+        for word in tree.descendants_and_empty:
             word.misc = {}
-            # Remove empty nodes
-            if not use_gold_empty_nodes and word.is_empty():
-                remove_empty_node(word)
-            elif word.is_empty():
-                shift_empty_node_recreate(word)
+        # Remove empty nodes
         if not use_gold_empty_nodes:
-            j = 1
-            for i in range(len(udapi_words)):
-                word = udapi_words[i]
-                while j < len(words) and words[j].startswith("##"):
-                    word.create_empty_child("_", after=True)
-                    j += 1
-                j += 1
-        udapi_words = [word for word in udapi_doc.nodes_and_empty]
+            remove_empty_nodes(tree)
+        else:
+            shift_empty_nodes_recreate(tree)
+    if not use_gold_empty_nodes:
+        j = 1
         for i in range(len(udapi_words)):
-            if udapi_words[i].form != words[i].split("|")[0]:
-                logger.warning(f"WARNING: words do not match. DOC: {udapi_doc.meta['docname']}, word1: {words[i].split('|')[0]}, word2: {udapi_words[i].form}, i: {i}")
-        # if len(udapi_words) != len(words):
-        #     continue
-        assert len(udapi_words) == len(words)
-        mention_starts = defaultdict(list)
-        entities = {}
-        for i, (word, udapi_word) in enumerate(zip(words, udapi_words)):
-            if word.split("|")[0] != udapi_word.form:
-                logger.warning(f"WARNING: words do not match. DOC: {udapi_doc.meta['docname']}, word1: {word.split('|')[0]}, word2: {udapi_word.form}")
-            if "|" in word:
-                mentions = word.split("|")[1].replace("-", ",").split(",")
-                for mention in mentions:
-                    eid = mention.replace("[", "").replace("]", "")
-                    if len(eid) == 0:
-                        continue
-                    if eid not in entities:
-                        entities[eid] = udapi_doc.create_coref_entity(eid=eid)
-                    if mention.startswith("["):
-                        mention_starts[eid].append(i)
-                    if mention[-1] == "]":
-                        if not mention_starts[eid]:
-                            logger.warning(f"WARNING: Closing mention which was not opened. DOC: {udapi_doc.meta['docname']}, EID: {eid}")
-                            continue
-                        entities[eid].create_mention(words=udapi_words[mention_starts[eid][-1]: i + 1])
-                        mention_starts[eid].pop()
-        udapi.core.coref.store_coref_to_misc(udapi_doc)
-        move_head.run(udapi_doc)
-    # debug_udapi(udapi_docs, udapi_docs2)
-    with open(out_file, "w", encoding="utf-8") as f:
-        write_data(udapi_docs, f)
+            word = udapi_words[i]
+            count = 0
+            while j < len(words) and words[j].startswith("##"):
+                count += 1
+                j += 1
+            create_empty_children(word, count)
+            j += 1
+    udapi_words = [word for word in udapi_doc.nodes_and_empty]
+    forms, events = lex_mentions(words)
+    for i in range(len(udapi_words)):
+        if udapi_words[i].form != forms[i]:
+            diagnostics.report("word_mismatches", "Words do not match in %s: %s != %s at %d", udapi_doc.meta["docname"],
+                               forms[i], udapi_words[i].form, i)
+    # if len(udapi_words) != len(words):
+    #     continue
+    assert len(udapi_words) == len(words)
+    stats.annotate(docname=udapi_doc.meta["docname"], tokens=len(udapi_words))
+    mention_starts = defaultdict(list)
+    entities = {}
+    events = iter(events)
+    event = next(events, None)
+    for i in range(len(udapi_words)):
+        while event is not None and event[0] == i:
+            _, eid, kind = event
+            event = next(events, None)
+            if eid not in entities:
+                entities[eid] = udapi_doc.create_coref_entity(eid=eid)
+            if kind & OPEN:
+                mention_starts[eid].append(i)
+            if kind & CLOSE:
+                if not mention_starts[eid]:
+                    diagnostics.report("unopened_mentions", "Closing mention which was not opened in %s: %s",
+                                       udapi_doc.meta["docname"], eid)
+                    continue
+                entities[eid].create_mention(words=udapi_words[mention_starts[eid][-1]: i + 1])
+                mention_starts[eid].pop()
+    udapi.core.coref.store_coref_to_misc(udapi_doc)
+    move_head.run(udapi_doc)
+
+
+def convert_document(blocks, global_entity, convert, convert_fast, udapi_reader=False):
+    """
+    Converts one document from `fast_reader.iter_document_blocks` by the fast reader
+    if possible, otherwise by udapi. Returns the result and whether udapi was used.
+    """
+    with stats.document(), diagnostics.document():
+        with stats.stage("read"):
+            doc = document_source(blocks, global_entity) if udapi_reader else parse_document(blocks, global_entity)
+        if isinstance(doc, FastDocument):
+            stats.annotate(docname=doc.docname, tokens=len(doc.forms))
+            diagnostics.name(doc.docname)
+            try:
+                with stats.stage("convert"):
+                    return convert_fast(doc), False
+            except UnsupportedDocument:
+                diagnostics.retry()
+                doc = document_source(blocks, global_entity)
+        udapi_doc = read_data(io.StringIO(doc))[0]
+        _annotate_udapi_document(udapi_doc)
+        with stats.stage("convert"):
+            return convert(udapi_doc), True
+
+
+def _annotate_udapi_document(doc):
+    diagnostics.name(doc.meta["docname"])
+    if stats.enabled():
+        stats.annotate(docname=doc.meta["docname"], udapi=True, tokens=sum(1 for _ in doc.nodes_and_empty))
+
+
+def _convert_chunk(chunk, convert, convert_fast, udapi_reader):
+    return [convert_document(blocks, global_entity, convert, convert_fast, udapi_reader)
+            for blocks, global_entity in chunk], stats.take()
+
+
+def _chunk_document_blocks(documents, chunk_lines=2000):
+    """Groups consecutive documents into chunks of at least `chunk_lines` CoNLL-U lines."""
+    chunk = []
+    size = 0
+    for blocks, global_entity in documents:
+        chunk.append((blocks, global_entity))
+        size += sum(len(lines) for lines in blocks)
+        if size >= chunk_lines:
+            yield chunk
+            chunk = []
+            size = 0
+    if chunk:
+        yield chunk
+
+
+def iter_converted_documents(filename, convert, convert_fast, udapi_reader=False, jobs=1):
+    """
+    Yields `convert(doc)` for every document in the CoNLL-U file in order. Documents
+    are read by the fast reader and converted by `convert_fast` where possible, the
+    rest is read by udapi. With more than one job, chunks of documents are converted
+    in worker processes, at most two chunks per job at once.
+    """
+    if udapi_reader and jobs <= 1:
+        for doc in read_data(filename):
+            with stats.document(), diagnostics.document():
+                _annotate_udapi_document(doc)
+                with stats.stage("convert"):
+                    result = convert(doc)
+            yield result
+        return
+    documents = iter_document_blocks(filename)
+    fallbacks = 0
+    if jobs > 1:
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
 
+        def collect(future):
+            nonlocal fallbacks
+            results, chunk_stats = future.result()
+            stats.merge(chunk_stats)
+            for result, fallback in results:
+                fallbacks += fallback
+                yield result
 
-def convert_conllu_file_to_text(filename, output_filename, zero_mentions, blind=False, sequential_ids=True, no_empty_node_form=False):
+        with ProcessPoolExecutor(max_workers=jobs, initializer=stats.init_worker,
+                                 initargs=(stats.enabled(),)) as executor:
+            pending = deque()
+            for chunk in _chunk_document_blocks(documents):
+                pending.append(executor.submit(_convert_chunk, chunk, convert, convert_fast, udapi_reader))
+                if len(pending) >= 2 * jobs:
+                    yield from collect(pending.popleft())
+            while pending:
+                yield from collect(pending.popleft())
+    else:
+        for blocks, global_entity in documents:
+            result, fallback = convert_document(blocks, global_entity, convert, convert_fast)
+            fallbacks += fallback
+            yield result
+    if fallbacks and not udapi_reader:
+        logger.info(f"{fallbacks} documents read by udapi")
+
+
+def convert_conllu_file_to_text(filename, output_filename, zero_mentions, blind=False, sequential_ids=True, no_empty_node_form=False, udapi_reader=False, jobs=1,
+                                max_tokens=None, overlap=0, shard=None):
+    """
+    Writes every document as one line of the text format. With `max_tokens`, every document
+    is split into chunks of whole sentences of at most `max_tokens` words sharing `overlap`
+    sentences, one chunk per line, and the chunks are described in `OUTPUT.chunks.jsonl`
+    (see `chunking`). With `shard` (i, N), only the documents of the i-th of N parts of
+    the file are written (see `doc_index`).
+    """
     if not output_filename:
         output_filename = filename.replace(".conllu", ".txt")
-    docs = read_data(filename)
-    convert_to_text(docs, output_filename, zero_mentions, not blind, sequential_ids, not no_empty_node_form)
+        if shard:
+            from .doc_index import shard_filename
+            output_filename = shard_filename(output_filename, shard)
+    if shard:
+        from .doc_index import open_shard
+        filename = open_shard(filename, shard)
+    options = dict(solve_empty_nodes=zero_mentions, mark_entities=not blind, sequential_ids=sequential_ids,
+                   empty_node_form=not no_empty_node_form)
+    convert = partial(document_to_text, **options)
+    convert_fast = partial(fast_document_to_text, **options)
+    if max_tokens:
+        from .chunking import chunk_document, convert_with_sentences, metadata_filename, write_metadata
+
+        convert = partial(convert_with_sentences, convert=convert, solve_empty_nodes=zero_mentions)
+        convert_fast = partial(convert_with_sentences, convert=convert_fast, solve_empty_nodes=zero_mentions)
+    lines = iter_converted_documents(filename, convert, convert_fast, udapi_reader, jobs)
+    chunks = []
+    with open_file(output_filename, "w") as f:
+        for doc_index, line in enumerate(lines):
+            if max_tokens:
+                line, docname, sizes = line
+                chunk_lines, doc_chunks = chunk_document(line, docname, sizes, doc_index, max_tokens, overlap,
+                                                         zero_mentions, sequential_ids)
+                chunks.extend(doc_chunks)
+                line = "\n".join(chunk_lines)
+            f.write(line + "\n")
+    if max_tokens:
+        write_metadata(chunks, metadata_filename(output_filename))
+        logger.info(f"{len(chunks)} chunks described in {metadata_filename(output_filename)}")
 
 
 def shift_empty_node(node):
@@ -178,52 +404,273 @@ def shift_empty_node_recreate(node):
     remove_empty_node(node)
 
 
+def _ord(node):
+    return node.ord
+
+
+def _has_simple_empty_nodes(root):
+    """
+    True if the empty nodes of the tree are sorted, have ords with one decimal digit
+    and their first enhanced parent is a regular node, as in CorefUD.
+    """
+    last_ord = 0
+    for empty in root.empty_nodes:
+        if not isinstance(empty.ord, float) or empty.ord != round(empty.ord, 1) or empty.ord <= last_ord:
+            return False
+        last_ord = empty.ord
+        if not empty.deps:
+            return False
+        parent = empty.deps[0]["parent"]
+        if parent.is_empty() or parent.is_root() or parent.root is not root:
+            return False
+    return True
+
+
+def shift_empty_nodes(root):
+    """
+    Moves the empty nodes of the tree after their parents. The same as `shift_empty_node`
+    on every empty node in the word order, but the ords are counted per integer part and
+    every moved node is put to its place by bisection instead of sorting all empty nodes.
+    """
+    nodes = root.empty_nodes
+    if not all(isinstance(empty.ord, float) for empty in nodes) or any(
+            previous.ord > empty.ord for previous, empty in zip(nodes, nodes[1:])):
+        for node in sorted(nodes):
+            shift_empty_node(node)
+        return
+    # number of empty nodes with each integer part of the ord
+    counts = defaultdict(int)
+    for empty in nodes:
+        counts[int(empty.ord)] += 1
+    for node in list(nodes):
+        parent_ord = node.deps[0]["parent"].ord
+        if int(node.ord) == parent_ord:
+            continue
+        new_ord = parent_ord + 0.1
+        for _ in range(counts.get(parent_ord, 0)):
+            new_ord += 0.1
+        counts[int(node.ord)] -= 1
+        counts[int(new_ord)] += 1
+        # the stable sort keeps the node before the nodes with the same ord which were after it
+        i = bisect_left(nodes, node.ord, key=_ord)
+        while nodes[i] is not node:
+            i += 1
+        del nodes[i]
+        node.ord = new_ord
+        nodes.insert(min(max(i, bisect_left(nodes, new_ord, key=_ord)), bisect_right(nodes, new_ord, key=_ord)), node)
+
+
+def remove_empty_nodes(root):
+    """Deletes all empty nodes of the tree, the same as `remove_empty_node` on each of them."""
+    if not root.empty_nodes:
+        return
+    removed = set(root.empty_nodes)
+    for n in root.empty_nodes + root.descendants:
+        if n.deps:
+            n.deps = [x for x in n.deps if x["parent"] not in removed]
+    root.empty_nodes.clear()
+
+
+def shift_empty_nodes_recreate(root):
+    """
+    The same as `shift_empty_node_recreate` on every empty node of the tree in the word order.
+    The ords are found by bisection in the sorted empty nodes and the enhanced dependencies
+    are rewired through an index, instead of scanning all the nodes for every empty node.
+    """
+    from udapi.core.node import EmptyNode
+
+    empties = sorted(root.empty_nodes)
+    if not _has_simple_empty_nodes(root):
+        for node in empties:
+            shift_empty_node_recreate(node)
+        return
+    nodes = root.empty_nodes
+    referencing = defaultdict(list)
+    for empty in empties:
+        for dep in empty.deps:
+            referencing[dep["parent"]].append(dep)
+    removed = set()
+    for node in empties:
+        parent = node.deps[0]["parent"]
+        if int(node.ord) == parent.ord:
+            continue
+        # Node.create_empty_child(after=True)
+        new_ord = parent.ord + 0.1
+        i = bisect_left(nodes, new_ord, key=_ord)
+        while i < len(nodes) and nodes[i].ord <= new_ord:
+            if nodes[i].ord == new_ord:
+                if new_ord == parent.ord + 0.9:
+                    new_ord = None
+                    break
+                new_ord = round(new_ord + 0.1, 1)
+            i += 1
+        if new_ord is None:
+            # the tenth empty node after the parent gets a special ord
+            new_empty = parent.create_empty_child(node.deps[0]["deprel"], after=True)
+        else:
+            new_empty = EmptyNode(root=root)
+            new_empty.ord = new_ord
+            insort(nodes, new_empty, key=_ord)
+        new_empty.form = node.form
+        new_empty.lemma = node.lemma
+        for dep in referencing.pop(node, []):
+            dep["parent"] = new_empty
+        new_empty.deps = node.deps
+        # remove_empty_node, the deps of the other nodes are filtered at the end
+        i = bisect_left(nodes, node.ord, key=_ord)
+        while nodes[i] is not node:
+            i += 1
+        for empty in nodes[i + 1:bisect_left(nodes, node.ord + 1, key=_ord)]:
+            empty.ord = round(empty.ord - 0.1, 1)
+        del nodes[i]
+        removed.add(node)
+    if removed:
+        for n in root.empty_nodes + root.descendants:
+            if n.deps:
+                n.deps = [x for x in n.deps if x["parent"] not in removed]
+
+
+def create_empty_children(node, count, deprel="_"):
+    """
+    Creates `count` empty children after the node, the same as calling
+    `node.create_empty_child(deprel, after=True)` `count` times.
+    """
+    from udapi.core.node import EmptyNode
+
+    empties = node.root.empty_nodes
+    new_ord = node.ord + 0.1
+    if count > 9 or any(empty.ord >= new_ord for empty in empties[-1:]):
+        for _ in range(count):
+            node.create_empty_child(deprel, after=True)
+        return
+    for _ in range(count):
+        new_empty = EmptyNode(root=node.root)
+        new_empty.deps = [{"parent": node, "deprel": deprel}]
+        new_empty.ord = new_ord
+        empties.append(new_empty)
+        new_ord = round(new_ord + 0.1, 1)
+
+
 
 
 
 
 def convert_to_text(docs, out_file, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
-    with open(out_file, "w", encoding="utf-8") as f:
+    with open_file(out_file, "w") as f:
         for doc in docs:
-            eids = {}
-            out_words = []
-            if solve_empty_nodes:
-                for node in doc.nodes_and_empty:
-                    if node.is_empty():
-                        # node.shift_before_node(node.deps[0]["parent"])
-                        shift_empty_node(node)
-                udapi_words = [word for word in doc.nodes_and_empty]
+            f.write(document_to_text(doc, solve_empty_nodes, mark_entities, sequential_ids, empty_node_form) + "\n")
+
+
+def document_to_text(doc, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
+    """Converts one udapi document into one line of the text format."""
+    out_words = []
+    if solve_empty_nodes:
+        for tree in doc.trees:
+            shift_empty_nodes(tree)
+        udapi_words = [word for word in doc.nodes_and_empty]
+    else:
+        udapi_words = [word for word in doc.nodes]
+    tags = mention_tags(udapi_words, sequential_ids) if mark_entities else {}
+    for i, word in enumerate(udapi_words):
+        out_word = word.form.replace(" ", "_")
+        if word.is_empty():
+            out_word = "##" + (out_word if out_word != "_" and empty_node_form else "") # empty nodes start with ##
+        if i in tags:
+            out_words.append(f"{out_word}|{','.join(sorted(tags[i]))}")
+        else:
+            out_words.append(out_word)
+    return " ".join(out_words)
+
+
+def mention_tags(udapi_words, sequential_ids=False):
+    """
+    Returns the mention tags of the text format (`[e1`, `e1]`, `[e1]`) of the words by their position.
+    Every mention is reduced to a continuous span and its span is parsed once, when it is
+    first seen, and the tags are put only to the words of the mention.
+    """
+    position = {word: i for i, word in enumerate(udapi_words)}
+    tags = defaultdict(list)
+    eids = {}
+    seen = set()
+    for i, word in enumerate(udapi_words):
+        new_mentions = [mention for mention in word.coref_mentions if mention not in seen]
+        if not new_mentions:
+            continue
+        # the order in which the mentions are seen keeps the sequential ids deterministic
+        for mention in dict.fromkeys(new_mentions):
+            seen.add(mention)
+            if sequential_ids:
+                if mention.entity.eid not in eids:
+                    eids[mention.entity.eid] = f"e{len(eids) + 1}"
+                eid = eids[mention.entity.eid]
             else:
-                udapi_words = [word for word in doc.nodes]
-            for word in udapi_words:
-                out_word = word.form.replace(" ", "_")
-                if word.is_empty():
-                    out_word = "##" + (out_word if out_word != "_" and empty_node_form else "") # empty nodes start with ##
-                mentions = []
-                if mark_entities:
-                    for mention in set(word.coref_mentions):
-                        if sequential_ids:
-                            if mention.entity.eid not in eids:
-                                eids[mention.entity.eid] = f"e{len(eids) + 1}"
-                            eid = eids[mention.entity.eid]
-                        else:
-                            eid = mention.entity.eid
-                        if "," in mention.span:
-                            reduce_discontinuous_mention(mention)
-                        span = mention.span
-                        mention_start = float(span.split("-")[0])
-                        mention_end = float(span.split("-")[1]) if "-" in span else mention_start
-                        if mention_start == float(word.ord) and mention_end == float(word.ord):
-                            mentions.append(f"[{eid}]")
-                        elif mention_start == float(word.ord):
-                            mentions.append(f"[{eid}")
-                        elif mention_end == float(word.ord):
-                            mentions.append(f"{eid}]")
-                if len(mentions) > 0:
-                    out_words.append(f"{out_word}|{','.join(sorted(mentions))}")
-                else:
-                    out_words.append(out_word)
-            f.write(" ".join(out_words) + "\n")
+                eid = mention.entity.eid
+            if "," in mention.span:
+                reduce_discontinuous_mention(mention)
+            span = mention.span
+            mention_start = float(span.split("-")[0])
+            mention_end = float(span.split("-")[1]) if "-" in span else mention_start
+            # this word and the words left in the mention (a reduced mention may skip this word)
+            for mention_word in dict.fromkeys([word] + mention.words):
+                j = position.get(mention_word)
+                if j is None or j < i:
+                    continue
+                if mention_start == float(mention_word.ord) and mention_end == float(mention_word.ord):
+                    tags[j].append(f"[{eid}]")
+                elif mention_start == float(mention_word.ord):
+                    tags[j].append(f"[{eid}")
+                elif mention_end == float(mention_word.ord):
+                    tags[j].append(f"{eid}]")
+    return tags
+
+
+def fast_document_order(doc, solve_empty_nodes=True):
+    """
+    Returns the positions of the output words of a FastDocument and the rank
+    of every word (empty nodes included) in the word order used for mention spans.
+    """
+    if solve_empty_nodes:
+        order, _ = doc.shifted_order()
+        rank = [0] * len(doc.forms)
+        for i, position in enumerate(order):
+            rank[position] = i
+    else:
+        order = [position for position in range(len(doc.forms)) if not doc.is_empty(position)]
+        rank = range(len(doc.forms))
+    return order, rank
+
+
+def fast_document_to_text(doc, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
+    """Same as document_to_text for a document read by the fast reader."""
+    order, rank = fast_document_order(doc, solve_empty_nodes)
+    word_mentions = {}
+    if mark_entities:
+        for (start, end, eid), (first, last) in zip(doc.mentions, doc.mention_bounds(rank)):
+            for position in range(start, end + 1):
+                word_mentions.setdefault(position, []).append((eid, first, last))
+    eids = {}
+    out_words = []
+    for position in order:
+        out_word = doc.forms[position].replace(" ", "_")
+        if doc.is_empty(position):
+            out_word = "##" + (out_word if out_word != "_" and empty_node_form else "")
+        mentions = []
+        for eid, first, last in word_mentions.get(position, ()):
+            if sequential_ids:
+                if eid not in eids:
+                    eids[eid] = f"e{len(eids) + 1}"
+                eid = eids[eid]
+            if first == rank[position] == last:
+                mentions.append(f"[{eid}]")
+            elif first == rank[position]:
+                mentions.append(f"[{eid}")
+            elif last == rank[position]:
+                mentions.append(f"{eid}]")
+        if len(mentions) > 0:
+            out_words.append(f"{out_word}|{','.join(sorted(mentions))}")
+        else:
+            out_words.append(out_word)
+    return " ".join(out_words)
 
 
 def debug_udapi(udapi_docs1, udapi_docs2):
@@ -0,0 +1,175 @@
+"""
+Aggregated diagnostics of the problems found in the documents.
+
+Noisy predictions have many problems (words not matching the skeleton, closing
+brackets without an opening one, invalid tags, ...). Logging every one of them
+formats a message per word and floods the log, so they are counted instead:
+
+- `report(kind, message, *args)` counts a problem of the current document. The
+  message is %-formatted lazily by logging and only the first `SAMPLES`
+  messages of every kind are logged (per process).
+- `document(name)` collects the problems of one document, a document with
+  problems is summarized in one line (at the DEBUG level, `--log_level DEBUG`)
+  when it is done.
+  `retry()` forgets them when the document is processed again by udapi.
+- `quiet()` drops the warnings udapi logs while reading and writing documents,
+  they are counted as `udapi_warnings`.
+
+The counts are added to the `--stats` report too. Worker processes return their
+totals with the statistics (`stats.take`), the parent logs the totals of the run
+(`log_summary`). `reset()` starts a new run, e.g. for every request of `serve`.
+"""
+import logging
+from collections import Counter
+
+from . import stats
+
+logger = logging.getLogger(__name__)
+
+# logged messages of every kind of problem
+SAMPLES = 5
+
+_totals = Counter()
+_documents = Counter()  # documents with a problem of the kind
+_samples = Counter()
+_current = None
+
+
+class _Document:
+    __slots__ = ["name", "issues", "outer"]
+
+    def __init__(self, name):
+        self.name = name
+        self.issues = Counter()
+
+    def __enter__(self):
+        global _current
+        self.outer = _current
+        _current = self
+        return self
+
+    def __exit__(self, *exc):
+        global _current
+        _current = self.outer
+        if self.issues:
+            _documents.update(self.issues.keys())
+            for kind, count in self.issues.items():
+                stats.count(kind, count)
+            if logger.isEnabledFor(logging.DEBUG):
+                summary = ", ".join(f"{count} {kind}" for kind, count in self.issues.most_common())
+                logger.debug("Document %s: %s", self.name, summary)
+
+
+def document(name=None):
+    """Context manager collecting the problems of one document."""
+    return _Document(name)
+
+
+def name(docname):
+    """Names the current document when the name is known only after it is read."""
+    if _current is not None:
+        _current.name = docname
+
+
+def retry():
+    """Forgets the problems of the current document, which is processed again (by udapi)."""
+    if _current is not None:
+        _totals.subtract(_current.issues)
+        _current.issues.clear()
+
+
+def report(kind, message=None, *args, n=1):
+    """Counts `n` problems of the kind, the first `SAMPLES` messages of the kind are logged."""
+    _totals[kind] += n
+    if _current is not None:
+        _current.issues[kind] += n
+    else:
+        stats.count(kind, n)
+    if message is not None:
+        _samples[kind] += 1
+        if _samples[kind] <= SAMPLES:
+            logger.warning(message, *args)
+        elif _samples[kind] == SAMPLES + 1:
+            logger.warning("Further %s messages are not logged", kind)
+
+
+class Joined:
+    """The words joined by spaces when the message is formatted."""
+
+    __slots__ = ["words"]
+
+    def __init__(self, words):
+        self.words = words
+
+    def __str__(self):
+        return " ".join(self.words)
+
+
+class _Quiet(logging.Filter):
+    """Filter of the root logger dropping the records below ERROR in `quiet` blocks."""
+
+    def __init__(self):
+        super().__init__()
+        self.depth = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            return True
+        if record.levelno >= logging.WARNING:
+            report("udapi_warnings")
+        return False
+
+    def __enter__(self):
+        if not self.depth:
+            logging.getLogger().addFilter(self)
+        self.depth += 1
+
+    def __exit__(self, *exc):
+        self.depth -= 1
+        if not self.depth:
+            logging.getLogger().removeFilter(self)
+
+
+_quiet = _Quiet()
+
+
+def quiet():
+    """
+    Context manager dropping the records below ERROR logged directly on the root logger
+    (where udapi logs) while it is entered, unlike changing the level of the logger it
+    is cheap to enter.
+    """
+    return _quiet
+
+
+def take():
+    """The totals of this process (for the parent) since the last call."""
+    global _totals, _documents
+    data = {"totals": dict(+_totals), "documents": dict(_documents)} if +_totals else None
+    _totals = Counter()
+    _documents = Counter()
+    return data
+
+
+def merge(data):
+    """Adds the totals from `take` of a worker process."""
+    if data:
+        _totals.update(data["totals"])
+        _documents.update(data["documents"])
+
+
+def reset():
+    """Starts a new run (or a request of `serve`), its first messages of every kind are logged again."""
+    global _totals, _documents, _samples
+    _totals = Counter()
+    _documents = Counter()
+    _samples = Counter()
+
+
+def log_summary():
+    """Logs the totals of the run and starts a new one."""
+    if +_totals:
+        logger.warning("Problems: %s", ", ".join(
+            f"{count} {kind}" + (f" in {_documents[kind]} documents" if _documents[kind] else "")
+            for kind, count in (+_totals).most_common()))
+    reset()
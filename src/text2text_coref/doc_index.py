@@ -0,0 +1,296 @@
+"""
+Document offset index of CoNLL-U files, for random access and sharding.
+
+The index is built in one scan of the file and stored next to it (`FILE.idx`):
+the byte offsets of every document and every sentence, the number of words and
+empty nodes of every document, the document names and the global.Entity
+declaration every document inherits from the previous ones. The offsets and the
+counts are arrays read through mmap, so document k is read directly without
+parsing the documents before it. An index is rebuilt when the size or the
+modification time of the file changed.
+
+`--shard i/N` of the commands reads only the i-th of N contiguous parts of the
+documents (`open_shard`), the outputs of the shards are joined in order by the
+`merge` command (`merge_files`).
+"""
+import io
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from .compression import codec, open_file, split_suffix
+from .fast_reader import RE_GLOBAL_ENTITY, RE_NEWDOC, document_source
+
+logger = logging.getLogger()
+
+MAGIC = b"T2TIDX1\0"
+# size and modification time of the file, byte order, documents, sentences, length of the JSON metadata
+HEADER = struct.Struct("<Qq8sQQQ")
+BYTE_ORDER = sys.byteorder.encode().ljust(8, b"\0")
+SUFFIX = ".idx"
+
+
+def parse_shard(shard):
+    """Parses `i/N` (1 <= i <= N), for argparse."""
+    index, _, count = shard.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"shard {shard} is not i/N")
+    if not 1 <= index <= count:
+        raise ValueError(f"shard {shard} is not i/N with 1 <= i <= N")
+    return index, count
+
+
+def shard_filename(filename, shard):
+    """The name of the output of a shard, `out.txt` -> `out.shard2of4.txt`."""
+    name, compression = split_suffix(filename)
+    root, ext = os.path.splitext(name)
+    return f"{root}.shard{shard[0]}of{shard[1]}{ext}{compression}"
+
+
+def _scan(filename):
+    """Reads the file once and returns the arrays and the metadata of the index."""
+    doc_offsets = array("Q")
+    doc_sentences = array("Q")
+    sentence_offsets = array("Q")
+    tokens = array("Q")
+    empty_nodes = array("Q")
+    docnames = []
+    global_entities = []
+    global_entity = None
+    offset = 0
+    block_start = None
+    block_newdoc = False
+    block_comments = []
+    block_tokens = block_empty = 0
+
+    def end_block():
+        nonlocal global_entity
+        if block_newdoc or not doc_offsets:
+            if doc_offsets:
+                tokens.append(block_doc_tokens[0])
+                empty_nodes.append(block_doc_tokens[1])
+            doc_offsets.append(block_start)
+            doc_sentences.append(len(sentence_offsets))
+            global_entities.append(global_entity)
+            docname = None
+            for line in block_comments:
+                match = RE_NEWDOC.match(line)
+                if match:
+                    docname = match.group(1)
+                    break
+            docnames.append(docname)
+            block_doc_tokens[:] = [0, 0]
+        sentence_offsets.append(block_start)
+        block_doc_tokens[0] += block_tokens
+        block_doc_tokens[1] += block_empty
+        for line in block_comments:
+            match = RE_GLOBAL_ENTITY.match(line)
+            if match:
+                global_entity = match.group(1)
+
+    block_doc_tokens = [0, 0]
+    with open_file(filename, "rb") as f:
+        for raw in f:
+            line = raw.rstrip(b"\r\n")
+            if offset == 0 and line.startswith(b"\xef\xbb\xbf"):
+                line = line[3:]
+            if line:
+                if block_start is None:
+                    block_start = offset
+                    block_newdoc = False
+                    block_comments = []
+                    block_tokens = block_empty = 0
+                if line[:1] == b"#":
+                    comment = line.decode("utf-8")
+                    block_comments.append(comment)
+                    if RE_NEWDOC.match(comment):
+                        block_newdoc = True
+                else:
+                    word_id = line.split(b"\t", 1)[0]
+                    if b"." in word_id:
+                        block_empty += 1
+                    elif b"-" not in word_id:
+                        block_tokens += 1
+            elif block_start is not None:
+                end_block()
+                block_start = None
+            offset += len(raw)
+    if block_start is not None:
+        end_block()
+    if doc_offsets:
+        tokens.append(block_doc_tokens[0])
+        empty_nodes.append(block_doc_tokens[1])
+    doc_offsets.append(offset)
+    doc_sentences.append(len(sentence_offsets))
+    sentence_offsets.append(offset)
+    return doc_offsets, doc_sentences, sentence_offsets, tokens, empty_nodes, docnames, global_entities
+
+
+def build_index(filename):
+    """Scans the file and returns the content of its index file."""
+    doc_offsets, doc_sentences, sentence_offsets, tokens, empty_nodes, docnames, global_entities = _scan(filename)
+    stat = os.stat(filename)
+    metadata = json.dumps({"docnames": docnames, "global_entities": global_entities}, ensure_ascii=False).encode()
+    header = HEADER.pack(stat.st_size, stat.st_mtime_ns, BYTE_ORDER, len(tokens),
+                         len(sentence_offsets) - 1, len(metadata))
+    return b"".join([MAGIC, header, doc_offsets.tobytes(), doc_sentences.tobytes(), sentence_offsets.tobytes(),
+                     tokens.tobytes(), empty_nodes.tobytes(), metadata])
+
+
+class DocumentIndex:
+    """
+    The index of a CoNLL-U file, the arrays are views of the mapped index file
+    (or of its content when it could not be written).
+    """
+
+    __slots__ = ["filename", "doc_offsets", "doc_sentences", "sentence_offsets", "tokens", "empty_nodes",
+                 "_metadata", "_buffer", "_source"]
+
+    def __init__(self, filename, buffer):
+        self.filename = filename
+        self._buffer = buffer
+        self._source = None
+        view = memoryview(buffer)
+        _, _, _, documents, sentences, metadata_length = HEADER.unpack_from(view, len(MAGIC))
+        offset = len(MAGIC) + HEADER.size
+        arrays = []
+        for length in (documents + 1, documents + 1, sentences + 1, documents, documents):
+            arrays.append(view[offset:offset + 8 * length].cast("Q"))
+            offset += 8 * length
+        self.doc_offsets, self.doc_sentences, self.sentence_offsets, self.tokens, self.empty_nodes = arrays
+        self._metadata = bytes(view[offset:offset + metadata_length])
+
+    @classmethod
+    def load(cls, filename):
+        """Loads the index of the file, it is built (and written next to the file) if it is missing or stale."""
+        index_filename = filename + SUFFIX
+        stat = os.stat(filename)
+        try:
+            with open(index_filename, "rb") as f:
+                buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if buffer[:len(MAGIC)] == MAGIC and HEADER.unpack_from(buffer, len(MAGIC))[:3] == (
+                    stat.st_size, stat.st_mtime_ns, BYTE_ORDER):
+                return cls(filename, buffer)
+            buffer.close()
+        except (FileNotFoundError, ValueError, struct.error):
+            pass
+        logger.info(f"Building the document index {index_filename}")
+        content = build_index(filename)
+        try:
+            with open(index_filename + ".tmp", "wb") as f:
+                f.write(content)
+            os.replace(index_filename + ".tmp", index_filename)
+        except OSError as ex:
+            logger.warning(f"The document index {index_filename} could not be written ({ex})")
+        return cls(filename, content)
+
+    def __len__(self):
+        return len(self.tokens)
+
+    @property
+    def metadata(self):
+        """The document names and the inherited global.Entity declarations, parsed on the first use."""
+        if isinstance(self._metadata, bytes):
+            self._metadata = json.loads(self._metadata)
+        return self._metadata
+
+    @property
+    def docnames(self):
+        return self.metadata["docnames"]
+
+    def global_entity(self, k):
+        """The global.Entity declaration document k inherits from the previous documents."""
+        return self.metadata["global_entities"][k]
+
+    def sentence_range(self, k):
+        """Byte offsets of the sentences of document k."""
+        return self.sentence_offsets[self.doc_sentences[k]:self.doc_sentences[k + 1]]
+
+    def read(self, start, end=None):
+        """The CoNLL-U of the documents start..end (exclusive, start + 1 by default) as in the file."""
+        if self._source is None:
+            if codec(self.filename):
+                # the offsets are offsets of the decompressed file, which is kept in memory
+                with open_file(self.filename, "rb") as f:
+                    self._source = f.read()
+            else:
+                with open(self.filename, "rb") as f:
+                    self._source = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                        if os.fstat(f.fileno()).st_size else b""
+        end = start + 1 if end is None else end
+        return self._source[self.doc_offsets[start]:self.doc_offsets[end]].decode("utf-8-sig")
+
+    def shard(self, shard):
+        """The range of the documents of the shard (i, N)."""
+        index, count = shard
+        return range((index - 1) * len(self) // count, index * len(self) // count)
+
+    def source(self, documents):
+        """
+        The CoNLL-U of a range of documents. The global.Entity declaration the first
+        document inherits is added to it, so the documents read the same as in the file.
+        """
+        if not documents:
+            return ""
+        text = self.read(documents.start, documents.stop)
+        global_entity = self.global_entity(documents.start)
+        if not global_entity:
+            return text
+        first = self.read(documents.start)
+        blocks = [block.split("\n") for block in first.strip("\n").split("\n\n") if block]
+        return document_source(blocks, global_entity) + text[len(first):]
+
+
+def open_shard(filename, shard):
+    """A handle of the CoNLL-U of the documents of the shard (i, N) of the file."""
+    index = DocumentIndex.load(filename)
+    documents = index.shard(shard)
+    logger.info(f"Shard {shard[0]}/{shard[1]} of {filename}: documents {documents.start}-{documents.stop - 1} "
+                f"of {len(index)}")
+    return io.StringIO(index.source(documents))
+
+
+def merge_files(filenames, output_filename):
+    """
+    Joins the outputs of the shards in order. The documents of JSON files (not JSON Lines)
+    are joined into one list and the documents of chunk metadata (`.chunks.jsonl`) are
+    renumbered, other files are concatenated.
+    """
+    name = split_suffix(output_filename)[0]
+    if name.endswith(".json"):
+        from .json_format import write_json
+
+        documents = []
+        for filename in filenames:
+            with open_file(filename) as f:
+                documents.extend(json.load(f))
+        write_json(documents, output_filename)
+    elif name.endswith(".chunks.jsonl"):
+        from .chunking import read_metadata, write_metadata
+
+        chunks = []
+        for filename in filenames:
+            shard_chunks = read_metadata(filename)
+            offset = chunks[-1]["doc"] + 1 if chunks else 0
+            chunks.extend({**chunk, "doc": chunk["doc"] + offset} for chunk in shard_chunks)
+        write_metadata(chunks, output_filename)
+    elif all(codec(filename) is codec(output_filename) for filename in filenames):
+        # concatenated compressed streams are one compressed file
+        with open(output_filename, "wb") as out:
+            for filename in filenames:
+                with open(filename, "rb") as f:
+                    while chunk := f.read(1 << 20):
+                        out.write(chunk)
+    else:
+        with open_file(output_filename, "wb") as out:
+            for filename in filenames:
+                with open_file(filename, "rb") as f:
+                    while chunk := f.read(1 << 20):
+                        out.write(chunk)
+    logger.info(f"Merged {len(filenames)} files into {output_filename}")
@@ -0,0 +1,328 @@
+"""
+Lightweight CoNLL-U reader used by conllu2text and conllu2json.
+
+Reading a document with udapi builds the whole object graph and runs the
+MoveHead and SingleParent blocks, while the conversion to the text and JSON
+formats only needs the word forms, the empty nodes and the mentions. This
+reader parses them directly into flat per-document lists. Documents with
+anything the conversion would need udapi for (discontinuous mentions, empty
+nodes with several parents, bridging, ...) are returned as their CoNLL-U
+source so that they can be read by udapi instead.
+"""
+import re
+from array import array
+from contextlib import nullcontext
+from sys import intern
+
+from .compression import open_file
+
+RE_SENT_ID = re.compile(r"^# sent_id\s*=?\s*(\S+)")
+RE_NEWDOC = re.compile(r"^# newdoc(?:\s+id\s*=\s*(.+))?$")
+RE_GLOBAL_ENTITY = re.compile(r"^# global.Entity\s*=\s*(\S+)")
+RE_EMPTY_ORD = re.compile(r"^\d+\.[1-9]$")
+RE_ENTITY_CHUNKS = re.compile(r"(\([^()]+\)?|[^()]+\))")
+
+CHARS_FORBIDDEN_IN_ID = "-=| \t()"
+
+
+class UnsupportedDocument(ValueError):
+    """The document cannot be converted without udapi."""
+
+
+class FastDocument:
+    """
+    One document in flat columns indexed by the position of the word in the document,
+    the words of every sentence are ordered like in udapi (by ord, empty nodes included).
+    The numbers are kept in arrays and the forms and eids are interned, so a document
+    takes a fraction of the memory of the udapi nodes. The source lines are not kept,
+    a caller falling back to udapi rebuilds the source from its blocks (`document_source`).
+
+    - forms: word forms
+    - ords: ords of the words (float array, x.0 for words)
+    - empty_parents: ord of the (only) enhanced parent of empty nodes, -1 for words
+    - sentence_starts: position of the first word of every sentence and the number of words
+    - mention_starts, mention_ends, mention_eids: the mentions in the udapi order
+    """
+
+    __slots__ = ("docname", "forms", "ords", "empty_parents", "sentence_starts", "mention_starts", "mention_ends",
+                 "mention_eids")
+
+    def __init__(self, docname, forms, ords, empty_parents, sentence_starts, mentions):
+        self.docname = docname
+        self.forms = forms
+        self.ords = ords
+        self.empty_parents = empty_parents
+        self.sentence_starts = sentence_starts
+        self.mention_starts = array("i", [start for start, _, _ in mentions])
+        self.mention_ends = array("i", [end for _, end, _ in mentions])
+        self.mention_eids = [intern(eid) for _, _, eid in mentions]
+
+    @property
+    def mentions(self):
+        """(start, end, eid) of every mention in the udapi order."""
+        return zip(self.mention_starts, self.mention_ends, self.mention_eids)
+
+    def is_empty(self, position):
+        return self.empty_parents[position] >= 0
+
+    def shifted_order(self):
+        """
+        Returns the positions of the words in the order they have after every empty
+        node is moved after its parent by `convert.shift_empty_node` and the ords
+        of the words in this order.
+        """
+        order = []
+        ords = []
+        for start, end in zip(self.sentence_starts, self.sentence_starts[1:]):
+            words = []
+            empties = []
+            for position in range(start, end):
+                item = [self.ords[position], position]
+                (empties if self.is_empty(position) else words).append(item)
+            # the same steps as shift_empty_node, so that the float ords are the same
+            for empty in sorted(empties, key=lambda item: item[0]):
+                parent_ord = self.empty_parents[empty[1]]
+                if int(empty[0]) == parent_ord:
+                    continue
+                new_ord = parent_ord + 0.1
+                for other in empties:
+                    if int(other[0]) == parent_ord:
+                        new_ord += 0.1
+                empty[0] = new_ord
+                empties.sort(key=lambda item: item[0])
+            sentence = sorted(words + empties, key=lambda item: item[0])
+            sentence_ords = [item[0] for item in sentence]
+            if len(set(sentence_ords)) != len(sentence_ords):
+                raise UnsupportedDocument("empty nodes with the same ord after shifting")
+            order.extend(item[1] for item in sentence)
+            ords.extend(sentence_ords)
+        return order, ords
+
+    def mention_bounds(self, rank):
+        """
+        Returns the first and the last rank of the words of every mention.
+        Mentions must stay continuous in the ranked order.
+        """
+        bounds = []
+        for start, end, _ in self.mentions:
+            ranks = [rank[position] for position in range(start, end + 1)]
+            first, last = min(ranks), max(ranks)
+            if last - first != end - start:
+                raise UnsupportedDocument("discontinuous mention after shifting empty nodes")
+            bounds.append((first, last))
+        return bounds
+
+
+def _parse_entities(doc_misc, sentence_of, global_entity):
+    """
+    Parses the Entity attributes the same way as udapi.core.coref.load_coref_from_misc
+    and returns the mentions sorted like udapi sorts them.
+    """
+    fields = global_entity.split("-") if global_entity else []
+    if doc_misc and (not global_entity or "GRP" in fields or "eid" not in fields):
+        raise UnsupportedDocument(f"unsupported global.Entity {global_entity}")
+
+    mentions = []
+    unfinished = {}
+    for position, misc_entity in doc_misc:
+        for chunk in RE_ENTITY_CHUNKS.split(misc_entity):
+            if not chunk:
+                continue
+            opening, closing = chunk[0] == "(", chunk[-1] == ")"
+            chunk = chunk.strip("()")
+            if not opening and not closing:
+                raise UnsupportedDocument(f"entity without brackets {chunk}")
+            if not opening:
+                if not unfinished.get(chunk):
+                    raise UnsupportedDocument(f"mention {chunk} closed, but not opened")
+                mention, head_idx = unfinished[chunk].pop()
+                if sentence_of[mention[0]] != sentence_of[position]:
+                    raise UnsupportedDocument(f"cross-sentence mention {chunk}")
+                mention[1] = position
+                length = position - mention[0] + 1
+                if head_idx and not -length <= head_idx - 1 < length:
+                    raise UnsupportedDocument(f"invalid head index of {chunk}")
+                continue
+            eid, head_idx = None, None
+            for name, value in zip(fields, chunk.split("-")):
+                if name == "eid":
+                    eid = value
+                elif name == "head":
+                    try:
+                        head_idx = int(value)
+                    except ValueError:
+                        raise UnsupportedDocument(f"invalid head index of {chunk}")
+            if not eid or eid[-1] == "]" or any(x in eid for x in CHARS_FORBIDDEN_IN_ID):
+                raise UnsupportedDocument(f"unsupported eid in {chunk}")
+            mention = [position, position, eid]
+            mentions.append(mention)
+            if not closing:
+                unfinished.setdefault(eid, []).append((mention, head_idx))
+
+    if any(unfinished.values()):
+        raise UnsupportedDocument("unclosed mentions")
+
+    # udapi orders mentions by the first word, longer mentions first, then by eid
+    mentions.sort(key=lambda mention: (mention[0], -mention[1], mention[2]))
+    return [tuple(mention) for mention in mentions]
+
+
+def _parse_document(blocks, global_entity):
+    """Parses the sentence blocks of one document."""
+    docname = None
+    forms = []
+    ords = array("d")
+    empty_parents = array("i")
+    sentence_starts = array("i")
+    sentence_of = []
+    doc_misc = []
+    doc_global_entity = None
+    last_bundle_id = None
+
+    for block_idx, block in enumerate(blocks):
+        words = []
+        empties = []
+        for line in block:
+            if line[0] == "#":
+                match = RE_SENT_ID.match(line)
+                if match:
+                    bundle_id = match.group(1)
+                    if "/" in bundle_id or bundle_id == last_bundle_id:
+                        raise UnsupportedDocument("several zones in one bundle")
+                    last_bundle_id = bundle_id
+                    continue
+                match = RE_NEWDOC.match(line)
+                if match:
+                    if block_idx == 0 and match.group(1) is not None:
+                        docname = match.group(1)
+                    continue
+                match = RE_GLOBAL_ENTITY.match(line)
+                if match:
+                    if block_idx > 0:
+                        # udapi keeps the declaration from the last sentence
+                        raise UnsupportedDocument("global.Entity inside the document")
+                    global_entity = match.group(1)
+                continue
+
+            fields = line.split("\t")
+            if len(fields) < 10:
+                fields.extend(["_"] * (10 - len(fields)))
+            if "-" in fields[0]:
+                continue  # multiword tokens
+            misc = fields[9]
+            if "Bridge=" in misc or "Split" in misc or misc == "Empty=Yes":
+                raise UnsupportedDocument("bridging, split antecedents or an empty sentence")
+            entity = None
+            if "Entity=" in misc:
+                for item in misc.split("|"):
+                    name, _, value = item.partition("=")
+                    if name == "Entity":
+                        entity = value
+            if "." in fields[0]:
+                if not RE_EMPTY_ORD.match(fields[0]):
+                    raise UnsupportedDocument(f"unsupported empty node ord {fields[0]}")
+                deps = fields[8].split("|")
+                parent = deps[0].split(":", 1)[0]
+                if len(deps) != 1 or not parent.isdigit():
+                    raise UnsupportedDocument("empty node without a single non-empty parent")
+                empties.append((float(fields[0]), fields[1], int(parent), entity))
+            else:
+                if fields[0] != str(len(words) + 1):
+                    raise UnsupportedDocument(f"unexpected word ord {fields[0]}")
+                if fields[6] != "_" and not fields[6].isdigit():
+                    raise UnsupportedDocument(f"unexpected head {fields[6]}")
+                words.append((len(words) + 1, fields[1], -1, entity))
+
+        if not words:
+            raise UnsupportedDocument("sentence without words")
+        if any(parent > len(words) for _, _, parent, _ in empties):
+            raise UnsupportedDocument("empty node parent out of range")
+        if block_idx == 0:
+            doc_global_entity = global_entity
+
+        sentence_starts.append(len(forms))
+        for word_ord, form, parent, entity in sorted(words + empties, key=lambda word: word[0]):
+            if entity:
+                doc_misc.append((len(forms), entity))
+            forms.append(intern(form))
+            ords.append(word_ord)
+            empty_parents.append(parent)
+            sentence_of.append(block_idx)
+    sentence_starts.append(len(forms))
+    if docname is None:
+        raise UnsupportedDocument("document without a name")
+
+    mentions = _parse_entities(doc_misc, sentence_of, doc_global_entity)
+    return FastDocument(docname, forms, ords, empty_parents, sentence_starts, mentions)
+
+
+def _iter_blocks(file):
+    """Yields the sentence blocks (lists of lines) of every document in the file (name or handle)."""
+    with open_file(file, encoding="utf-8-sig") if isinstance(file, str) else nullcontext(file) as f:
+        blocks = []
+        lines = []
+        for line in f:
+            line = line.rstrip("\n")
+            if line:
+                lines.append(line)
+                continue
+            if lines:
+                if blocks and any(RE_NEWDOC.match(x) for x in lines if x[0] == "#"):
+                    yield blocks
+                    blocks = []
+                blocks.append(lines)
+                lines = []
+        if lines:
+            if blocks and any(RE_NEWDOC.match(x) for x in lines if x[0] == "#"):
+                yield blocks
+                blocks = []
+            blocks.append(lines)
+        if blocks:
+            yield blocks
+
+
+def iter_document_blocks(file):
+    """
+    Yields the sentence blocks of every document in the file (name or handle) with the
+    global.Entity declaration of the previous documents, which the document may override.
+    """
+    global_entity = None
+    for blocks in _iter_blocks(file):
+        yield blocks, global_entity
+        for lines in blocks:
+            for line in lines:
+                if line[0] != "#":
+                    break
+                match = RE_GLOBAL_ENTITY.match(line)
+                if match:
+                    global_entity = match.group(1)
+
+
+def document_source(blocks, global_entity):
+    """
+    The CoNLL-U source of the document, with the global.Entity declaration
+    of the previous documents if it does not have its own.
+    """
+    first = list(blocks[0])
+    if global_entity and not any(RE_GLOBAL_ENTITY.match(line) for line in first):
+        # right after newdoc, where udapi writes the declaration
+        newdoc = next((i for i, line in enumerate(first) if RE_NEWDOC.match(line)), -1)
+        first.insert(newdoc + 1, f"# global.Entity = {global_entity}")
+    return "\n\n".join("\n".join(lines) for lines in [first] + blocks[1:]) + "\n\n"
+
+
+def parse_document(blocks, global_entity):
+    """Returns the FastDocument, or the CoNLL-U source if the fast reader cannot handle the document."""
+    try:
+        return _parse_document(blocks, global_entity)
+    except UnsupportedDocument:
+        return document_source(blocks, global_entity)
+
+
+def iter_documents(filename):
+    """
+    Reads the CoNLL-U file one document at a time. Yields a FastDocument for every
+    document the fast reader can handle, otherwise the CoNLL-U source of the document.
+    """
+    for blocks, global_entity in iter_document_blocks(filename):
+        yield parse_document(blocks, global_entity)
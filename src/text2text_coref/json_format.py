@@ -1,127 +1,230 @@
-from text2text_coref.convert import shift_empty_node_recreate
+from text2text_coref.convert import shift_empty_nodes_recreate
 
-from .convert import shift_empty_node, reduce_discontinuous_mention
-import udapi
+from .convert import shift_empty_nodes, reduce_discontinuous_mention, fast_document_order, iter_converted_documents
 from collections import defaultdict
+from functools import partial
 import logging
 from .convert import read_data
-import pprint
-from compact_json import Formatter
-logging.basicConfig(format='%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-                    datefmt='%m/%d/%Y %H:%M:%S',
-                    level=logging.INFO)
+from . import diagnostics, stats
+from .compression import open_file
 logger = logging.getLogger()
 
 
 def convert_to_json(docs, out_file, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
-    output_data = []
-    for doc in docs:
-        eids = {}
-        out_words = []
-        if solve_empty_nodes:
-            for node in doc.nodes_and_empty:
-                if node.is_empty():
-                    shift_empty_node(node)
-            udapi_words = [word for word in doc.nodes_and_empty]
-        else:
-            udapi_words = [word for word in doc.nodes]
-        for word in udapi_words:
-            out_word = word.form.replace(" ", "_")
-            if word.is_empty():
-                out_word = "##" + (out_word if out_word != "_" and empty_node_form else "") # empty nodes start with ##
-            out_words.append(out_word)
-        clusters_token_offsets = None
-        clusters_text_mentions = None
-        if mark_entities:
-            node2id = {node: i for i, node in enumerate(doc.nodes_and_empty)}
-            clusters_token_offsets = []
-            clusters_text_mentions = []
-            for entity in doc.coref_entities:
-                entity_mentions = []
-                entity_mention_offsets = []
-                for mention in entity.mentions:
-                    if "," in mention.span:
-                        reduce_discontinuous_mention(mention)
-                    span_start = node2id[mention.words[0]]
-                    span_end = node2id[mention.words[-1]]
-                    entity_mention_offsets.append([span_start, span_end])
-                    entity_mentions.append(" ".join([word.form if not word.is_empty() else "##" + (word.form if word.form != "_" and empty_node_form else "") for word in mention.words]))
-                if sequential_ids:
-                    if entity.eid not in eids:
-                        eids[entity.eid] = f"e{len(eids) + 1}"
-                    eid = eids[entity.eid]
-                else:
-                    eid = entity.eid
-                clusters_token_offsets.append(entity_mention_offsets)
-                clusters_text_mentions.append(entity_mentions)
-        output_data.append({
-            "doc_id": doc.meta["docname"],
-            "tokens": out_words,
-            "clusters_token_offsets": clusters_token_offsets,
-            "clusters_text_mentions": clusters_text_mentions
-        })
+    output_data = [document_to_json(doc, solve_empty_nodes, mark_entities, sequential_ids, empty_node_form) for doc in docs]
+    write_json(output_data, out_file)
+
+
+def write_json(output_data, out_file):
+    from compact_json import Formatter
+
     formatter = Formatter()
     formatter.ensure_ascii = False
-    formatter.dump(output_data, out_file)
+    # Formatter.dump opens the file itself, without compression
+    with open_file(out_file, "w") as f:
+        f.write(formatter.serialize(output_data) + formatter.eol_str)
+
 
-def convert_conllu_file_to_json(filename, output_filename, zero_mentions, blind=False, sequential_ids=True, no_empty_node_form=False):
+def write_json_lines(output_data, out_file):
+    """Writes the documents one JSON object per line as they come, `output_data` may be any iterable."""
+    import json
+
+    with open_file(out_file, "w") as f:
+        for doc in output_data:
+            f.write(json.dumps(doc, ensure_ascii=False) + "\n")
+
+
+def iter_json_lines(filename):
+    """Yields the documents of a JSON Lines file one at a time."""
+    import json
+
+    with open_file(filename) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def document_to_json(doc, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
+    """Converts one udapi document into its JSON object."""
+    eids = {}
+    out_words = []
+    if solve_empty_nodes:
+        for tree in doc.trees:
+            shift_empty_nodes(tree)
+        udapi_words = [word for word in doc.nodes_and_empty]
+    else:
+        udapi_words = [word for word in doc.nodes]
+    for word in udapi_words:
+        out_word = word.form.replace(" ", "_")
+        if word.is_empty():
+            out_word = "##" + (out_word if out_word != "_" and empty_node_form else "") # empty nodes start with ##
+        out_words.append(out_word)
+    clusters_token_offsets = None
+    clusters_text_mentions = None
+    if mark_entities:
+        node2id = {node: i for i, node in enumerate(doc.nodes_and_empty)}
+        clusters_token_offsets = []
+        clusters_text_mentions = []
+        for entity in doc.coref_entities:
+            entity_mentions = []
+            entity_mention_offsets = []
+            for mention in entity.mentions:
+                if "," in mention.span:
+                    reduce_discontinuous_mention(mention)
+                span_start = node2id[mention.words[0]]
+                span_end = node2id[mention.words[-1]]
+                entity_mention_offsets.append([span_start, span_end])
+                entity_mentions.append(" ".join([word.form if not word.is_empty() else "##" + (word.form if word.form != "_" and empty_node_form else "") for word in mention.words]))
+            if sequential_ids:
+                if entity.eid not in eids:
+                    eids[entity.eid] = f"e{len(eids) + 1}"
+                eid = eids[entity.eid]
+            else:
+                eid = entity.eid
+            clusters_token_offsets.append(entity_mention_offsets)
+            clusters_text_mentions.append(entity_mentions)
+    return {
+        "doc_id": doc.meta["docname"],
+        "tokens": out_words,
+        "clusters_token_offsets": clusters_token_offsets,
+        "clusters_text_mentions": clusters_text_mentions
+    }
+
+
+def fast_document_to_json(doc, solve_empty_nodes=True, mark_entities=True, sequential_ids=False, empty_node_form=True):
+    """Same as document_to_json for a document read by the fast reader."""
+    order, rank = fast_document_order(doc, solve_empty_nodes)
+    out_words = []
+    for position in order:
+        out_word = doc.forms[position].replace(" ", "_")
+        if doc.is_empty(position):
+            out_word = "##" + (out_word if out_word != "_" and empty_node_form else "")
+        out_words.append(out_word)
+    clusters_token_offsets = None
+    clusters_text_mentions = None
+    if mark_entities:
+        # mention offsets always count the empty nodes, like node2id in document_to_json
+        if not solve_empty_nodes:
+            order = range(len(doc.forms))
+        word_form = [doc.forms[position] if not doc.is_empty(position)
+                     else "##" + (doc.forms[position] if doc.forms[position] != "_" and empty_node_form else "")
+                     for position in order]
+        entities = {}
+        for (_, _, eid), (first, last) in zip(doc.mentions, doc.mention_bounds(rank)):
+            offsets, texts = entities.setdefault(eid, ([], []))
+            offsets.append([first, last])
+            texts.append(" ".join(word_form[first:last + 1]))
+        clusters_token_offsets = [offsets for offsets, _ in entities.values()]
+        clusters_text_mentions = [texts for _, texts in entities.values()]
+    return {
+        "doc_id": doc.docname,
+        "tokens": out_words,
+        "clusters_token_offsets": clusters_token_offsets,
+        "clusters_text_mentions": clusters_text_mentions
+    }
+
+
+def convert_conllu_file_to_json(filename, output_filename, zero_mentions, blind=False, sequential_ids=True, no_empty_node_form=False, udapi_reader=False, jobs=1,
+                                jsonl=False, shard=None):
     if not output_filename:
-        output_filename = filename.replace(".conllu", ".json")
-    docs = read_data(filename)
-    convert_to_json(docs, output_filename, zero_mentions, not blind, sequential_ids, not no_empty_node_form)
+        output_filename = filename.replace(".conllu", ".jsonl" if jsonl else ".json")
+        if shard:
+            from .doc_index import shard_filename
+            output_filename = shard_filename(output_filename, shard)
+    if shard:
+        from .doc_index import open_shard
+        filename = open_shard(filename, shard)
+    options = dict(solve_empty_nodes=zero_mentions, mark_entities=not blind, sequential_ids=sequential_ids,
+                   empty_node_form=not no_empty_node_form)
+    output_data = iter_converted_documents(filename, partial(document_to_json, **options),
+                                           partial(fast_document_to_json, **options), udapi_reader, jobs)
+    if jsonl:
+        write_json_lines(output_data, output_filename)
+    else:
+        output_data = list(output_data)
+        with stats.stage("write"):
+            write_json(output_data, output_filename)
 
-def convert_json_to_conllu(json_filename, conllu_skeleton_filename, output_filename, use_gold_empty_nodes=True):
+def convert_json_to_conllu(json_filename, conllu_skeleton_filename, output_filename, use_gold_empty_nodes=True, udapi_writer=False,
+                           cache_dir=None, jsonl=False, shard=None):
     import json
-    from .convert import read_data, write_data, remove_empty_node
-    from udapi.core.document import Document
-    from udapi.block.corefud.movehead import MoveHead
+    from .convert import read_data, write_data, merge_into_skeleton
+    from .skeleton_merge import merge_json_document
 
-    with open(json_filename, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if not output_filename:
+        output_filename = json_filename.replace(".jsonl" if jsonl else ".json", ".conllu")
+    if shard:
+        from .doc_index import open_shard
+        conllu_skeleton_filename = open_shard(conllu_skeleton_filename, shard)
 
-    udapi_docs = read_data(conllu_skeleton_filename)
-    move_head = MoveHead()
-    for doc in udapi_docs:
-        doc._eid_to_entity = {}
+    if jsonl:
+        data = iter_json_lines(json_filename)
+    else:
+        with stats.stage("read_input"), open_file(json_filename) as f:
+            data = json.load(f)
+
+    if not udapi_writer:
+        output = merge_into_skeleton(data, conllu_skeleton_filename, merge_json_document, merge_json_into_udapi,
+                                     use_gold_empty_nodes)
+        with open_file(output_filename, "w") as f:
+            f.writelines(output)
+        return
+
+    data = list(data)
+    udapi_docs = read_data(conllu_skeleton_filename, cache_dir)
     assert len(udapi_docs) == len(data)
     for doc, udapi_doc in zip(data, udapi_docs):
-        words = doc["tokens"]
-        udapi_words = [word for word in udapi_doc.nodes]
-        for word in udapi_doc.nodes_and_empty:
-            word.misc = {}
-            # Remove empty nodes
-            if not use_gold_empty_nodes and word.is_empty():
-                remove_empty_node(word)
-            elif word.is_empty():
-                shift_empty_node_recreate(word)
-                # shift_empty_node(word)
+        with stats.document(), diagnostics.document(udapi_doc.meta["docname"]), stats.stage("udapi_merge"):
+            merge_json_into_udapi(doc, udapi_doc, use_gold_empty_nodes)
+    with open_file(output_filename, "w") as f:
+        write_data(udapi_docs, f)
+
 
+def merge_json_into_udapi(doc, udapi_doc, use_gold_empty_nodes=True):
+    """Replaces the coreference in the udapi document by the one from the JSON document."""
+    import udapi.core.coref
+    from .convert import create_empty_children, remove_empty_nodes
+    from udapi.block.corefud.movehead import MoveHead
+
+    move_head = MoveHead()
+    udapi_doc._eid_to_entity = {}
+    words = doc["tokens"]
+    udapi_words = [word for word in udapi_doc.nodes]
+    for tree in udapi_doc.trees:
+        for word in tree.descendants_and_empty:
+            word.misc = {}
+        # Remove empty nodes
         if not use_gold_empty_nodes:
-            j = 1
-            for i in range(len(udapi_words)):
-                word = udapi_words[i]
-                while j < len(words) and words[j].startswith("##"):
-                    word.create_empty_child("_", after=True)
-                    j += 1
-                j += 1
-        udapi_words = [word for word in udapi_doc.nodes_and_empty]
-        for i in range(len(udapi_words)):
-            if udapi_words[i].form != words[i].split("|")[0]:
-                logger.warning(f"WARNING: words do not match. DOC: {udapi_doc.meta['docname']}, word1: {words[i].split('|')[0]}, word2: {udapi_words[i].form}, i: {i}")
+            remove_empty_nodes(tree)
+        else:
+            shift_empty_nodes_recreate(tree)
+            # shift_empty_nodes(tree)
 
-        assert len(udapi_words) == len(words)
-        entities = {}
-        for entity in doc["clusters_token_offsets"]:
-            eid = f"e{len(entities) + 1}"
-            entities[eid] = udapi_doc.create_coref_entity(eid=eid)
-            for mention_offsets in entity:
-                span_start = mention_offsets[0]
-                span_end = mention_offsets[1]
-                entities[eid].create_mention(words=udapi_words[span_start: span_end + 1])
-        udapi.core.coref.store_coref_to_misc(udapi_doc)
-        move_head.run(udapi_doc)
-    if not output_filename:
-        output_filename = output_filename.replace(".json", ".conllu")
-    with open(output_filename, "w", encoding="utf-8") as f:
-        write_data(udapi_docs, f)
+    if not use_gold_empty_nodes:
+        j = 1
+        for i in range(len(udapi_words)):
+            word = udapi_words[i]
+            count = 0
+            while j < len(words) and words[j].startswith("##"):
+                count += 1
+                j += 1
+            create_empty_children(word, count)
+            j += 1
+    udapi_words = [word for word in udapi_doc.nodes_and_empty]
+    for i in range(len(udapi_words)):
+        if udapi_words[i].form != words[i].split("|")[0]:
+            diagnostics.report("word_mismatches", "Words do not match in %s: %s != %s at %d", udapi_doc.meta["docname"],
+                               words[i].split("|")[0], udapi_words[i].form, i)
 
+    assert len(udapi_words) == len(words)
+    stats.annotate(docname=udapi_doc.meta["docname"], tokens=len(udapi_words))
+    entities = {}
+    for entity in doc["clusters_token_offsets"]:
+        eid = f"e{len(entities) + 1}"
+        entities[eid] = udapi_doc.create_coref_entity(eid=eid)
+        for mention_offsets in entity:
+            span_start = mention_offsets[0]
+            span_end = mention_offsets[1]
+            entities[eid].create_mention(words=udapi_words[span_start: span_end + 1])
+    udapi.core.coref.store_coref_to_misc(udapi_doc)
+    move_head.run(udapi_doc)
@@ -1,9 +1,15 @@
-from collections import defaultdict
+from bisect import bisect_left
+from collections import Counter, defaultdict
 from itertools import chain
-from typing import List
-import re
+from contextlib import nullcontext
+from sys import intern
+from typing import Iterable, Iterator, List, TextIO
 import logging
 
+from . import diagnostics, stats
+from .compression import open_file
+from .tag_lexer import OPEN, SINGLETON, lex_entity_tags, tag_text
+
 logger = logging.getLogger(__name__)
 
 
@@ -20,53 +26,34 @@ def _correct_tags(tok_sentence):
     if not tok_sentence:
         return []
 
-    entity_stacks = defaultdict(lambda: [])
-    clean_toks = []
-
-    for word_idx, word in enumerate(tok_sentence):
-        splits = word.split("|")
-
-        if len(splits) == 1:
-            clean_toks.append(word)
-
-        elif len(splits) == 2:
-            tags = splits[1].split(",")
-
-            ptags = map(lambda x: re.match(r"(\[?)e(\d+)(]?)", x), tags)
-            ptags = map(lambda x: x.groups() if x else ("", "", ""), ptags)
+    forms, events = lex_entity_tags(tok_sentence)
+    entity_stacks = defaultdict(list)
+    word_tags = defaultdict(list)
 
-            clean_tags = []
+    for word_idx, eid, kind in events:
+        clean_tags = word_tags[word_idx]
+        tag = tag_text(eid, kind)
 
-            for left_bracket, entity_id, right_bracket in ptags:
-                tag = f"{left_bracket}e{entity_id}{right_bracket}"
-
-                if left_bracket and right_bracket:
-                    clean_tags.append(tag)
-
-                elif left_bracket:
-                    entity_stacks[entity_id].append((word_idx, len(clean_tags)))
-                    clean_tags.append(tag)
-
-                elif right_bracket:
-                    entity_stack = entity_stacks[entity_id]
-                    if len(entity_stack) > 0:
-                        entity_stacks[entity_id].pop()
-                        clean_tags.append(tag)
-                    else:
-                        num_wrong_para += 1
-                        clean_tags.append("[" + tag)
+        if kind == SINGLETON:
+            clean_tags.append(tag)
 
-                else:
-                    logging.debug(f"warning: completely invalid tag in: {word}")
+        elif kind == OPEN:
+            entity_stacks[eid].append((word_idx, len(clean_tags)))
+            clean_tags.append(tag)
 
-            if clean_tags:
-                clean_toks.append(f"{splits[0]}|{','.join(clean_tags)}")
+        else:
+            entity_stack = entity_stacks[eid]
+            if len(entity_stack) > 0:
+                entity_stack.pop()
+                clean_tags.append(tag)
             else:
-                clean_toks.append(splits[0])
+                num_wrong_para += 1
+                clean_tags.append("[" + tag)
 
-        else:
-            logging.debug(f"warning: multiple pipes in word {word}- stripping tags")
-            clean_toks.append(splits[0])
+    clean_toks = [
+        f"{form}|{','.join(word_tags[word_idx])}" if word_idx in word_tags else form
+        for word_idx, form in enumerate(forms)
+    ]
 
     # convert all unclosed entities to 1-word entities
     for entity, stack in entity_stacks.items():
@@ -79,7 +66,7 @@ def _correct_tags(tok_sentence):
 
                 tags = tags.split(",")
 
-                assert tags[tag_idx] == f"(e{entity}", (
+                assert tags[tag_idx] == f"({entity}", (
                     "Mismatched entity when correcting tags"
                 )
 
@@ -88,72 +75,249 @@ def _correct_tags(tok_sentence):
                 clean_toks[word_idx] = f"{word}|{','.join(tags)}"
 
             except Exception as ex:
-                logging.debug(f"{ex} while converting unclosed entitites")
+                logging.debug("%s while converting unclosed entitites", ex)
 
     if num_wrong_para:
-        sentence = " ".join(tok_sentence)
-        logging.debug(
-            f'{num_wrong_para} mismatched parantheses in sentence: "{sentence}"'
-        )
+        diagnostics.report("mismatched_brackets", '%d mismatched parantheses in sentence: "%s"', num_wrong_para,
+                           diagnostics.Joined(tok_sentence), n=num_wrong_para)
 
     return clean_toks
 
 
-def _word_level_edit_distance(words1, words2, tagged_words1, gold_zeros=False):
+# backtrack moves stored for every cell of the band
+_SKIP, _SAME, _REPLACE, _DELETE, _INSERT = range(5)
+_SKIP_BYTE = bytes([_SKIP])
+
+# initial slack of the band around the diagonal, doubled until the band is wide enough
+_INITIAL_SLACK = 16
+# a band covering more than this share of the table is replaced by the full table
+_FULL_BAND = 0.5
+
+
+def _band_moves(words1, words2, gold_zeros, slack):
     """
-    Uses an edit-distance-like algorithm to match up the words between
-    two versions of a document. Tagged words are used to carry over
-    as many entity annotations as possible - any words that remain the
-    same or can be tracked back to a "replace" operation keep their tags.
+    Fills the edit-distance table of `_word_level_edit_distance` only inside a band
+    around the diagonal and records the backtrack move of every cell.
+
+    The band of row i is centered on the number of non-empty words among the first
+    i words of words1 (empty nodes are deleted for free) and it is widened by
+    `slack` on both sides of the shift between the lengths of the two documents.
+    Only two rows of distances are kept, the moves are stored one byte per cell.
+
+    Returns the distance, the width of the band (the largest distance for which
+    the band is guaranteed to contain all optimal alignments), the moves and
+    the offset of every row in the moves (indexed by the column).
     """
     m, n = len(words1), len(words2)
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    skip = [not gold_zeros and word.startswith("##") for word in words1]
+    shift = n - (m - sum(skip))
+    x_lo = min(0, shift) - slack
+    x_hi = max(0, shift) + slack
+    inf = m + n + 1
+
+    moves = bytearray()
+    append = moves.append
+    row_offset = [0] * (m + 1)
 
-    # initialize the first row and column
-    for i in range(m + 1):
-        dp[i][0] = i
-    for j in range(n + 1):
-        dp[0][j] = j
+    prev_lo = 0
+    prev = list(range(0, min(n, x_hi) + 1))
+    non_empty = 0
 
-    # fill the dp table
     for i in range(1, m + 1):
-        for j in range(1, n + 1):
-            if not gold_zeros and words1[i - 1].startswith("##"):
-                # empty nodes are ignored (deleted for free)
-                dp[i][j] = dp[i - 1][j]
-            elif words1[i - 1] == words2[j - 1]:
-                dp[i][j] = dp[i - 1][j - 1]
+        word1 = words1[i - 1]
+        skipped = skip[i - 1]
+        if not skipped:
+            non_empty += 1
+        lo = max(0, non_empty + x_lo)
+        hi = min(n, non_empty + x_hi)
+        row_offset[i] = len(moves) - lo
+        # the previous row padded so that the cells outside its band are infinite,
+        # the band moves right by at most one column per row
+        padded = [inf] + prev + [inf]
+
+        if skipped:
+            # empty nodes are ignored (deleted for free)
+            cur = padded[lo - prev_lo + 1 : hi - prev_lo + 2]
+            if lo == 0:
+                cur[0] = i
+            moves.extend(_SKIP_BYTE * (hi - lo + 1))
+            prev, prev_lo = cur, lo
+            continue
+
+        if lo == 0:
+            append(_SKIP)  # placeholder for column 0, never read
+            cur = [i]
+            first = 1
+        else:
+            cur = []
+            first = lo
+        store = cur.append
+        left = cur[-1] if cur else inf
+        for word2, diag, up in zip(words2[first - 1 : hi], padded[first - prev_lo : hi - prev_lo + 1],
+                                   padded[first - prev_lo + 1 : hi - prev_lo + 2]):
+            if word1 == word2:
+                left = diag
+                append(_SAME)
+            elif diag <= up and diag <= left:
+                left = diag + 1
+                append(_REPLACE)
+            elif up <= left:
+                left = up + 1
+                append(_DELETE)
             else:
-                dp[i][j] = min(dp[i - 1][j], dp[i][j - 1], dp[i - 1][j - 1]) + 1
+                left += 1
+                append(_INSERT)
+            store(left)
+
+        prev, prev_lo = cur, lo
+
+    distance = prev[n - prev_lo]
+    return distance, abs(shift) + 2 * slack, moves, row_offset
+
+
+def _band_moves_numpy(words1, words2, gold_zeros, slack):
+    """
+    NumPy version of `_band_moves` with the same band and the same moves.
+
+    The words are interned into integer arrays and every row of the band is
+    computed at once. The dependency on the left neighbour within a row is
+    resolved with a running minimum of the distances shifted by the column.
+    """
+    import numpy as np
+
+    m, n = len(words1), len(words2)
+    skip = [not gold_zeros and word.startswith("##") for word in words1]
+    shift = n - (m - sum(skip))
+    x_lo = min(0, shift) - slack
+    x_hi = max(0, shift) + slack
+    inf = m + n + 1
+
+    vocab = {}
+    ids1 = np.fromiter((vocab.setdefault(word, len(vocab)) for word in words1), dtype=np.int32, count=m)
+    ids2 = np.fromiter((vocab.setdefault(word, len(vocab)) for word in words2), dtype=np.int32, count=n)
+
+    # bounds of the band in every row
+    non_empty = np.cumsum(~np.array(skip, dtype=bool))
+    lows = np.concatenate(([0], np.maximum(0, non_empty + x_lo)))
+    highs = np.concatenate(([min(n, x_hi)], np.minimum(n, non_empty + x_hi)))
+    starts = np.concatenate(([0], np.cumsum(highs - lows + 1)))
+
+    moves = np.zeros(starts[-1], dtype=np.uint8)
+    row_offset = (starts[:-1] - lows).tolist()
+    lows = lows.tolist()
+    highs = highs.tolist()
+    starts = starts.tolist()
+    columns = np.arange(n + 1, dtype=np.int32)
+
+    prev_lo = 0
+    prev = columns[: highs[0] + 1].copy()
+
+    for i in range(1, m + 1):
+        lo, hi = lows[i], highs[i]
+        row_moves = moves[starts[i] : starts[i + 1]]
+
+        if skip[i - 1]:
+            # empty nodes are ignored (deleted for free), the band does not move
+            cur = prev.copy()
+            row_moves[:] = _SKIP
+            if lo == 0:
+                cur[0] = i
+            prev, prev_lo = cur, lo
+            continue
+
+        first = max(lo, 1)  # column 0 has no move
+        width = hi - first + 1
+        up = np.full(width, inf, dtype=np.int32)
+        up_end = min(hi, prev_lo + len(prev) - 1)
+        up[: up_end - first + 1] = prev[first - prev_lo : up_end - prev_lo + 1]
+        diag = prev[first - 1 - prev_lo : hi - prev_lo]
+        same = ids2[first - 1 : hi] == ids1[i - 1]
+
+        best = np.where(same, diag, np.minimum(up, diag) + 1)
+        if lo == 0:
+            best = np.concatenate(([i], best))
+        # cur[j] = min(best[j], cur[j - 1] + 1)
+        shifted = columns[: len(best)]
+        cur = np.minimum.accumulate(best - shifted) + shifted
+        values = cur[len(cur) - width :]
+
+        row_moves[len(row_moves) - width :] = np.where(
+            same,
+            _SAME,
+            np.where(
+                values == diag + 1,
+                _REPLACE,
+                np.where(values == up + 1, _DELETE, _INSERT),
+            ),
+        )
+        prev, prev_lo = cur, lo
+
+    distance = int(prev[n - prev_lo])
+    return distance, abs(shift) + 2 * slack, moves.tobytes(), row_offset
+
+
+# implementations of the banded edit distance
+_ENGINES = {"python": _band_moves, "numpy": _band_moves_numpy}
+
+
+def _initial_slack(words1, words2, gold_zeros):
+    """
+    The slack of the first band, wide enough for a lower bound of the distance: every
+    word missing from one of the documents (counted as multisets) needs an edit.
+    """
+    words = Counter(word for word in words1 if gold_zeros or not word.startswith("##"))
+    shift = abs(len(words2) - sum(words.values()))
+    words.subtract(words2)
+    bound = max(sum(count for count in words.values() if count > 0), -sum(count for count in words.values() if count < 0))
+    return max(_INITIAL_SLACK, (bound - shift + 1) // 2)
+
+
+def _align(words1, words2, tagged_words1, gold_zeros, word_problems, inner=False, engine="python"):
+    """
+    Aligns words1 to words2 with the banded edit distance computed by the engine
+    ("python" or "numpy") and returns the words of the alignment in reverse order.
+    Edit operations are counted in word_problems.
+
+    When the aligned words are only a part of the document (inner), leading empty
+    nodes of words1 left over when words2 is exhausted are copied over like anywhere
+    else in the document instead of being dropped.
+    """
+    m, n = len(words1), len(words2)
+
+    slack = _initial_slack(words1, words2, gold_zeros)
+    while True:
+        if abs(m - n) + 2 * slack + 1 > _FULL_BAND * (n + 1):
+            # rerunning wider and wider bands would cost more than one pass over the full table
+            slack = max(m, n)
+        distance, width, moves, row_offset = _ENGINES[engine](words1, words2, gold_zeros, slack)
+        stats.count("dp_cells", len(moves))
+        if distance <= width:
+            break
+        # the distance inside the band is an upper bound of the true distance
+        slack = min(2 * slack, (distance - (width - 2 * slack) + 1) // 2)
 
     # backtrack to extract sentence with appropriate tags.
     result = []
-    word_problems = defaultdict(int)
 
     i, j = m, n
 
     while i > 0 and j > 0:
-        if not gold_zeros and words1[i - 1].startswith("##"):
-            # empty nodes always copied over
-            result.append(tagged_words1[i - 1])
-            i -= 1
-        elif words1[i - 1] == words2[j - 1]:
-            # same case - actually use tags
+        move = moves[row_offset[i] + j]
+        if move == _SKIP or move == _SAME:
+            # same case or empty node - actually use tags
             result.append(tagged_words1[i - 1])
             i -= 1
-            j -= 1
-        elif dp[i][j] == dp[i - 1][j - 1] + 1:
-            # replace case
+            if move == _SAME:
+                j -= 1
+        elif move == _REPLACE:
             result.append(words2[j - 1])
             word_problems["replace"] += 1
             i -= 1
             j -= 1
-        elif dp[i][j] == dp[i - 1][j] + 1:
-            # delete case
+        elif move == _DELETE:
             word_problems["delete"] += 1
             i -= 1
         else:
-            # insert case
             result.append(words2[j - 1])
             word_problems["insert"] += 1
             j -= 1
@@ -163,70 +327,235 @@ def _word_level_edit_distance(words1, words2, tagged_words1, gold_zeros=False):
         word_problems["insert"] += 1
         j -= 1
 
+    while inner and i > 0:
+        if not gold_zeros and words1[i - 1].startswith("##"):
+            result.append(tagged_words1[i - 1])
+        else:
+            word_problems["delete"] += 1
+        i -= 1
+
+    return result
+
+
+def _word_level_edit_distance(words1, words2, tagged_words1, gold_zeros=False, engine="python"):
+    """
+    Uses an edit-distance-like algorithm to match up the words between
+    two versions of a document. Tagged words are used to carry over
+    as many entity annotations as possible - any words that remain the
+    same or can be tracked back to a "replace" operation keep their tags.
+
+    The table is only computed inside a band around the diagonal which is
+    widened until it contains every optimal alignment, so the memory needed
+    is proportional to the document length times the number of edits instead
+    of the product of the document lengths. The first band is as wide as a
+    lower bound of the distance and a band covering half of the table is
+    replaced by the full table, so documents which do not match at all are
+    not aligned again and again. The resulting alignment is the
+    same as the one of the full table. The "numpy" engine computes the same
+    table row by row with NumPy.
+    """
+    word_problems = defaultdict(int)
+    result = _align(words1, words2, tagged_words1, gold_zeros, word_problems, engine=engine)
+
     if word_problems:
-        logger.debug(f"word_problems: {dict(word_problems)}")
+        for problem, count in word_problems.items():
+            diagnostics.report(problem, n=count)
 
     result.reverse()
     return result
 
 
-def _clean_document(document, gold_tok2, gold_zeros=False):
+def _find_anchors(words1, words2, gold_zeros):
+    """
+    Finds pairs of positions of words that occur exactly once in both documents
+    and keeps the longest sequence of them that is increasing in both documents
+    (patience alignment). Every anchor is then extended to the neighbouring
+    words as long as they match.
+    """
+    counts1 = defaultdict(int)
+    for word in words1:
+        counts1[word] += 1
+    counts2 = defaultdict(int)
+    for word in words2:
+        counts2[word] += 1
+    positions2 = {word: j for j, word in enumerate(words2) if counts2[word] == 1}
+
+    candidates = [
+        (i, positions2[word])
+        for i, word in enumerate(words1)
+        if counts1[word] == 1
+        and word in positions2
+        and (gold_zeros or not word.startswith("##"))
+    ]
+
+    # longest increasing subsequence of the gold positions (patience sorting)
+    tails = []
+    tail_idx = []
+    predecessors = [-1] * len(candidates)
+    for k, (_, j) in enumerate(candidates):
+        pile = bisect_left(tails, j)
+        if pile == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pile] = j
+            tail_idx[pile] = k
+        predecessors[k] = tail_idx[pile - 1] if pile > 0 else -1
+
+    unique_anchors = []
+    k = tail_idx[-1] if tail_idx else -1
+    while k >= 0:
+        unique_anchors.append(candidates[k])
+        k = predecessors[k]
+    unique_anchors.reverse()
+
+    def matches(i, j):
+        return words1[i] == words2[j] and (gold_zeros or not words1[i].startswith("##"))
+
+    # extend the anchors over the matching neighbours, the start and the end
+    # of the documents are used as anchors too
+    bounds = [(-1, -1)] + unique_anchors + [(len(words1), len(words2))]
+    starts = list(bounds)
+    # extend backwards first, the later word is kept like in the backtrack of the edit distance
+    for k in range(len(bounds) - 1, 0, -1):
+        i, j = bounds[k]
+        prev_i, prev_j = bounds[k - 1]
+        while i - 1 > prev_i and j - 1 > prev_j and matches(i - 1, j - 1):
+            i -= 1
+            j -= 1
+        starts[k] = (i, j)
+    anchors = []
+    for k in range(len(bounds) - 1):
+        start_i, start_j = starts[k]
+        end_i, end_j = bounds[k]
+        next_i, next_j = starts[k + 1]
+        while end_i + 1 < next_i and end_j + 1 < next_j and matches(end_i + 1, end_j + 1):
+            end_i += 1
+            end_j += 1
+        anchors.extend((i, start_j + i - start_i) for i in range(max(start_i, 0), end_i + 1))
+    # the end of the documents
+    start_i, start_j = starts[-1]
+    anchors.extend((i, start_j + i - start_i) for i in range(start_i, len(words1)))
+
+    return anchors
+
+
+def _anchored_edit_distance(words1, words2, tagged_words1, gold_zeros=False, engine="python"):
+    """
+    Splits the documents on anchors (see `_find_anchors`), keeps the tags of the
+    anchor words and aligns only the parts between the anchors with the edit
+    distance.
+
+    This is much faster than aligning the whole document when the documents are
+    nearly the same, but the alignment of the parts is not guaranteed to be
+    the same as the alignment of the whole document.
+
+    Returns None if there are no anchors.
+    """
+    anchors = _find_anchors(words1, words2, gold_zeros)
+    if not anchors:
+        return None
+
+    result = []
+    word_problems = defaultdict(int)
+
+    prev_i, prev_j = -1, -1
+    for i, j in anchors + [(len(words1), len(words2))]:
+        if i > prev_i + 1 or j > prev_j + 1:
+            gap = _align(
+                words1[prev_i + 1 : i],
+                words2[prev_j + 1 : j],
+                tagged_words1[prev_i + 1 : i],
+                gold_zeros,
+                word_problems,
+                inner=prev_i >= 0,
+                engine=engine,
+            )
+            gap.reverse()
+            result.extend(gap)
+        if i < len(words1):
+            result.append(tagged_words1[i])
+        prev_i, prev_j = i, j
+
+    if word_problems:
+        for problem, count in word_problems.items():
+            diagnostics.report(problem, n=count)
+
+    return result
+
+
+def _clean_document(document, gold_tok2, gold_zeros=False, anchors=False, tiers=None, engine="python"):
     """
     Applies both stages of cleaning on one document.
+
+    The words are aligned by the first tier that applies: "exact" when the
+    words already match the gold document, "anchored" when anchors are enabled
+    and found (see `_anchored_edit_distance`), "full" otherwise. The tier used
+    is counted in tiers. The engine computes the edit distance (see `_ENGINES`).
     """
     doc_words = document.split()
 
-    stripped_doc = [word.split("|")[0] for word in doc_words]
+    stripped_doc = [word.partition("|")[0] for word in doc_words]
     flattened_gold = list(chain(*gold_tok2))
-
-    correct_words = _word_level_edit_distance(
-        stripped_doc, flattened_gold, doc_words, gold_zeros
-    )
+    stats.annotate(tokens=len(flattened_gold), predicted_words=len(doc_words))
+
+    correct_words = None
+    with stats.stage("align"):
+        if stripped_doc == flattened_gold and (
+            gold_zeros or not any(word.startswith("##") for word in stripped_doc)
+        ):
+            tier = "exact"
+            correct_words = doc_words
+        elif anchors:
+            tier = "anchored"
+            correct_words = _anchored_edit_distance(
+                stripped_doc, flattened_gold, doc_words, gold_zeros, engine
+            )
+        if correct_words is None:
+            tier = "full"
+            correct_words = _word_level_edit_distance(
+                stripped_doc, flattened_gold, doc_words, gold_zeros, engine
+            )
+
+    logger.debug("alignment tier: %s", tier)
+    stats.annotate(tier=tier)
+    if tiers is not None:
+        tiers[tier] += 1
 
     final_sentences = []
 
     offset = 0
-    for ref_sentence in gold_tok2:
-        ln = len(ref_sentence)
-        i = 0
-        zeros = 0
-        if not gold_zeros:
-            while i < ln:
-                if not correct_words[offset + i + zeros].startswith("##"):
-                    # empty nodes are always copied over
-                    i += 1
-                else:
-                    zeros += 1
-        sentence = correct_words[offset : offset + ln + zeros]
-        offset += ln + zeros
-        correct_sentence = _correct_tags(sentence)
-        assert len(correct_sentence) == len(ref_sentence) + zeros
-        final_sentences.append(" ".join(correct_sentence))
+    with stats.stage("correct_tags"):
+        for ref_sentence in gold_tok2:
+            ln = len(ref_sentence)
+            i = 0
+            zeros = 0
+            if not gold_zeros:
+                while i < ln:
+                    if not correct_words[offset + i + zeros].startswith("##"):
+                        # empty nodes are always copied over
+                        i += 1
+                    else:
+                        zeros += 1
+            sentence = correct_words[offset : offset + ln + zeros]
+            offset += ln + zeros
+            correct_sentence = _correct_tags(sentence)
+            assert len(correct_sentence) == len(ref_sentence) + zeros
+            final_sentences.append(" ".join(correct_sentence))
 
     return " ".join(final_sentences)
 
 
-def read_conllu(filename: str, zero_mentions: bool) -> List[List[List[str]]]:
+def iter_conllu(filename: str | TextIO, zero_mentions: bool) -> Iterator[List[List[str]]]:
     """
-    Parses a CoNLL-U file into a list structure. Only loads the minimal information
-    needed to correct sentence structure.
-
-    The list structure is as follows:
-    - first outer list corresponds to documents
-    - the next list corresponds to sentences
-    - final inner list corresponds to word tokens
-
-    The zero mentions switch determines whether zero mentions should be included
-    (True) or skipped (False).
+    Reads a CoNLL-U file (name or handle) line by line and yields the documents
+    one at a time in the structure of `read_conllu`.
     """
-    with open(filename, "r", encoding="utf-8") as f:
-        gold = f.readlines()
-
-        gold_docs_tok2 = []
+    with open_file(filename) if isinstance(filename, str) else nullcontext(filename) as f:
         next_doc = []
         next_sent: List[str] = []
 
-        for line in gold:
+        for line in f:
             if not line.strip():
                 continue
 
@@ -240,7 +569,7 @@ def read_conllu(filename: str, zero_mentions: bool) -> List[List[List[str]]]:
 
                 if begins_new_doc:
                     if next_doc:
-                        gold_docs_tok2.append(next_doc)
+                        yield next_doc
                     next_doc = []
 
                 continue
@@ -253,26 +582,214 @@ def read_conllu(filename: str, zero_mentions: bool) -> List[List[List[str]]]:
             if "-" in number:
                 continue  # always skip multitokens
 
-            next_sent.append(word)
+            # the gold words are often kept for many runs, equal forms share one string
+            next_sent.append(intern(word))
 
         next_doc.append(next_sent)
-        gold_docs_tok2.append(next_doc)
+        yield next_doc
+
+
+def read_conllu(filename: str | TextIO, zero_mentions: bool, cache_dir: str | None = None) -> List[List[List[str]]]:
+    """
+    Parses a CoNLL-U file into a list structure. Only loads the minimal information
+    needed to correct sentence structure.
+
+    The list structure is as follows:
+    - first outer list corresponds to documents
+    - the next list corresponds to sentences
+    - final inner list corresponds to word tokens
+
+    The zero mentions switch determines whether zero mentions should be included
+    (True) or skipped (False). With `cache_dir`, the structure is loaded from the
+    on-disk skeleton cache when the same file was read before.
+    """
+    if cache_dir and isinstance(filename, str):
+        from .skeleton_cache import load_cached
+        return load_cached(cache_dir, filename, "conllu", read_conllu, zero_mentions)
+    return list(iter_conllu(filename, zero_mentions))
 
-    return gold_docs_tok2
+
+def iter_input_file(filename: str) -> Iterator[str]:
+    """
+    Reads an input file line by line and yields the documents one at a time.
+    """
+    with open_file(filename) as f:
+        for line in f:
+            yield line.strip()
 
 
 def read_input_file(filename: str) -> List[str]:
     """
     Reads an input file as a list of documents.
     """
-    with open(filename, "r", encoding="utf-8") as f:
-        return [line.strip() for line in f.readlines()]
+    return list(iter_input_file(filename))
+
+
+def _try_clean_document(index, document, gold_tok2, gold_zeros, anchors, tiers, engine, cache_dir=None,
+                        strict=False):
+    """
+    Cleans one document. A failure is logged and counted (`failed_documents`)
+    and the document is replaced by the gold words without any entities so that
+    the other documents are kept, with `strict` it is raised. With `cache_dir`,
+    a document cleaned before is taken from the cleaning cache (the "cached"
+    tier) and a newly cleaned one is stored there.
+    """
+    with stats.document(), diagnostics.document(index):
+        if cache_dir:
+            from . import clean_cache
+
+            path = clean_cache.entry_path(cache_dir, document, gold_tok2, gold_zeros, anchors)
+            clean = clean_cache.load(path)
+            if clean is not None:
+                tiers["cached"] += 1
+                stats.annotate(tier="cached")
+                stats.count("cache_hits")
+                return clean
+            stats.count("cache_misses")
+        try:
+            clean = _clean_document(document, gold_tok2, gold_zeros, anchors, tiers, engine)
+        except Exception as ex:
+            if strict:
+                raise
+            logging.error("Cleaning of document %s failed (%r), using the gold words without entities", index, ex)
+            diagnostics.report("failed_documents")
+            tiers["failed"] += 1
+            stats.annotate(tier="failed")
+            return " ".join(chain(*gold_tok2))
+        if cache_dir:
+            clean_cache.store(path, clean)
+        return clean
+
+
+def _log_tiers(tiers, cache_dir):
+    logging.info(f"Alignment tiers: {dict(tiers)}")
+    if cache_dir:
+        from . import clean_cache
+
+        hits = tiers.get("cached", 0)
+        logging.info(f"Cleaning cache: {hits} hits, {sum(tiers.values()) - hits} misses")
+        clean_cache.evict(cache_dir)
+
+
+def _clean_chunk(chunk, gold_zeros, anchors, engine, cache_dir=None, strict=False):
+    tiers = defaultdict(int)
+    clean = [
+        _try_clean_document(index, doc, gold_doc, gold_zeros, anchors, tiers, engine, cache_dir, strict)
+        for index, doc, gold_doc in chunk
+    ]
+    return clean, tiers, stats.take()
+
+
+def _chunk_documents(docs, gold, jobs):
+    """
+    Groups the documents into chunks of roughly the same number of gold words,
+    several chunks per job so that long documents do not keep one worker busy
+    while the others are idle.
+    """
+    sizes = [sum(len(sentence) for sentence in gold_doc) for gold_doc in gold]
+    target = max(1, sum(sizes) // (4 * jobs))
+    chunks = []
+    chunk = []
+    chunk_size = 0
+    for index, (doc, gold_doc, size) in enumerate(zip(docs, gold, sizes)):
+        chunk.append((index, doc, gold_doc))
+        chunk_size += size
+        if chunk_size >= target:
+            chunks.append(chunk)
+            chunk = []
+            chunk_size = 0
+    if chunk:
+        chunks.append(chunk)
+    return chunks
 
 
 def clean_data(
-    docs: List[str], gold: List[List[List[str]]], gold_zeros: bool = False
+    docs: List[str],
+    gold: List[List[List[str]]],
+    gold_zeros: bool = False,
+    anchors: bool = False,
+    engine: str = "python",
+    jobs: int = 1,
+    cache_dir: str | None = None,
+    strict: bool = False,
 ) -> List[str]:
-    return [_clean_document(doc, gold_doc, gold_zeros) for doc, gold_doc in zip(docs, gold)]
+    """
+    Cleans the documents against the gold documents. With more than one job
+    the documents are cleaned in a process pool, the order is kept. With
+    `cache_dir`, only the documents missing in the cleaning cache are cleaned.
+    A document which fails to clean is replaced by its gold words without
+    entities, with `strict` the failure stops the run instead.
+    """
+    if jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        from functools import partial
+
+        chunks = _chunk_documents(docs, gold, jobs)
+        clean_chunk = partial(_clean_chunk, gold_zeros=gold_zeros, anchors=anchors, engine=engine,
+                              cache_dir=cache_dir, strict=strict)
+        clean = []
+        tiers = defaultdict(int)
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=stats.init_worker, initargs=(stats.enabled(),)
+        ) as executor:
+            for chunk_clean, chunk_tiers, chunk_stats in executor.map(clean_chunk, chunks):
+                clean.extend(chunk_clean)
+                for tier, count in chunk_tiers.items():
+                    tiers[tier] += count
+                stats.merge(chunk_stats)
+    else:
+        clean, tiers, chunk_stats = _clean_chunk(zip(range(len(docs)), docs, gold), gold_zeros, anchors, engine,
+                                                 cache_dir, strict)
+        stats.merge(chunk_stats)
+    _log_tiers(tiers, cache_dir)
+    return clean
+
+
+def iter_clean_data(
+    docs: Iterable[str],
+    gold: Iterable[List[List[str]]],
+    gold_zeros: bool = False,
+    anchors: bool = False,
+    engine: str = "python",
+    jobs: int = 1,
+    cache_dir: str | None = None,
+    strict: bool = False,
+) -> Iterator[str]:
+    """
+    Lazy version of `clean_data`, the documents are read from the iterables and
+    the cleaned documents are yielded in order as soon as they are ready. With
+    more than one job, at most two documents per job are being cleaned at once.
+    """
+    pairs = enumerate(zip(docs, gold))
+    tiers = defaultdict(int)
+    if jobs > 1:
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        def collect(future):
+            chunk_clean, chunk_tiers, chunk_stats = future.result()
+            for tier, count in chunk_tiers.items():
+                tiers[tier] += count
+            stats.merge(chunk_stats)
+            return chunk_clean
+
+        with ProcessPoolExecutor(
+            max_workers=jobs, initializer=stats.init_worker, initargs=(stats.enabled(),)
+        ) as executor:
+            pending = deque()
+            for index, (doc, gold_doc) in pairs:
+                pending.append(
+                    executor.submit(_clean_chunk, [(index, doc, gold_doc)], gold_zeros, anchors, engine, cache_dir,
+                                    strict)
+                )
+                if len(pending) >= 2 * jobs:
+                    yield from collect(pending.popleft())
+            while pending:
+                yield from collect(pending.popleft())
+    else:
+        for index, (doc, gold_doc) in pairs:
+            yield _try_clean_document(index, doc, gold_doc, gold_zeros, anchors, tiers, engine, cache_dir, strict)
+    _log_tiers(tiers, cache_dir)
 
 
 def clean_file(
@@ -280,20 +797,88 @@ def clean_file(
     gold_filename: str,
     output_filename: str | None = None,
     zero_mentions: bool = True,
+    anchors: bool = False,
+    engine: str = "python",
+    jobs: int = 1,
+    stream: bool = False,
+    cache_dir: str | None = None,
+    chunks: str | None = None,
+    shard: tuple[int, int] | None = None,
+    strict: bool = False,
 ):
+    """
+    Cleans the input file against the gold CoNLL-U file. When streaming, the
+    documents are read, cleaned and written one at a time so that the memory
+    is bounded by the largest document instead of the whole file. Otherwise the
+    gold file is read through the skeleton cache in `cache_dir` if given. In both
+    cases, the documents cleaned before are taken from the cleaning cache in
+    `cache_dir` (see `clean_cache`). With `chunks` (the metadata file of
+    `conllu2text --max_tokens`), every line is a chunk cleaned against its
+    sentences of the gold document and the chunks are merged into documents. With
+    `shard` (i, N), the input documents are the i-th of N parts of the gold file (see
+    `doc_index`). A document which fails to clean is replaced by its gold words
+    without entities unless `strict` (see `clean_data`).
+    """
+    if not output_filename:
+        output_filename = filename.replace(".txt", "-cleaned.txt")
+    gold_file = gold_filename
+    if shard:
+        from .doc_index import open_shard
+        gold_file = open_shard(gold_filename, shard)
+
+    if stream and chunks:
+        raise ValueError("chunks can not be cleaned while streaming")
+    if stream:
+        logging.info(f"Cleaning {filename} with gold file {gold_filename} to {output_filename}")
+        clean = iter_clean_data(
+            iter_input_file(filename),
+            iter_conllu(gold_file, zero_mentions),
+            gold_zeros=zero_mentions,
+            anchors=anchors,
+            engine=engine,
+            jobs=jobs,
+            cache_dir=cache_dir,
+            strict=strict,
+        )
+        with open_file(output_filename, "w") as f:
+            for line in clean:
+                f.write(line + "\n")
+        return
+
     logging.info(f"Reading input file: {filename}")
-    data = read_input_file(filename)
+    with stats.stage("read_input"):
+        data = read_input_file(filename)
 
     logging.info(f"Reading gold file: {gold_filename}")
-    gold_docs_tok2 = read_conllu(gold_filename, zero_mentions)
+    with stats.stage("read_gold"):
+        gold_docs_tok2 = read_conllu(gold_file, zero_mentions, cache_dir)
 
-    logging.info("Cleaning data")
-    clean = clean_data(data, gold_docs_tok2, gold_zeros=zero_mentions)
+    if chunks:
+        from .chunking import merge_chunks, read_metadata
 
-    if not output_filename:
-        output_filename = filename.replace(".txt", "-cleaned.txt")
+        chunks = read_metadata(chunks)
+        # the sentences of the gold document of every chunk
+        gold_docs_tok2 = [
+            gold_docs_tok2[chunk["doc"]][chunk["first_sentence"] : chunk["first_sentence"] + len(chunk["sentences"])]
+            for chunk in chunks
+        ]
+
+    logging.info("Cleaning data")
+    clean = clean_data(
+        data, gold_docs_tok2, gold_zeros=zero_mentions, anchors=anchors, engine=engine, jobs=jobs,
+        cache_dir=cache_dir, strict=strict,
+    )
+    if chunks:
+        logging.info(f"Merging {len(chunks)} chunks")
+        with stats.stage("merge_chunks"):
+            # the cleaned chunks have the words of the gold sentences
+            chunks = [
+                {**chunk, "sentences": [len(sentence) for sentence in gold_doc], "zero_mentions": zero_mentions}
+                for chunk, gold_doc in zip(chunks, gold_docs_tok2)
+            ]
+            clean = merge_chunks(clean, chunks)
 
     logging.info(f"Writing output file: {output_filename}")
-    with open(output_filename, "w", encoding="utf-8") as f:
+    with stats.stage("write"), open_file(output_filename, "w") as f:
         clean = [line + "\n" for line in clean]
         f.writelines(clean)
@@ -0,0 +1,148 @@
+"""
+Long-running `serve` mode keeping the skeleton/gold documents in memory.
+
+The skeleton files are loaded once (see `api.Skeleton`) and requests are then
+answered one JSON object per line, from stdin to stdout or over a Unix socket.
+Every request names the command and the document (its `# newdoc id`):
+
+    {"id": 1, "command": "clean", "doc_id": "doc1", "text": "...", "zero_mentions": true}
+    {"id": 1, "ok": true, "text": "..."}
+
+Commands (options in brackets, with the defaults of the CLI):
+
+- `documents`: ids of the loaded documents (`doc_ids`),
+- `load` `filename`: loads another skeleton file,
+- `conllu2text` [`zero_mentions`, `blind`, `sequential_ids`, `empty_node_form`]: `text` of the document,
+- `conllu2json` [the same]: JSON `document`,
+- `clean` `text` [`zero_mentions`, `anchors`, `engine`]: cleaned `text`,
+- `text2conllu` `text` [`zero_mentions`]: the document merged with the text as `conllu`,
+- `json2conllu` `document` [`use_gold_empty_nodes`]: the same for a JSON document.
+
+Failed requests are answered with `"ok": false` and the `error`.
+"""
+import json
+import logging
+import sys
+
+from . import api, diagnostics
+from .fast_reader import RE_NEWDOC
+
+logger = logging.getLogger()
+
+
+class Server:
+    """The resident documents and the commands answering the requests."""
+
+    def __init__(self, filenames=()):
+        # one single-document Skeleton per document, its gold words are computed once
+        self.documents = {}
+        for filename in filenames:
+            self.load(filename)
+
+    def load(self, filename):
+        skeleton = api.Skeleton.from_file(filename)
+        doc_ids = []
+        for index, document in enumerate(skeleton.documents):
+            doc_id = _doc_id(document[0]) or f"{filename}#{index}"
+            if doc_id in self.documents:
+                logger.warning(f"Document {doc_id} from {filename} is already loaded, keeping the first one")
+                continue
+            self.documents[doc_id] = api.Skeleton([document])
+            doc_ids.append(doc_id)
+        logger.info(f"Loaded {len(doc_ids)} documents from {filename}")
+        return doc_ids
+
+    def _skeleton(self, request):
+        doc_id = request["doc_id"]
+        if doc_id not in self.documents:
+            raise ValueError(f"unknown document {doc_id}")
+        return self.documents[doc_id]
+
+    def handle(self, request):
+        """Returns the response to one request (a dict)."""
+        command = request.get("command")
+        if command == "documents":
+            return {"doc_ids": list(self.documents)}
+        if command == "load":
+            return {"doc_ids": self.load(request["filename"])}
+        if command in ("conllu2text", "conllu2json"):
+            convert = api.conllu_to_text if command == "conllu2text" else api.conllu_to_json
+            result = convert(self._skeleton(request), request.get("zero_mentions", False), request.get("blind", False),
+                             request.get("sequential_ids", False), request.get("empty_node_form", True))[0]
+            return {"text": result} if command == "conllu2text" else {"document": result}
+        if command == "clean":
+            zero_mentions = request.get("zero_mentions", True)
+            gold = self._skeleton(request).gold(zero_mentions)
+            return {"text": api.clean([request["text"]], gold, zero_mentions, request.get("anchors", False),
+                                      request.get("engine", "python"))[0]}
+        if command == "text2conllu":
+            return {"conllu": api.text_to_conllu([request["text"]], self._skeleton(request),
+                                                 request.get("zero_mentions", False))}
+        if command == "json2conllu":
+            return {"conllu": api.json_to_conllu([request["document"]], self._skeleton(request),
+                                                 request.get("use_gold_empty_nodes", False))}
+        raise ValueError(f"unknown command {command}")
+
+    def respond(self, line):
+        """Answers one line of the protocol, returns the response line."""
+        request = {}
+        # the first problems of every request are logged
+        diagnostics.reset()
+        try:
+            request = json.loads(line)
+            response = {"ok": True, **self.handle(request)}
+        except Exception as ex:
+            logger.error(f"Request failed: {ex!r}")
+            response = {"ok": False, "error": f"{type(ex).__name__}: {ex}"}
+        if isinstance(request, dict) and "id" in request:
+            response = {"id": request["id"], **response}
+        return json.dumps(response, ensure_ascii=False) + "\n"
+
+    def serve_lines(self, lines, out):
+        for line in lines:
+            if line.strip():
+                out.write(self.respond(line))
+                out.flush()
+
+
+def _doc_id(blocks):
+    for line in blocks[0]:
+        match = RE_NEWDOC.match(line)
+        if match and match.group(1):
+            return match.group(1).strip()
+    return None
+
+
+def serve(skeleton_filenames, socket=None):
+    """
+    Loads the skeleton files and answers the requests from stdin (to stdout) or
+    from the clients of a Unix socket until the input ends or the server is stopped.
+    """
+    server = Server(skeleton_filenames)
+    if socket is None:
+        # the udapi writer redirects sys.stdout while writing, keep the real one
+        server.serve_lines(sys.stdin, sys.stdout)
+        return
+
+    import os
+    import signal
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(server.respond(line.decode("utf-8")).encode("utf-8"))
+
+    if os.path.exists(socket):
+        os.remove(socket)
+    # stopped by SIGTERM as well, the socket is removed in both cases
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    with socketserver.UnixStreamServer(socket, Handler) as unix_server:
+        logger.info(f"Listening on {socket}")
+        try:
+            unix_server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(socket)
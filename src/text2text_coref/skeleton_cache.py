@@ -0,0 +1,98 @@
+"""
+On-disk cache of preprocessed skeleton and gold CoNLL-U files.
+
+The same skeleton is usually read many times (every clean, text2conllu and
+json2conllu run of an experiment), so the result of `convert.read_data`
+(udapi documents after MoveHead and SingleParent) and of
+`output_cleaner.read_conllu` is pickled into the cache directory. The entries
+are keyed by the hash of the file content, the reader and its options, so
+a changed file is never served from the cache. The least recently used
+entries are deleted when the cache grows over its size limit.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import tempfile
+from importlib.metadata import PackageNotFoundError, version
+
+logger = logging.getLogger()
+
+CACHE_VERSION = 1
+CACHE_SIZE = 2 * 1024 ** 3
+SUFFIX = ".skeleton.pickle"
+
+
+def _udapi_version():
+    try:
+        return version("udapi")
+    except PackageNotFoundError:
+        return ""
+
+
+def cache_key(filename, kind, *options):
+    """Hash of the file content, the reader (`kind`) and its options."""
+    digest = hashlib.sha256(f"{CACHE_VERSION} {kind} {options} {_udapi_version()}\n".encode())
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _evict(cache_dir, max_size, suffix=SUFFIX):
+    """Deletes the least recently used entries until the cache fits into `max_size` bytes."""
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(suffix):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue  # deleted by another process
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def load_cached(cache_dir, filename, kind, read, *options, max_size=CACHE_SIZE):
+    """
+    Returns `read(filename, *options)`, from the cache if the same file was read
+    with the same options before, otherwise the result is stored in the cache.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, f"{kind}-{cache_key(filename, kind, *options)}{SUFFIX}")
+    try:
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        os.utime(path)  # the modification time orders the entries for the eviction
+        logger.info(f"Loaded {filename} from the cache {path}")
+        return data
+    except FileNotFoundError:
+        pass
+    except (EOFError, pickle.UnpicklingError):
+        logger.warning(f"Ignoring the broken cache entry {path}")
+
+    data = read(filename, *options)
+    # pickle recurses through the udapi trees, deep trees need more than the default limit
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, 10000))
+    try:
+        # written under a temporary name, so that other processes never read a partial entry
+        with tempfile.NamedTemporaryFile(dir=cache_dir, suffix=".tmp", delete=False) as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f.name, path)
+    except RecursionError:
+        logger.warning(f"{filename} is too deeply nested to be cached")
+        os.remove(f.name)
+        return data
+    finally:
+        sys.setrecursionlimit(limit)
+    _evict(cache_dir, max_size)
+    return data
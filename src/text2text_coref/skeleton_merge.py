@@ -0,0 +1,547 @@
+"""
+Skeleton-merge engine for text2conllu and json2conllu.
+
+The udapi engine loads the skeleton into udapi documents, clears the MISC
+column, rebuilds the empty nodes, creates the predicted mentions, moves their
+heads with corefud.MoveHead and serializes everything with write.Conllu. This
+engine parses the skeleton lines of one document, replays the same steps on
+plain lists and writes the CoNLL-U lines directly, so the output is the same.
+Documents with anything it does not replay (empty nodes attached to the root
+or to other empty nodes, mentions across sentences, json comments, ...) raise
+UnsupportedDocument and are converted by udapi.
+"""
+import logging
+import re
+
+from . import diagnostics, stats
+from .fast_reader import RE_GLOBAL_ENTITY, RE_SENT_ID, UnsupportedDocument
+from .tag_lexer import CLOSE, OPEN, lex_mentions
+
+RE_TEXT = re.compile(r"^# text\s*=\s*(.*)")
+RE_NEWPARDOC = re.compile(r"^# (newpar|newdoc)(?:\s+id\s*=\s*(.+))?$")
+RE_JSON = re.compile(r"^# (doc_)?json_([^ =]+)\s*=\s*(.+)")
+RE_EMPTY_ORD = re.compile(r"^[1-9]\d*\.[1-9]$")
+
+CHARS_FORBIDDEN_IN_ID = "-=| \t()"
+
+logger = logging.getLogger()
+
+
+class _Empty:
+    """Empty node, `deps` is a list of (parent ord, deprel) with non-empty parents."""
+
+    __slots__ = ("ord", "form", "lemma", "upos", "xpos", "feats", "deps")
+
+    def __init__(self, ord, form=None, lemma=None, upos=None, xpos=None, feats=None, deps=None):
+        self.ord = ord
+        self.form = form
+        self.lemma = lemma
+        self.upos = upos
+        self.xpos = xpos
+        self.feats = feats
+        self.deps = deps
+
+
+class _Sentence:
+    """
+    One skeleton sentence. `comment` holds the comments with udapi placeholders,
+    `words` the CoNLL-U fields of the regular words and `mwts` the fields of
+    the multiword tokens with their ranges.
+    """
+
+    __slots__ = ("comment", "sent_id", "text", "newdoc", "newpar", "words", "parents", "eparents", "empties",
+                 "mwts")
+
+    def __init__(self):
+        self.comment = ""
+        self.sent_id = None
+        self.text = None
+        self.newdoc = None
+        self.newpar = None
+        self.words = []
+        self.parents = [None]
+        self.eparents = [None]
+        self.empties = []
+        self.mwts = []
+
+
+def _parse_deps(raw_deps, words_count):
+    """Parses DEPS with non-empty parents, which must be already sorted like udapi sorts them."""
+    deps = []
+    for dep in raw_deps.split("|"):
+        head, _, deprel = dep.partition(":")
+        if not head.isdigit() or str(int(head)) != head or int(head) > words_count or not deprel:
+            raise UnsupportedDocument(f"unsupported DEPS {raw_deps}")
+        deps.append((int(head), deprel))
+    if deps != sorted(set(deps)):
+        raise UnsupportedDocument(f"unsorted DEPS {raw_deps}")
+    return deps
+
+
+def _parse_sentence(block, block_idx):
+    sentence = _Sentence()
+    heads = []
+    raw_deps = []
+    empty_deps = []
+    for line in block:
+        if "\r" in line:
+            raise UnsupportedDocument("carriage return in the skeleton")
+        if line[0] == "#":
+            match = RE_SENT_ID.match(line)
+            if match:
+                sentence.sent_id = match.group(1)
+                sentence.comment += "$SENT_ID\n"
+                continue
+            match = RE_TEXT.match(line)
+            if match:
+                sentence.text = match.group(1)
+                sentence.comment += "$TEXT\n"
+                continue
+            match = RE_NEWPARDOC.match(line)
+            if match:
+                value = True if match.group(2) is None else match.group(2)
+                if match.group(1) == "newpar":
+                    sentence.newpar = value
+                    sentence.comment += "$NEWPAR\n"
+                else:
+                    sentence.newdoc = value
+                    sentence.comment += "$NEWDOC\n"
+                continue
+            if RE_JSON.match(line):
+                raise UnsupportedDocument("json comments")
+            if RE_GLOBAL_ENTITY.match(line):
+                if block_idx > 0:
+                    raise UnsupportedDocument("global.Entity inside the document")
+                sentence.comment += "$GLOBAL.ENTITY\n"
+                continue
+            sentence.comment += line[1:] + "\n"
+            continue
+
+        fields = line.split("\t")
+        if len(fields) != 10 or "" in fields:
+            raise UnsupportedDocument(f"unsupported columns in {line}")
+        if "-" in fields[0]:
+            start, _, end = fields[0].partition("-")
+            if not start.isdigit() or not end.isdigit() or str(int(start)) != start or str(int(end)) != end:
+                raise UnsupportedDocument(f"unsupported multiword token {fields[0]}")
+            sentence.mwts.append((int(start), int(end), fields))
+        elif "." in fields[0]:
+            if not RE_EMPTY_ORD.match(fields[0]) or fields[8] == "_" or "|" in fields[8]:
+                raise UnsupportedDocument(f"unsupported empty node {fields[0]}")
+            empty = _Empty(float(fields[0]), *fields[1:6])
+            if sentence.empties and sentence.empties[-1].ord >= empty.ord:
+                raise UnsupportedDocument("unsorted empty nodes")
+            sentence.empties.append(empty)
+            empty_deps.append(fields[8])
+        else:
+            if fields[0] != str(len(sentence.words) + 1) or not fields[6].isdigit() or fields[9] == "Empty=Yes":
+                raise UnsupportedDocument(f"unsupported word {fields[0]}")
+            sentence.words.append(fields)
+            heads.append(int(fields[6]))
+            raw_deps.append(fields[8])
+
+    words_count = len(sentence.words)
+    if not words_count or sentence.sent_id is None or "/" in sentence.sent_id or sentence.text is None:
+        raise UnsupportedDocument("sentence without words, sent_id or text")
+    for head in heads:
+        if head > words_count:
+            raise UnsupportedDocument("head out of range")
+        sentence.parents.append(head)
+    for node in range(1, words_count + 1):
+        # cycles are errors in udapi
+        climbing, steps = sentence.parents[node], 0
+        while climbing:
+            climbing, steps = sentence.parents[climbing], steps + 1
+            if steps > words_count:
+                raise UnsupportedDocument("cycle in the skeleton")
+    for node, deps in enumerate(raw_deps, 1):
+        if deps == "_":
+            sentence.eparents.append([sentence.parents[node]])
+        else:
+            sentence.eparents.append([parent for parent, _ in _parse_deps(deps, words_count)])
+    for empty, deps in zip(sentence.empties, empty_deps):
+        empty.deps = _parse_deps(deps, words_count)
+    last_end = 0
+    for start, end, fields in sentence.mwts:
+        if not last_end < start <= end <= words_count:
+            raise UnsupportedDocument("overlapping multiword tokens")
+        last_end = end
+        # udapi moves SpaceAfter=No of the last word to the multiword token
+        if "SpaceAfter=No" in sentence.words[end - 1][9].split("|"):
+            if fields[9] not in ("_", "SpaceAfter=No"):
+                raise UnsupportedDocument("SpaceAfter=No added to the MISC of a multiword token")
+            fields[9] = "SpaceAfter=No"
+    return sentence
+
+
+def parse_skeleton(blocks, global_entity):
+    """
+    Parses the sentence blocks of one skeleton document. Returns the sentences,
+    the document name and the global.Entity declaration valid for the document.
+    """
+    sentences = [_parse_sentence(block, block_idx) for block_idx, block in enumerate(blocks)]
+    for line in blocks[0]:
+        match = RE_GLOBAL_ENTITY.match(line)
+        if match:
+            global_entity = match.group(1)
+    docname = sentences[0].newdoc
+    if docname is None or docname is True:
+        raise UnsupportedDocument("document without a name")
+    return sentences, docname, global_entity
+
+
+def _create_empty(sentence, parent, deprel):
+    """The same as udapi Node.create_empty_child(deprel, after=True)."""
+    new_ord = parent + 0.1
+    for empty in sentence.empties:
+        if empty.ord > new_ord:
+            break
+        if empty.ord == new_ord:
+            if new_ord == parent + 0.9:
+                raise UnsupportedDocument("more than nine empty nodes after a word")
+            new_ord = round(new_ord + 0.1, 1)
+    new_empty = _Empty(new_ord, deps=[(parent, deprel)])
+    sentence.empties.append(new_empty)
+    if len(sentence.empties) > 1 and new_ord <= sentence.empties[-2].ord:
+        sentence.empties.sort(key=lambda empty: empty.ord)
+    return new_empty
+
+
+def _remove_empty(sentence, node):
+    """The same as convert.remove_empty_node (no DEPS point to empty nodes here)."""
+    for empty in sentence.empties:
+        if node.ord < empty.ord < node.ord + 1:
+            empty.ord = round(empty.ord - 0.1, 1)
+    sentence.empties.remove(node)
+
+
+def _recreate_empty(sentence, node):
+    """The same as convert.shift_empty_node_recreate."""
+    parent, deprel = node.deps[0]
+    if int(node.ord) == parent:
+        return
+    if parent == 0:
+        raise UnsupportedDocument("empty node attached to the root")
+    new_empty = _create_empty(sentence, parent, deprel)
+    new_empty.form = node.form
+    new_empty.lemma = node.lemma
+    new_empty.deps = node.deps
+    _remove_empty(sentence, node)
+
+
+def _prepare_words(sentences, words, use_gold_empty_nodes):
+    """
+    Replays the removal or the shifting of the empty nodes and returns the document
+    words in udapi order as (sentence index, node) pairs, where node is the ord
+    of a regular word or an _Empty.
+    """
+    for sentence in sentences:
+        for empty in list(sentence.empties):
+            if use_gold_empty_nodes:
+                _recreate_empty(sentence, empty)
+            else:
+                _remove_empty(sentence, empty)
+    if not use_gold_empty_nodes:
+        j = 1
+        for sentence in sentences:
+            for word_ord in range(1, len(sentence.words) + 1):
+                while j < len(words) and words[j].startswith("##"):
+                    _create_empty(sentence, word_ord, "_")
+                    j += 1
+                j += 1
+    doc_words = []
+    for sentence_idx, sentence in enumerate(sentences):
+        nodes = [(word_ord, word_ord) for word_ord in range(1, len(sentence.words) + 1)]
+        nodes += [(empty.ord, empty) for empty in sentence.empties]
+        nodes.sort(key=lambda node: node[0])
+        doc_words.extend((sentence_idx, node) for _, node in nodes)
+    return doc_words
+
+
+def _form(sentences, word):
+    sentence_idx, node = word
+    if isinstance(node, _Empty):
+        return node.form
+    return sentences[sentence_idx].words[node - 1][1]
+
+
+def _check_words(sentences, docname, doc_words, predicted):
+    """The same checks and warnings as the udapi engine, `predicted` are the forms of the prediction."""
+    forms = [_form(sentences, word) for word in doc_words]
+    if len(forms) != len(predicted):
+        # the udapi engine fails on an assertion, let it report the document
+        raise UnsupportedDocument("different number of words")
+    for i in range(len(forms)):
+        if forms[i] != predicted[i]:
+            diagnostics.report("word_mismatches", "Words do not match in %s: %s != %s at %d", docname, predicted[i],
+                               forms[i], i)
+    return forms
+
+
+def _text_mentions(docname, forms, predicted, events):
+    """
+    Mentions (eid, first word, last word) in the order convert_text_to_conllu creates them, and all eids.
+    `events` are the mention tags of the line from `tag_lexer.lex_mentions`.
+    """
+    mention_starts = {}
+    mentions = []
+    events = iter(events)
+    event = next(events, None)
+    for i in range(len(forms)):
+        while event is not None and event[0] == i:
+            _, eid, kind = event
+            event = next(events, None)
+            if eid not in mention_starts:
+                if any(x in eid for x in CHARS_FORBIDDEN_IN_ID):
+                    raise UnsupportedDocument(f"forbidden characters in {eid}")
+                mention_starts[eid] = []
+            if kind & OPEN:
+                mention_starts[eid].append(i)
+            if kind & CLOSE:
+                if not mention_starts[eid]:
+                    diagnostics.report("unopened_mentions", "Closing mention which was not opened in %s: %s", docname,
+                                       eid)
+                    continue
+                mentions.append((eid, mention_starts[eid][-1], i))
+                mention_starts[eid].pop()
+    return mentions, list(mention_starts)
+
+
+def _json_mentions(doc):
+    """Mentions (eid, first word, last word) in the order convert_json_to_conllu creates them, and all eids."""
+    mentions = []
+    eids = []
+    for entity in doc["clusters_token_offsets"]:
+        eid = f"e{len(eids) + 1}"
+        eids.append(eid)
+        for mention_offsets in entity:
+            mentions.append((eid, mention_offsets[0], mention_offsets[1]))
+    return mentions, eids
+
+
+def _minimal_common_treelet_root(nodes, parents):
+    """udapi.core.node.find_minimal_common_treelet for the ords of regular words (0 is the root)."""
+    sure = -1
+    nodes = list(nodes)
+    in_treelet = {node: sure for node in nodes}
+    new_nodes = {}
+    highest = None
+    while len(nodes) > 1:
+        node = nodes.pop(0)
+        parent = parents[node]
+        if parent is None:
+            highest = node
+        elif in_treelet.get(parent, False):
+            in_treelet[parent] = sure
+        else:
+            new_nodes[parent] = parent
+            in_treelet[parent] = node
+            nodes.append(parent)
+    highest = nodes[0] if highest is None else highest
+    child = in_treelet[highest]
+    while child != sure:
+        del new_nodes[highest]
+        highest = child
+        child = in_treelet[highest]
+    return highest
+
+
+def _find_head(sentence, nodes):
+    """The head chosen by corefud.MoveHead for a mention of `nodes` (its first node is the current head)."""
+    mwords = set(nodes)
+
+    def eparents(node):
+        if isinstance(node, _Empty):
+            return [parent for parent, _ in node.deps]
+        return sentence.eparents[node]
+
+    basic_heads = [w for w in nodes if isinstance(w, _Empty) or sentence.parents[w] not in mwords]
+    if len(basic_heads) == 1:
+        return basic_heads[0]
+    enh_heads = [w for w in basic_heads if not any(p in mwords for p in eparents(w))]
+    if not enh_heads:
+        enh_heads = [w for w in basic_heads if not all(p in mwords for p in eparents(w))]
+        if not enh_heads:
+            return nodes[0]
+    if len(enh_heads) == 1:
+        return enh_heads[0]
+
+    empty_nodes, non_empty = [], []
+    for w in enh_heads:
+        (empty_nodes if isinstance(w, _Empty) else non_empty).append(w)
+    if empty_nodes:
+        for empty_node in empty_nodes:
+            # parents of empty nodes are never empty here
+            parent = empty_node.deps[0][0]
+            if parent not in non_empty:
+                non_empty.append(parent)
+        non_empty.sort()
+
+    highest = _minimal_common_treelet_root(non_empty, sentence.parents)
+    if highest in enh_heads:
+        return highest
+    if nodes[0] in enh_heads:
+        return nodes[0]
+    return enh_heads[0]
+
+
+def _entity_attributes(sentences, doc_words, mentions, global_entity):
+    """Entity attribute of every word, the same as udapi.core.coref.store_coref_to_misc after corefud.MoveHead."""
+    fields = global_entity.split("-")
+    if "GRP" in fields:
+        raise UnsupportedDocument("GRP in global.Entity")
+    doc_mentions = []
+    for eid, start, end in mentions:
+        if not 0 <= start <= end < len(doc_words) or doc_words[start][0] != doc_words[end][0]:
+            raise UnsupportedDocument("mention across sentences")
+        sentence = sentences[doc_words[start][0]]
+        nodes = [node for _, node in doc_words[start:end + 1]]
+        head = 1 if len(nodes) == 1 else nodes.index(_find_head(sentence, nodes)) + 1
+        doc_mentions.append((start, end, eid, head))
+    # udapi orders mentions by the first word, longer mentions first, then by eid
+    doc_mentions.sort(key=lambda mention: (mention[0], -mention[1], mention[2]))
+
+    entity = [""] * len(doc_words)
+    for start, end, eid, head in doc_mentions:
+        values = []
+        for field in fields:
+            if field == "eid":
+                values.append(eid)
+            elif field == "head":
+                values.append(str(head))
+            else:
+                values.append("")
+        while values and values[-1] == "":
+            del values[-1]
+        mention_str = "(" + "-".join(values)
+        if start == end:
+            orig_entity = entity[start]
+            if not orig_entity or orig_entity[-1] != ")":
+                entity[start] += mention_str + ")"
+            elif "(" not in orig_entity:
+                entity[start] = mention_str + ")" + orig_entity
+            elif any(c and c[0] == "(" and c[-1] != ")" for c in re.split(r"(\([^()]+\)?|[^()]+\))", orig_entity)):
+                entity[start] += mention_str + ")"
+            else:
+                entity[start] = mention_str + ")" + orig_entity
+        else:
+            entity[start] += mention_str
+            entity[end] = eid + ")" + entity[end]
+    return entity
+
+
+def _comment_lines(sentence, newdoc, global_entity):
+    """The comment lines as printed by udapi write.Conllu."""
+    out = []
+    comment_lines = sentence.comment.splitlines()
+    i_newdoc, i_newpar, i_sent_id, i_global_entity = -1, -1, -1, -1
+    for i, c_line in enumerate(comment_lines):
+        if c_line == "$SENT_ID":
+            i_sent_id = i
+            comment_lines[i] = " sent_id = " + sentence.sent_id
+        elif c_line == "$TEXT":
+            comment_lines[i] = " text = " + sentence.text.replace("\n", "").replace("\r", "").rstrip()
+        elif c_line == "$NEWDOC":
+            i_newdoc = i
+            comment_lines[i] = " newdoc" + (" id = " + newdoc if newdoc is not True else "") if newdoc else None
+        elif c_line == "$NEWPAR":
+            i_newpar = i
+            newpar = sentence.newpar
+            comment_lines[i] = " newpar" + (" id = " + newpar if newpar is not True else "") if newpar else None
+        elif c_line == "$GLOBAL.ENTITY":
+            i_global_entity = i
+            comment_lines[i] = " global.Entity = " + global_entity if global_entity else None
+
+    def print_until(index):
+        nonlocal printed_i
+        while printed_i < index:
+            printed_i += 1
+            if comment_lines[printed_i]:
+                out.append("#" + comment_lines[printed_i])
+
+    printed_i = -1
+    if comment_lines:
+        if comment_lines[0] is None:
+            raise UnsupportedDocument("unexpected first comment")
+        if comment_lines[0].startswith(" global.columns"):
+            printed_i += 1
+            out.append("#" + comment_lines[printed_i])
+    if newdoc:
+        if i_newdoc == -1:
+            out.append("# newdoc" + (" id = " + newdoc if newdoc is not True else ""))
+        else:
+            print_until(i_newdoc)
+        if global_entity:
+            if i_global_entity == -1:
+                out.append("# global.Entity = " + global_entity)
+            else:
+                print_until(i_global_entity)
+    if sentence.newpar:
+        if i_newpar == -1:
+            newpar = sentence.newpar
+            out.append("# newpar" + (" id = " + newpar if newpar is not True else ""))
+        else:
+            print_until(i_newpar)
+    print_until(i_sent_id)
+    for c_line in comment_lines[printed_i + 1:]:
+        if c_line:
+            out.append("#" + c_line)
+    return out
+
+
+def _write_document(sentences, doc_words, entity, global_entity, newdoc):
+    """CoNLL-U lines of the document as printed by udapi write.Conllu."""
+    out = []
+    position = 0
+    for sentence_idx, sentence in enumerate(sentences):
+        out.extend(_comment_lines(sentence, newdoc if sentence_idx == 0 else sentence.newdoc, global_entity))
+        mwts = {word_ord: mwt for mwt in sentence.mwts for word_ord in range(mwt[0], mwt[1] + 1)}
+        last_mwt_id = 0
+        while position < len(doc_words) and doc_words[position][0] == sentence_idx:
+            node = doc_words[position][1]
+            misc = "Entity=" + entity[position] if entity[position] else "_"
+            position += 1
+            if isinstance(node, _Empty):
+                out.append("\t".join((str(node.ord), node.form or "_", node.lemma or "_", node.upos or "_",
+                                      node.xpos or "_", node.feats or "_", "_", "_",
+                                      "|".join(f"{p}:{r}" for p, r in node.deps), misc)))
+                continue
+            if node in mwts and node > last_mwt_id:
+                start, end, fields = mwts[node]
+                out.append("\t".join((f"{start}-{end}", fields[1], "_\t_\t_", fields[5], "_\t_\t_", fields[9])))
+                last_mwt_id = end
+            fields = sentence.words[node - 1]
+            out.append("\t".join(fields[:6] + [str(sentence.parents[node])] + fields[7:9] + [misc]))
+        out.append("")
+    return "\n".join(out) + "\n"
+
+
+def _merge(blocks, global_entity, predicted, use_gold_empty_nodes, get_mentions):
+    sentences, docname, global_entity = parse_skeleton(blocks, global_entity)
+    doc_words = _prepare_words(sentences, predicted, use_gold_empty_nodes)
+    forms = _check_words(sentences, docname, doc_words, predicted)
+    stats.annotate(docname=docname, tokens=len(doc_words))
+    diagnostics.name(docname)
+    mentions, eids = get_mentions(docname, forms)
+    entity = [""] * len(doc_words)
+    if eids:
+        global_entity = global_entity or "eid-etype-head-other"
+        entity = _entity_attributes(sentences, doc_words, mentions, global_entity)
+    return _write_document(sentences, doc_words, entity, global_entity, sentences[0].newdoc)
+
+
+def merge_text_document(text, blocks, global_entity, use_gold_empty_nodes=True):
+    """
+    Merges one line of the text format into the skeleton document given as sentence
+    blocks from `fast_reader.iter_document_blocks` and returns its CoNLL-U.
+    """
+    predicted, events = lex_mentions(text.split(" "))
+    return _merge(blocks, global_entity, predicted, use_gold_empty_nodes,
+                  lambda docname, forms: _text_mentions(docname, forms, predicted, events))
+
+
+def merge_json_document(doc, blocks, global_entity, use_gold_empty_nodes=True):
+    """The same as merge_text_document for one document of the JSON format."""
+    predicted = [word.split("|")[0] for word in doc["tokens"]]
+    return _merge(blocks, global_entity, predicted, use_gold_empty_nodes,
+                  lambda docname, forms: _json_mentions(doc))
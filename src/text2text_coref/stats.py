@@ -0,0 +1,194 @@
+"""
+Timing and metrics report of a run, written by the `--stats FILE` option.
+
+The statistics are kept in a process-wide collector created by `enable`. All the
+other functions do nothing while it is disabled, so the pipelines report their
+stages and counts without passing the collector around:
+
+- `stage(name)` sums the wall and CPU time spent in a stage of the pipeline,
+- `document(**fields)` records one document, its time and everything counted
+  while it is processed,
+- `count(name, n)` adds to a counter of the run and of the current document,
+  `annotate(**fields)` sets fields of the current document.
+
+Worker processes start their own collector in `init_worker` and return it with
+their results (`take`), the parent adds it to its own (`merge`).
+"""
+import json
+import sys
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+
+_stats = None
+_NULL = nullcontext()
+
+
+class _Stats:
+    __slots__ = ["command", "stages", "counters", "documents", "current", "wall", "cpu"]
+
+    def __init__(self, command=None):
+        self.command = command
+        self.stages = defaultdict(lambda: [0.0, 0.0, 0])  # wall time, CPU time, calls
+        self.counters = defaultdict(int)
+        self.documents = []
+        self.current = None
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+
+class _Stage:
+    __slots__ = ["entry", "wall", "cpu"]
+
+    def __init__(self, entry):
+        self.entry = entry
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+
+    def __exit__(self, *exc):
+        self.entry[0] += time.perf_counter() - self.wall
+        self.entry[1] += time.process_time() - self.cpu
+        self.entry[2] += 1
+
+
+class _Document:
+    __slots__ = ["record", "outer", "wall"]
+
+    def __init__(self, fields):
+        self.record = fields
+
+    def __enter__(self):
+        _stats.documents.append(self.record)
+        self.outer = _stats.current
+        _stats.current = self.record
+        self.wall = time.perf_counter()
+        return self.record
+
+    def __exit__(self, *exc):
+        self.record["seconds"] = round(time.perf_counter() - self.wall, 6)
+        _stats.current = self.outer
+
+
+def enable(command=None):
+    """Starts collecting the statistics of the run."""
+    global _stats
+    _stats = _Stats(command)
+
+
+def enabled():
+    return _stats is not None
+
+
+def init_worker(enable_stats):
+    """Initializer of worker processes, the collector inherited from the parent is dropped."""
+    global _stats
+    _stats = _Stats() if enable_stats else None
+
+
+def stage(name):
+    """Context manager timing a stage of the pipeline."""
+    if _stats is None:
+        return _NULL
+    return _Stage(_stats.stages[name])
+
+
+def document(**fields):
+    """Context manager recording one document with the fields."""
+    if _stats is None:
+        return _NULL
+    return _Document(fields)
+
+
+def count(name, n=1):
+    if _stats is None:
+        return
+    _stats.counters[name] += n
+    if _stats.current is not None:
+        _stats.current[name] = _stats.current.get(name, 0) + n
+
+
+def annotate(**fields):
+    if _stats is not None and _stats.current is not None:
+        _stats.current.update(fields)
+
+
+def take():
+    """
+    Returns the statistics collected so far in this process and resets them, only the totals
+    of the diagnostics if disabled (None if there are none).
+    """
+    from . import diagnostics
+
+    issues = diagnostics.take()
+    if _stats is None:
+        return {"issues": issues} if issues else None
+    data = {"stages": dict(_stats.stages), "counters": dict(_stats.counters), "documents": _stats.documents,
+            "issues": issues}
+    _stats.stages.clear()
+    _stats.counters.clear()
+    _stats.documents = []
+    return data
+
+
+def merge(data):
+    """Adds the statistics from `take` of a worker process."""
+    if data is None:
+        return
+    from . import diagnostics
+
+    diagnostics.merge(data["issues"])
+    if _stats is None:
+        return
+    for name, (wall, cpu, calls) in data["stages"].items():
+        entry = _stats.stages[name]
+        entry[0] += wall
+        entry[1] += cpu
+        entry[2] += calls
+    for name, n in data["counters"].items():
+        _stats.counters[name] += n
+    _stats.documents.extend(data["documents"])
+
+
+def _peak_rss_mb():
+    """Peak resident set size of this process and the largest one of its finished children in MB."""
+    import resource
+
+    scale = 1024 ** 2 if sys.platform == "darwin" else 1024  # ru_maxrss is in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    # ru_maxrss of a new process starts at the peak of its parent on Linux, VmHWM does not
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+
+
+def report():
+    """The statistics of the run as a JSON-serializable dict."""
+    import resource
+
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    peak, peak_children = _peak_rss_mb()
+    return {
+        "command": _stats.command,
+        "wall_seconds": round(time.perf_counter() - _stats.wall, 6),
+        "cpu_seconds": round(time.process_time() - _stats.cpu + children.ru_utime + children.ru_stime, 6),
+        "peak_rss_mb": round(peak, 1),
+        "peak_rss_children_mb": round(peak_children, 1),
+        "stages": {
+            name: {"wall_seconds": round(wall, 6), "cpu_seconds": round(cpu, 6), "calls": calls}
+            for name, (wall, cpu, calls) in _stats.stages.items()
+        },
+        "counters": dict(_stats.counters),
+        "documents": [{"index": index, **record} for index, record in enumerate(_stats.documents)],
+    }
+
+
+def write(filename):
+    with open(filename, "w", encoding="utf-8") as f:
+        json.dump(report(), f, indent=2, ensure_ascii=False)
@@ -0,0 +1,70 @@
+"""
+Lexer of the mention tags of the text format, e.g. `Los|[e1 jugadores de el Espanyol|[e2],e1]`.
+
+A line (list of words) is turned in one pass into the word forms and a stream of events
+`(index, eid, kind)`: the index of the word, the entity id and the kind of the tag, OPEN
+(`[e1`), CLOSE (`e1]`) or SINGLETON (`[e1]`). The cleaner reads the tags strictly
+(`lex_entity_tags`), text2conllu keeps any eid found between the brackets (`lex_mentions`).
+"""
+import re
+
+from . import diagnostics
+
+OPEN = 1
+CLOSE = 2
+SINGLETON = OPEN | CLOSE
+
+# a tag of the cleaner, anything after it is ignored
+RE_ENTITY_TAG = re.compile(r"(\[?)e(\d+)(]?)")
+# mentions of text2conllu are separated by "," or "-"
+RE_MENTION = re.compile(r"[^,-]+")
+
+
+def tag_text(eid, kind):
+    """The tag of the event in the text format."""
+    return ("[" if kind & OPEN else "") + eid + ("]" if kind & CLOSE else "")
+
+
+def lex_entity_tags(words):
+    """
+    Lexes the words the way the cleaner reads them. Only tags `e` + number with at
+    least one bracket are kept. Words with more pipes lose all their tags. Returns
+    the forms and the events.
+    """
+    forms = []
+    events = []
+    for index, word in enumerate(words):
+        form, pipe, tags = word.partition("|")
+        forms.append(form)
+        if not pipe:
+            continue
+        if "|" in tags:
+            diagnostics.report("multiple_pipes", "Multiple pipes in word %s, stripping tags", word)
+            continue
+        for tag in tags.split(","):
+            match = RE_ENTITY_TAG.match(tag)
+            if not match or not (match[1] or match[3]):
+                diagnostics.report("invalid_tags", "Completely invalid tag in: %s", word)
+                continue
+            events.append((index, "e" + match[2], (OPEN if match[1] else 0) | (CLOSE if match[3] else 0)))
+    return forms, events
+
+
+def lex_mentions(words):
+    """
+    Lexes the words the way text2conllu reads them. Any text between the brackets
+    is an eid, the kind of the event is 0 for an eid without brackets (it only
+    declares the entity). Returns the forms and the events.
+    """
+    forms = []
+    events = []
+    for index, word in enumerate(words):
+        form, pipe, tags = word.partition("|")
+        forms.append(form)
+        if not pipe:
+            continue
+        for mention in RE_MENTION.findall(tags.partition("|")[0]):
+            eid = mention.replace("[", "").replace("]", "")
+            if eid:
+                events.append((index, eid, (OPEN if mention[0] == "[" else 0) | (CLOSE if mention[-1] == "]" else 0)))
+    return forms, events
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks"))
+
+
+@pytest.fixture(scope="session")
+def corpus(tmp_path_factory):
+    """
+    Directory with a synthetic corpus of `benchmarks/corpus.py` (empty nodes, nested and
+    discontinuous mentions): `gold.conllu`, `gold.txt`, `gold.json` and `noisy.txt`.
+    """
+    from corpus import generate
+
+    directory = tmp_path_factory.mktemp("corpus")
+    generate(str(directory), docs=12, sentences=6, words=12, discontinuous=0.05, empty_density=0.1)
+    return directory
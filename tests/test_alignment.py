@@ -0,0 +1,106 @@
+"""The banded edit distance of the cleaner (both engines) aligns like the full table."""
+import random
+from collections import defaultdict
+
+import pytest
+
+from text2text_coref import output_cleaner
+
+
+def full_table_alignment(words1, words2, tagged_words1, gold_zeros):
+    """The alignment of the full edit-distance table, as computed before the band."""
+    m, n = len(words1), len(words2)
+    dp = [[0] * (n + 1) for _ in range(m + 1)]
+    for i in range(m + 1):
+        dp[i][0] = i
+    for j in range(n + 1):
+        dp[0][j] = j
+    for i in range(1, m + 1):
+        for j in range(1, n + 1):
+            if not gold_zeros and words1[i - 1].startswith("##"):
+                dp[i][j] = dp[i - 1][j]
+            elif words1[i - 1] == words2[j - 1]:
+                dp[i][j] = dp[i - 1][j - 1]
+            else:
+                dp[i][j] = min(dp[i - 1][j], dp[i][j - 1], dp[i - 1][j - 1]) + 1
+
+    result = []
+    problems = defaultdict(int)
+    i, j = m, n
+    while i > 0 and j > 0:
+        if not gold_zeros and words1[i - 1].startswith("##"):
+            result.append(tagged_words1[i - 1])
+            i -= 1
+        elif words1[i - 1] == words2[j - 1]:
+            result.append(tagged_words1[i - 1])
+            i -= 1
+            j -= 1
+        elif dp[i][j] == dp[i - 1][j - 1] + 1:
+            result.append(words2[j - 1])
+            problems["replace"] += 1
+            i -= 1
+            j -= 1
+        elif dp[i][j] == dp[i - 1][j] + 1:
+            problems["delete"] += 1
+            i -= 1
+        else:
+            result.append(words2[j - 1])
+            problems["insert"] += 1
+            j -= 1
+    while j > 0:
+        result.append(words2[j - 1])
+        problems["insert"] += 1
+        j -= 1
+    result.reverse()
+    return result
+
+
+def _noisy(rng, words, vocabulary, noise):
+    out = []
+    for word in words:
+        x = rng.random()
+        if x >= noise:
+            out.append(word)
+        elif x < noise / 3:
+            out.append(rng.choice(vocabulary))
+        elif x < 2 * noise / 3:
+            out.extend([word, rng.choice(vocabulary)])
+    return out
+
+
+def _cases(count, seed=0):
+    rng = random.Random(seed)
+    for _ in range(count):
+        vocabulary = ["a", "b", "c", "d", "e", "##", "##x"][: rng.randint(2, 7)]
+        gold = [rng.choice(vocabulary) for _ in range(rng.randint(0, 80))]
+        if rng.random() < 0.25:
+            # unrelated documents, the band is widened up to the full table
+            predicted = [rng.choice(vocabulary) for _ in range(rng.randint(0, 80))]
+        else:
+            predicted = _noisy(rng, gold, vocabulary, rng.choice([0.0, 0.05, 0.3, 0.8]))
+        tagged = [f"{word}|[e{k}]" if word[0] != "#" else word for k, word in enumerate(predicted)]
+        yield predicted, gold, tagged, rng.random() < 0.5
+
+
+@pytest.fixture(params=[1, 4, output_cleaner._INITIAL_SLACK])
+def slack(request, monkeypatch):
+    # small bands are widened several times
+    monkeypatch.setattr(output_cleaner, "_INITIAL_SLACK", request.param)
+
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_band_matches_full_table(engine, slack):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    for predicted, gold, tagged, gold_zeros in _cases(300):
+        expected = full_table_alignment(predicted, gold, tagged, gold_zeros)
+        assert output_cleaner._word_level_edit_distance(predicted, gold, tagged, gold_zeros, engine) == expected
+
+
+def test_long_divergent_documents():
+    rng = random.Random(1)
+    vocabulary = [f"w{k}" for k in range(50)]
+    gold = [rng.choice(vocabulary) for _ in range(400)]
+    for predicted in (gold[:100], [rng.choice(vocabulary) for _ in range(400)], _noisy(rng, gold, vocabulary, 0.2)):
+        expected = full_table_alignment(predicted, gold, predicted, True)
+        assert output_cleaner._word_level_edit_distance(predicted, gold, predicted, True) == expected
@@ -0,0 +1,82 @@
+"""Documents split into overlapping chunks are cleaned and merged back into whole documents."""
+import random
+from collections import defaultdict
+
+import pytest
+
+from text2text_coref.chunking import metadata_filename
+from text2text_coref.convert import convert_conllu_file_to_text, convert_text_file_to_conllu
+from text2text_coref.output_cleaner import clean_file
+from text2text_coref.tag_lexer import CLOSE, OPEN, lex_mentions
+
+
+def _documents(filename):
+    """The forms, the mention spans and the entities (sets of spans) of every line."""
+    documents = []
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            forms, events = lex_mentions(line.rstrip("\n").split(" "))
+            opened = defaultdict(list)
+            entities = defaultdict(set)
+            for index, eid, kind in events:
+                if kind & OPEN:
+                    opened[eid].append(index)
+                if kind & CLOSE and opened[eid]:
+                    entities[eid].add((opened[eid].pop(), index))
+            spans = sorted(span for spans in entities.values() for span in spans)
+            documents.append((forms, spans, [frozenset(spans) for spans in entities.values()]))
+    return documents
+
+
+def _clean_chunks(corpus, tmp_path, max_tokens, overlap, noise=0.0):
+    gold = str(corpus / "gold.conllu")
+    chunks = str(tmp_path / f"chunks-{overlap}.txt")
+    convert_conllu_file_to_text(gold, chunks, zero_mentions=True, max_tokens=max_tokens, overlap=overlap)
+    with open(metadata_filename(chunks), encoding="utf-8") as f, open(corpus / "gold.txt", encoding="utf-8") as g:
+        # the documents are split
+        assert sum(1 for _ in f) > sum(1 for _ in g)
+    if noise:
+        from corpus import add_noise
+
+        rng = random.Random(0)
+        with open(chunks, encoding="utf-8") as f:
+            lines = [add_noise(line.rstrip("\n"), rng, noise) for line in f]
+        with open(chunks, "w", encoding="utf-8") as f:
+            f.writelines(line + "\n" for line in lines)
+    output = str(tmp_path / f"cleaned-{overlap}.txt")
+    clean_file(chunks, gold, output, chunks=metadata_filename(chunks))
+    return output
+
+
+@pytest.fixture
+def cleaned_full(corpus, tmp_path):
+    """The gold text cleaned as whole documents."""
+    convert_conllu_file_to_text(str(corpus / "gold.conllu"), str(tmp_path / "full.txt"), zero_mentions=True)
+    clean_file(str(tmp_path / "full.txt"), str(corpus / "gold.conllu"), str(tmp_path / "cleaned-full.txt"))
+    return _documents(tmp_path / "cleaned-full.txt")
+
+
+@pytest.mark.parametrize("max_tokens", [30, 60])
+def test_clean_chunks_with_overlap(corpus, tmp_path, cleaned_full, max_tokens):
+    entity_counts = {}
+    for overlap in (0, 1, 2):
+        merged = _documents(_clean_chunks(corpus, tmp_path, max_tokens, overlap))
+        assert len(merged) == len(cleaned_full)
+        entity_counts[overlap] = 0
+        for (forms, spans, entities), (full_forms, full_spans, full_entities) in zip(merged, cleaned_full):
+            # the same words and mentions, the entities of the chunks are parts of the whole ones
+            assert forms == full_forms
+            assert spans == full_spans
+            assert all(any(entity <= full_entity for full_entity in full_entities) for entity in entities)
+            entity_counts[overlap] += len(entities)
+    # the overlap links the entities of consecutive chunks
+    assert entity_counts[1] < entity_counts[0]
+    assert entity_counts[2] <= entity_counts[1]
+
+
+def test_clean_noisy_chunks(corpus, tmp_path, cleaned_full):
+    output = _clean_chunks(corpus, tmp_path, 30, 1, noise=0.2)
+    # the documents have the gold words and can be merged into the skeleton
+    assert [forms for forms, _, _ in _documents(output)] == [forms for forms, _, _ in cleaned_full]
+    convert_text_file_to_conllu(output, str(corpus / "gold.conllu"), str(tmp_path / "cleaned.conllu"),
+                                zero_mentions=True)
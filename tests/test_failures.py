@@ -0,0 +1,34 @@
+"""A document which fails to clean is replaced by its gold words unless strict."""
+from itertools import chain
+
+import pytest
+
+from text2text_coref import diagnostics, output_cleaner
+from text2text_coref.output_cleaner import clean_data, read_conllu
+
+
+@pytest.fixture
+def failing(monkeypatch):
+    clean_document = output_cleaner._clean_document
+
+    def fail_marked(document, gold_tok2, *args, **kwargs):
+        if document.startswith("FAIL "):
+            raise AssertionError("broken document")
+        return clean_document(document, gold_tok2, *args, **kwargs)
+
+    monkeypatch.setattr(output_cleaner, "_clean_document", fail_marked)
+
+
+def test_failed_document_is_replaced(corpus, failing):
+    gold = read_conllu(str(corpus / "gold.conllu"), True)[:3]
+    with open(corpus / "gold.txt", encoding="utf-8") as f:
+        docs = [next(f).rstrip("\n") for _ in gold]
+    expected = clean_data(docs, gold, gold_zeros=True)
+    docs[1] = "FAIL " + docs[1]
+    diagnostics.reset()
+    clean = clean_data(docs, gold, gold_zeros=True)
+    assert diagnostics.take()["totals"]["failed_documents"] == 1
+    assert clean[0] == expected[0] and clean[2] == expected[2]
+    assert clean[1] == " ".join(chain(*gold[1]))
+    with pytest.raises(AssertionError):
+        clean_data(docs, gold, gold_zeros=True, strict=True)
@@ -0,0 +1,56 @@
+"""The built-in reader and writer produce the same files as udapi."""
+import pytest
+
+from text2text_coref.convert import convert_conllu_file_to_text, convert_text_file_to_conllu
+from text2text_coref.json_format import convert_conllu_file_to_json, convert_json_to_conllu
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("options", [dict(zero_mentions=True), dict(zero_mentions=False),
+                                     dict(zero_mentions=True, blind=True, sequential_ids=False)])
+def test_conllu2text_fast_reader(corpus, tmp_path, options):
+    convert_conllu_file_to_text(str(corpus / "gold.conllu"), str(tmp_path / "fast.txt"), **options)
+    convert_conllu_file_to_text(str(corpus / "gold.conllu"), str(tmp_path / "udapi.txt"), udapi_reader=True, **options)
+    assert _read(tmp_path / "fast.txt") == _read(tmp_path / "udapi.txt")
+
+
+@pytest.mark.parametrize("zero_mentions", [True, False])
+def test_conllu2json_fast_reader(corpus, tmp_path, zero_mentions):
+    convert_conllu_file_to_json(str(corpus / "gold.conllu"), str(tmp_path / "fast.json"), zero_mentions)
+    convert_conllu_file_to_json(str(corpus / "gold.conllu"), str(tmp_path / "udapi.json"), zero_mentions,
+                                udapi_reader=True)
+    assert _read(tmp_path / "fast.json") == _read(tmp_path / "udapi.json")
+
+
+def test_conllu2text_jobs(corpus, tmp_path):
+    convert_conllu_file_to_text(str(corpus / "gold.conllu"), str(tmp_path / "one.txt"), zero_mentions=True)
+    convert_conllu_file_to_text(str(corpus / "gold.conllu"), str(tmp_path / "two.txt"), zero_mentions=True, jobs=2)
+    assert _read(tmp_path / "one.txt") == _read(tmp_path / "two.txt")
+
+
+@pytest.mark.parametrize("text", ["gold.txt", "cleaned.txt"])
+def test_text2conllu_skeleton_merge(corpus, tmp_path, text):
+    if text == "cleaned.txt":
+        from text2text_coref.output_cleaner import clean_file
+
+        # the predictions with the mentions the cleaner could recover
+        clean_file(str(corpus / "noisy.txt"), str(corpus / "gold.conllu"), str(tmp_path / text))
+        text = tmp_path / text
+    else:
+        text = corpus / text
+    convert_text_file_to_conllu(str(text), str(corpus / "gold.conllu"), str(tmp_path / "fast.conllu"),
+                                zero_mentions=True)
+    convert_text_file_to_conllu(str(text), str(corpus / "gold.conllu"), str(tmp_path / "udapi.conllu"),
+                                zero_mentions=True, udapi_writer=True)
+    assert _read(tmp_path / "fast.conllu") == _read(tmp_path / "udapi.conllu")
+
+
+def test_json2conllu_skeleton_merge(corpus, tmp_path):
+    convert_json_to_conllu(str(corpus / "gold.json"), str(corpus / "gold.conllu"), str(tmp_path / "fast.conllu"))
+    convert_json_to_conllu(str(corpus / "gold.json"), str(corpus / "gold.conllu"), str(tmp_path / "udapi.conllu"),
+                           udapi_writer=True)
+    assert _read(tmp_path / "fast.conllu") == _read(tmp_path / "udapi.conllu")
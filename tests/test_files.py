@@ -0,0 +1,93 @@
+"""File formats and layouts: JSON Lines, shards and compressed files give the same outputs."""
+import json
+
+from text2text_coref.json_format import convert_conllu_file_to_json, convert_json_to_conllu
+
+
+def _read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_jsonl_equals_json(corpus, tmp_path):
+    convert_conllu_file_to_json(str(corpus / "gold.conllu"), str(tmp_path / "out.json"), True)
+    convert_conllu_file_to_json(str(corpus / "gold.conllu"), str(tmp_path / "out.jsonl"), True, jsonl=True)
+    with open(tmp_path / "out.json", encoding="utf-8") as f:
+        documents = json.load(f)
+    with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == documents
+
+    convert_json_to_conllu(str(tmp_path / "out.json"), str(corpus / "gold.conllu"), str(tmp_path / "json.conllu"))
+    convert_json_to_conllu(str(tmp_path / "out.jsonl"), str(corpus / "gold.conllu"), str(tmp_path / "jsonl.conllu"),
+                           jsonl=True)
+    assert _read(tmp_path / "json.conllu") == _read(tmp_path / "jsonl.conllu")
+
+
+def test_shard_merge_round_trip(corpus, tmp_path):
+    from text2text_coref.convert import convert_conllu_file_to_text, convert_text_file_to_conllu
+    from text2text_coref.doc_index import merge_files
+    from text2text_coref.output_cleaner import clean_file
+
+    gold = str(corpus / "gold.conllu")
+    convert_conllu_file_to_text(gold, str(tmp_path / "full.txt"), zero_mentions=True)
+    convert_conllu_file_to_json(gold, str(tmp_path / "full.json"), True)
+    convert_text_file_to_conllu(str(tmp_path / "full.txt"), gold, str(tmp_path / "full.conllu"), zero_mentions=True)
+    clean_file(str(corpus / "noisy.txt"), gold, str(tmp_path / "full-cleaned.txt"))
+
+    count = 3
+    shards = range(1, count + 1)
+    with open(corpus / "noisy.txt", encoding="utf-8") as f:
+        noisy = f.readlines()
+    for index in shards:
+        shard = (index, count)
+        convert_conllu_file_to_text(gold, str(tmp_path / f"{index}.txt"), zero_mentions=True, shard=shard)
+        convert_conllu_file_to_json(gold, str(tmp_path / f"{index}.json"), True, shard=shard)
+        convert_text_file_to_conllu(str(tmp_path / f"{index}.txt"), gold, str(tmp_path / f"{index}.conllu"),
+                                    zero_mentions=True, shard=shard)
+
+    # the predictions of a shard are the lines of its documents
+    with open(tmp_path / "full.txt", encoding="utf-8") as f:
+        documents = sum(1 for _ in f)
+    start = 0
+    for index in shards:
+        with open(tmp_path / f"{index}.txt", encoding="utf-8") as f:
+            size = sum(1 for _ in f)
+        with open(tmp_path / f"{index}-noisy.txt", "w", encoding="utf-8") as f:
+            f.writelines(noisy[start:start + size])
+        start += size
+        clean_file(str(tmp_path / f"{index}-noisy.txt"), gold, str(tmp_path / f"{index}-cleaned.txt"),
+                   shard=(index, count))
+    assert start == documents
+
+    for suffix in (".txt", ".json", ".conllu", "-cleaned.txt"):
+        merge_files([str(tmp_path / f"{index}{suffix}") for index in shards], str(tmp_path / f"merged{suffix}"))
+        assert _read(tmp_path / f"merged{suffix}") == _read(tmp_path / f"full{suffix}")
+
+
+def test_gzip_round_trip(corpus, tmp_path):
+    import gzip
+    import shutil
+
+    from text2text_coref.convert import convert_conllu_file_to_text, convert_text_file_to_conllu
+    from text2text_coref.output_cleaner import clean_file
+
+    for name in ("gold.conllu", "noisy.txt"):
+        with open(corpus / name, "rb") as f, gzip.open(tmp_path / f"{name}.gz", "wb") as out:
+            shutil.copyfileobj(f, out)
+    # a compressed file without the suffix is recognized by its magic bytes
+    shutil.copy(tmp_path / "noisy.txt.gz", tmp_path / "noisy-gz.txt")
+
+    gold = str(corpus / "gold.conllu")
+    convert_conllu_file_to_text(gold, str(tmp_path / "plain.txt"), zero_mentions=True)
+    convert_conllu_file_to_text(str(tmp_path / "gold.conllu.gz"), str(tmp_path / "out.txt.gz"), zero_mentions=True)
+    convert_text_file_to_conllu(str(tmp_path / "plain.txt"), gold, str(tmp_path / "plain.conllu"), zero_mentions=True)
+    convert_text_file_to_conllu(str(tmp_path / "out.txt.gz"), str(tmp_path / "gold.conllu.gz"),
+                                str(tmp_path / "out.conllu.gz"), zero_mentions=True)
+    clean_file(str(corpus / "noisy.txt"), gold, str(tmp_path / "plain-cleaned.txt"))
+    clean_file(str(tmp_path / "noisy-gz.txt"), str(tmp_path / "gold.conllu.gz"), str(tmp_path / "out-cleaned.txt.gz"))
+
+    for plain, compressed in (("plain.txt", "out.txt.gz"), ("plain.conllu", "out.conllu.gz"),
+                              ("plain-cleaned.txt", "out-cleaned.txt.gz")):
+        assert _read(tmp_path / compressed)[:2] == b"\x1f\x8b"
+        with gzip.open(tmp_path / compressed, "rb") as f:
+            assert f.read() == _read(tmp_path / plain)
@@ -0,0 +1,47 @@
+"""The `clean` command imports neither udapi nor the conversion modules."""
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+CLEAN_IMPORTS = """
+import json, logging, sys
+from text2text_coref.__main__ import parse_args
+sys.argv = ["text2text_coref", "clean", "in.txt", "gold.conllu"]
+parse_args()
+from text2text_coref import clean_file
+print(json.dumps({"modules": sorted(sys.modules), "filters": len(logging.getLogger().filters)}))
+"""
+
+# generous, the imports of the clean path take a few milliseconds
+BUDGET_SECONDS = 0.5
+
+
+def _run(*args):
+    env = {**os.environ, "PYTHONPATH": SRC}
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, check=True, env=env)
+
+
+def test_clean_does_not_import_conversion():
+    result = json.loads(_run("-c", CLEAN_IMPORTS).stdout)
+    modules = set(result["modules"])
+    assert "text2text_coref.output_cleaner" in modules
+    for module in ("udapi", "compact_json", "text2text_coref.convert", "text2text_coref.json_format"):
+        assert module not in modules
+
+
+def test_import_has_no_side_effects():
+    # the filter of diagnostics.quiet is installed on the root logger only while it is entered
+    result = json.loads(_run("-c", CLEAN_IMPORTS).stdout)
+    assert result["filters"] == 0
+
+
+def test_clean_import_time():
+    stderr = _run("-X", "importtime", "-c", CLEAN_IMPORTS).stderr
+    # "import time: self [us] | cumulative | imported package", nested imports are indented
+    cumulative = sum(int(line.split("|")[1]) for line in stderr.splitlines()
+                     if line.startswith("import time:") and line.split("|")[2].strip().startswith("text2text_coref")
+                     and not line.split("|")[2].startswith("  "))
+    assert cumulative / 1e6 < BUDGET_SECONDS